@@ -58,6 +58,7 @@ from aps.common.measurment.beamline.image_collector import ImageCollector
 from aps.ai.autoalignment.common.measurement.image_processor import ImageProcessor
 from aps.ai.autoalignment.common.facade.parameters import DistanceUnits, Movement, AngularUnits
 from aps.ai.autoalignment.common.hardware.epics.focusing_optics import AbstractEpicsOptics
+from aps.ai.autoalignment.common.hardware.epics.watchdog import OperationType
 from aps.ai.autoalignment.beamline28IDB.facade.focusing_optics_interface import AbstractFocusingOptics, DISTANCE_V_MOTORS
 
 
@@ -111,7 +112,14 @@ class Motors:
 class __EpicsFocusingOptics(AbstractEpicsOptics, AbstractFocusingOptics):
 
     def __init__(self, **kwargs):
-        super().__init__(translational_units=DistanceUnits.MILLIMETERS, angular_units=AngularUnits.DEGREES)
+        try:    move_planner = kwargs["move_planner"] # approach direction/backlash of the motors (keys: PV names)
+        except: move_planner = None
+        try:    watchdog = kwargs["watchdog"] # timing budgets and retries of the hardware operations
+        except: watchdog = None
+        try:    position_cache = kwargs["position_cache"] # monitored positions of the motors
+        except: position_cache = None
+
+        super().__init__(translational_units=DistanceUnits.MILLIMETERS, angular_units=AngularUnits.DEGREES, move_planner=move_planner, watchdog=watchdog, position_cache=position_cache)
 
         try:    measurement_directory = kwargs["measurement_directory"]
         except: measurement_directory = os.curdir
@@ -142,7 +150,10 @@ class __EpicsFocusingOptics(AbstractEpicsOptics, AbstractFocusingOptics):
         except: pass
 
         try:
-            self.__image_collector.collect_single_shot_image(index=1)
+            self.watchdog.run("image collector", OperationType.IMAGE_ACQUISITION,
+                              function=lambda: self.__image_collector.collect_single_shot_image(index=1),
+                              recovery=self.__reset_image_collector,
+                              threaded=True) # the acquisition blocks until the camera is done
 
             image, h_coord, v_coord = self.__image_processor.get_image_data(image_index=1)
 
@@ -211,6 +222,12 @@ class __EpicsFocusingOptics(AbstractEpicsOptics, AbstractFocusingOptics):
 
             raise e
 
+    def __reset_image_collector(self):
+        try:    self.__image_collector.end_collection()
+        except: pass
+        try:    self.__image_collector.restore_status()
+        except: pass
+
     def initialize(self, **kwargs):
         pass
 
@@ -219,15 +236,22 @@ class __EpicsFocusingOptics(AbstractEpicsOptics, AbstractFocusingOptics):
 
     def move_v_bimorph_mirror_motor_bender(self, actuator_value, movement=Movement.ABSOLUTE):
         if movement == Movement.ABSOLUTE:
-            Motors.BENDER_V.put(actuator_value)
+            target = actuator_value
         elif movement == Movement.RELATIVE:
-            Motors.BENDER_V.put(Motors.BENDER_V.get() + actuator_value)
+            target = self._get_position(Motors.BENDER_V) + actuator_value
         else:
             raise ValueError("Movement not recognized")
-        time.sleep(2)
+
+        try:
+            for setpoint in self._plan_move(Motors.BENDER_V, target): # hysteresis of the bimorph: approach direction
+                Motors.BENDER_V.put(setpoint)
+                time.sleep(2)
+        except:
+            self.move_planner.reset(Motors.BENDER_V.pvname)
+            raise
 
     def get_v_bimorph_mirror_motor_bender(self):
-        return Motors.BENDER_V.get()
+        return self._get_position(Motors.BENDER_V)
 
     def move_v_bimorph_mirror_motor_pitch(self, angle, movement=Movement.ABSOLUTE, units=AngularUnits.DEGREES):
         if units == AngularUnits.MILLIRADIANS:
@@ -291,7 +315,7 @@ class __EpicsFocusingOptics(AbstractEpicsOptics, AbstractFocusingOptics):
                                                    pos=pos_upstream, movement=movement)
 
     def get_h_bendable_mirror_motor_1_bender(self):
-        return Motors.BENDER_H_1.get()
+        return self._get_position(Motors.BENDER_H_1)
 
     def move_h_bendable_mirror_motor_2_bender(self, pos_downstream, movement=Movement.ABSOLUTE):
         self.__move_h_bendable_mirror_motor_bender(motor=Motors.BENDER_H_2,
@@ -300,7 +324,7 @@ class __EpicsFocusingOptics(AbstractEpicsOptics, AbstractFocusingOptics):
                                                    pos=pos_downstream, movement=movement)
 
     def get_h_bendable_mirror_motor_2_bender(self):
-        return Motors.BENDER_H_2.get()
+        return self._get_position(Motors.BENDER_H_2)
 
     def move_h_bendable_mirror_motor_pitch(self, angle, movement=Movement.ABSOLUTE, units=AngularUnits.DEGREES):
         self._move_rotational_motor(Motors.PITCH_H, angle, movement, units)
@@ -315,20 +339,33 @@ class __EpicsFocusingOptics(AbstractEpicsOptics, AbstractFocusingOptics):
         return self._get_translational_motor_position(Motors.TRANSLATION_H, units)
 
     def __move_h_bendable_mirror_motor_bender(self, motor, feeback, readback, pos, movement=Movement.ABSOLUTE):
-        if movement == Movement.ABSOLUTE:   desired_position = pos
-        elif movement == Movement.RELATIVE: desired_position = motor.get() + pos
+        if movement == Movement.ABSOLUTE:   target = pos
+        elif movement == Movement.RELATIVE: target = self._get_position(motor) + pos
         else: raise ValueError("Movement not recognized")
 
-        feeback.put(1)  # set feedback on
-        motor.put(desired_position)
+        try:
+            setpoints = self._plan_move(motor, target) # approach direction/overshoot of the bender
+            for desired_position in setpoints: self.__wait_h_bendable_mirror_motor_bender(motor, feeback, readback, desired_position)
+        except:
+            self.move_planner.reset(motor.pvname)
+            raise
+
+        if self.move_planner.record_moves and len(setpoints) > 0: self._record_move(motor, setpoints[-1], readback_pv=readback)
+
+    def __wait_h_bendable_mirror_motor_bender(self, motor, feeback, readback, desired_position):
+        def move():
+            feeback.put(1)  # set feedback on
+            motor.put(desired_position)
+
+            n_consecutive_positive_check = [0]
+
+            # cycle until the readback is close enough to the desired position
+            def is_done():
+                if (numpy.abs(readback.get() - desired_position) <= self.__bender_threshold): n_consecutive_positive_check[0] += 1
+                else:                                                                         n_consecutive_positive_check[0] = 0
+
+                return n_consecutive_positive_check[0] >= self.__n_bender_threshold_check
 
-        n_consecutive_positive_check = 0
-        # cycle until the readback is close enough to the desired position
-        while (n_consecutive_positive_check < self.__n_bender_threshold_check):
-            if (numpy.abs(readback.get() - desired_position) <= self.__bender_threshold):
-                n_consecutive_positive_check += 1
-                # print("H Bender ok:" + str(n_consecutive_positive_check))
-            else:
-                n_consecutive_positive_check = 0
+            self.watchdog.wait_for(motor.pvname, OperationType.BENDER_MOVE, is_done=is_done, distance=lambda: numpy.abs(readback.get() - desired_position))
 
-            time.sleep(0.1)
+        self.watchdog.run(motor.pvname, OperationType.BENDER_MOVE, move)
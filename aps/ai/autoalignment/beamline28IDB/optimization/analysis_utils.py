@@ -11,6 +11,7 @@ from optuna.trial import FrozenTrial, TrialState
 
 from aps.ai.autoalignment.common.util.common import Histogram, calculate_projections_over_noise
 from aps.ai.autoalignment.common.util.gaussian_fit import calculate_2D_gaussian_fit
+from aps.ai.autoalignment.common.util.decision_engine import DecisionEngine
 from aps.ai.autoalignment.beamline28IDB.optimization.common import CalculationParameters
 
 
@@ -65,9 +66,13 @@ def load_histograms_from_files(n_steps: int, hists_dir: Union[str, Path], extens
 
 def select_nash_equil_trial_from_pareto_front(study: optuna.Study) -> Tuple[FrozenTrial, int, Sequence[int]]:
     """This identifies the nash equilibrium = the trial that dominates the most number of trials"""
-    n_dominated = calculate_dominated_trials(study.best_trials, study.trials, study.directions)
-    ix = np.argmax(n_dominated)
-    return study.best_trials[ix], ix, n_dominated
+    decision_engine = DecisionEngine(directions=study.directions)
+    decision_engine.update(study.trials)
+
+    best_trials = study.best_trials
+    n_dominated = decision_engine.count_dominated(decision_engine.get_rows([t.number for t in best_trials]))
+    ix = int(np.argmax(n_dominated))
+    return best_trials[ix], ix, list(n_dominated)
 
 
 # The pareto front functions are adapted from "optuna/optuna/study/_multi_objective.py"
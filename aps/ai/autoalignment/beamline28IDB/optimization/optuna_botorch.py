@@ -51,7 +51,9 @@ from typing import Callable, Dict, List, NoReturn, Optional, Union, Tuple
 import numpy
 import numpy as np
 import optuna
-from optuna.trial import Trial
+from optuna.trial import Trial, FrozenTrial, TrialState
+from optuna.study import StudyDirection
+from optuna.distributions import FloatDistribution
 import joblib
 
 from aps.ai.autoalignment.beamline28IDB.facade.focusing_optics_factory import ExecutionMode
@@ -59,13 +61,25 @@ from aps.ai.autoalignment.beamline28IDB.facade.focusing_optics_interface import
 from aps.ai.autoalignment.beamline28IDB.optimization import configs
 from aps.ai.autoalignment.beamline28IDB.optimization.common import SelectionAlgorithm, OptimizationCriteria, CalculationParameters, \
     OptimizationCommon
-from aps.ai.autoalignment.beamline28IDB.optimization.analysis_utils import select_nash_equil_trial_from_pareto_front
+from aps.ai.autoalignment.common.hardware.epics.watchdog import HardwareAbortException, HARDWARE_FAILURE_ATTR
+from aps.ai.autoalignment.common.util.decision_engine import DecisionEngine
+from aps.ai.autoalignment.common.util.noise import get_seed_sequence
+from aps.ai.autoalignment.common.util.observation_noise import DEFAULT_N_REPLICATES, OBSERVATION_NOISE_ATTR
+from aps.ai.autoalignment.common.util.replicates import ReplicateScheduler
+from aps.ai.autoalignment.common.util.shadow.common import EarlyAbortException
+from aps.ai.autoalignment.common.util.travel import TravelTimeModel, get_default_travel_time_model, get_travel_order
+from aps.ai.autoalignment.common.util.wrappers import get_distribution_info as get_simulated_distribution_info
+from aps.ai.autoalignment.beamline28IDB.optimization.prior_knowledge import PriorModel, HistoricalPriorMean, DEFAULT_N_STARTUP_TRIALS_PRIOR
+from aps.ai.autoalignment.beamline28IDB.optimization.sensitivity import Sensitivity, compute_sensitivity
 from aps.ai.autoalignment.beamline28IDB.optimization.custom_botorch_integration import (
     BoTorchSampler,
+    get_common_random_numbers_likelihood,
     qehvi_candidates_func,
     qei_candidates_func,
     qnehvi_candidates_func,
     qnei_candidates_func,
+    TrustRegionSampler,
+    VariationalGPSurrogate,
 )
 class MooThresholds:
     CENTROID       = "centroid"
@@ -120,13 +134,20 @@ class OptunaOptimizer(OptimizationCommon):
         self.best_params = None
         self.motor_ranges = None
         self.study = None
+        self._decision_engine = None
         self._log_parameters_weight = log_parameters_weight
         self._constraints = None
         self._raise_prune_exception = None
         self._base_sampler = None
+        self._sampler_options = None
+        self._travel_time_model = None
         self._sum_intensity_threshold = None
         self._loss_fn_this = None
         self._use_discrete_space = None
+        self._progressive_tracing = False
+        self._pilot_fraction = None
+        self._early_abort_margin = None
+        self.sensitivity = None
         
         self._dump_directory = dump_directory if dump_directory is not None else os.path.join(os.curdir, "dump")
         if not os.path.exists(self._dump_directory): os.mkdir(self._dump_directory)
@@ -146,6 +167,18 @@ class OptunaOptimizer(OptimizationCommon):
         n_startup_trials: Optional[int] = None,
         botorch_model_mean_module: Optional[object] = None,
         botorch_model_covar_module: Optional[object] = None,
+        botorch_likelihood_factory: Optional[Callable] = None,
+        observation_noise_method: Optional[str] = None,
+        n_noise_replicates: int = DEFAULT_N_REPLICATES,
+        heteroscedastic_noise: bool = False,
+        botorch_variational_surrogate: Optional[VariationalGPSurrogate] = None,
+        travel_time_model: Optional[TravelTimeModel] = None,
+        travel_cost_weight: float = 0.0,
+        replicate_scheduler: Optional[ReplicateScheduler] = None,
+        prior_model: Optional[PriorModel] = None,
+        progressive_tracing: bool = False,
+        pilot_fraction: float = 0.1,
+        early_abort_margin: float = 0.5,
     ):
         self.motor_ranges = self._get_guess_ranges(motor_ranges)
 
@@ -167,6 +200,10 @@ class OptunaOptimizer(OptimizationCommon):
         # Setting up the constraints
         self._constraints = OptunaOptimizer._check_constraints(constraints)
 
+        # Motion time of the motors between trials (default: the travel is measured in fractions of the movement ranges)
+        if travel_time_model is None: travel_time_model = get_default_travel_time_model({mt: configs.DEFAULT_MOVEMENT_RANGES[mt] for mt in self.motor_types})
+        self._travel_time_model = travel_time_model
+
         # Initializing the sampler
         seed = self.cp.random_seed if botorch_seed is None else botorch_seed
         if base_sampler is None:
@@ -175,13 +212,37 @@ class OptunaOptimizer(OptimizationCommon):
                 sampler_extra_options["constraints_func"] = self._constraints_func
             if n_startup_trials is not None:
                 sampler_extra_options["n_startup_trials"] = n_startup_trials
+            if prior_model is not None:
+                sampler_extra_options["prior_mean_factory"] = self._get_prior_mean_factory(prior_model, directions_list)
+                if n_startup_trials is None: sampler_extra_options["n_startup_trials"] = DEFAULT_N_STARTUP_TRIALS_PRIOR
             sampler_extra_options["model_mean_module"] = botorch_model_mean_module
             sampler_extra_options["model_covar_module"] = botorch_model_covar_module
-            base_sampler = BoTorchSampler(candidates_func=acquisition_function, seed=seed, **sampler_extra_options)
+            # with common random numbers and without added noise the trials are (almost) noise-free
+            if botorch_likelihood_factory is None and self.cp.common_random_numbers and not self.cp.add_noise:
+                botorch_likelihood_factory = get_common_random_numbers_likelihood
+            sampler_extra_options["likelihood_factory"] = botorch_likelihood_factory
+            # per-trial standard errors of the objectives (ObservationNoiseMethods), used by a fixed-noise/heteroscedastic GP
+            if observation_noise_method is not None:
+                sampler_extra_options["observation_noise_attr"] = OBSERVATION_NOISE_ATTR
+                sampler_extra_options["heteroscedastic"] = heteroscedastic_noise
+            # sparse variational GP for long studies: bounded fit time per trial (replaces the exact GP after min_trials)
+            sampler_extra_options["variational_surrogate"] = botorch_variational_surrogate
+            # acquisition value discounted by the motion time from the current motor positions (cost-aware BO)
+            if travel_cost_weight > 0:
+                sampler_extra_options["travel_time_model"]  = travel_time_model
+                sampler_extra_options["travel_cost_weight"] = travel_cost_weight
+            self._sampler_options = dict(candidates_func=acquisition_function, seed=seed, **sampler_extra_options)
+            base_sampler = BoTorchSampler(**self._sampler_options)
         self._base_sampler = base_sampler
         self._raise_prune_exception = raise_prune_exception
+        self._observation_noise_method = observation_noise_method
+        self._n_noise_replicates = n_noise_replicates
+        self._replicate_scheduler = replicate_scheduler
 
         self.study = optuna.create_study(sampler=self._base_sampler, directions=directions_list)
+        self._decision_engine = DecisionEngine(directions=directions_list)
+        self.study.set_user_attr("common_random_numbers", self.cp.common_random_numbers)
+        if not self.sensitivity is None: self.study.set_user_attr("sensitivity", self.sensitivity.to_dictionary())
         self.study.enqueue_trial({mt: 0.0 for mt in self.motor_types})
 
         loss_fn_obj = self.TrialInstanceLossFunction(self, verbose=False)
@@ -189,8 +250,28 @@ class OptunaOptimizer(OptimizationCommon):
         self._sum_intensity_threshold = sum_intensity_threshold
         self._use_discrete_space = use_discrete_space
 
+        # Progressive ray-tracing (simulation only): a pilot fraction of the rays is traced first, and the
+        # trial is stopped if the pilot beam misses the detector or its intensity, scaled to the full beam,
+        # is below early_abort_margin * sum_intensity_threshold
+        self._progressive_tracing = progressive_tracing and self.cp.execution_mode == ExecutionMode.SIMULATION
+        self._pilot_fraction      = pilot_fraction
+        self._early_abort_margin  = early_abort_margin
+
         self.best_params = {k: 0.0 for k in self.motor_types}
 
+    def _get_prior_mean_factory(self, prior_model: PriorModel, directions_list: List) -> Callable:
+        if prior_model.loss_parameters != self.loss_parameters: raise ValueError("Prior model has different loss parameters")
+        if not set(prior_model.motor_types).issubset(self.motor_types): raise ValueError("Prior model has motors not in the optimization")
+
+        origin_positions = dict(zip(self.motor_types, self.initial_motor_positions))
+        signs            = [-1.0 if direction == "minimize" else 1.0 for direction in directions_list]
+
+        # best_params are the fixed values of the motors not in the search space (see trials)
+        def prior_mean_factory(parameter_names, bounds, n_outputs):
+            return HistoricalPriorMean(prior_model, parameter_names, bounds, origin_positions, self.best_params, signs, n_outputs)
+
+        return prior_mean_factory
+
     def _check_directions(self, directions: Dict) -> List:
         if directions is None: return ["minimize" for k in self.loss_parameters]
         directions_list = []
@@ -250,22 +331,122 @@ class OptunaOptimizer(OptimizationCommon):
             trial.set_user_attr(f"{constraint}_constraint", value)
 
 
+    def _early_abort_check(self, pilot_beam: object, pilot_fraction: float) -> bool:
+        hist, _ = get_simulated_distribution_info(implementor=self.cp.implementor,
+                                                  beam=pilot_beam,
+                                                  xrange=self.cp.xrange,
+                                                  yrange=self.cp.yrange,
+                                                  nbins_h=self.cp.nbins_h,
+                                                  nbins_v=self.cp.nbins_v,
+                                                  do_gaussian_fit=False)
+        sum_intensity = hist.data_2D.sum() / pilot_fraction
+
+        if sum_intensity == 0: return True # out of the detector
+        if self._sum_intensity_threshold is not None and sum_intensity < self._early_abort_margin * self._sum_intensity_threshold: return True
+
+        return False
+
     def _prune_trial(self, params):
         print("Pruning trial with parameters", params)
         raise optuna.TrialPruned
 
-    def _objective(self, trial: Trial, step_scale: float = 1):
-        current_params = []
+    def _get_distributions(self, step_scale: float = 1) -> Dict[str, FloatDistribution]:
+        distributions = {}
         for mot, r in zip(self.motor_types, self.motor_ranges):
             if self._use_discrete_space:
                 resolution = np.round(configs.DEFAULT_MOTOR_RESOLUTIONS[mot], 5)
                 r_low = np.round(r[0], 5)
                 r_high = ((r[1] - r[0]) // resolution) * resolution + r_low
-                current_params.append(trial.suggest_float(mot, r_low, r_high, step=resolution * step_scale))
+                distributions[mot] = FloatDistribution(r_low, r_high, step=resolution * step_scale)
             else:
-                current_params.append(trial.suggest_float(mot, r[0], r[1]))
+                distributions[mot] = FloatDistribution(r[0], r[1])
+
+        return distributions
 
-        loss = self._loss_fn_this(current_params)
+    @staticmethod
+    def _snap_to_distribution(value: float, distribution: FloatDistribution) -> Union[float, None]:
+        if distribution.step is not None: value = distribution.low + np.round((value - distribution.low) / distribution.step) * distribution.step
+        if value < distribution.low - 1e-12 or value > distribution.high + 1e-12: return None
+
+        return float(np.clip(value, distribution.low, distribution.high))
+
+    def warm_start(self, trials: List[FrozenTrial], offsets: Dict[str, float] = None, start_params: Dict[str, float] = None) -> int:
+        """
+        Seeds the study with completed trials of a previous study, so that the surrogate model starts from their posterior.
+        The offsets are added to the old (relative) motor positions to bring them into the reference frame of this optimizer:
+        only the trials falling into the current motor ranges are kept. If given, start_params is enqueued as the first new trial.
+        Returns the number of trials added.
+        """
+        distributions = self._get_distributions()
+        offsets       = {} if offsets is None else offsets
+        n_added       = 0
+
+        for trial in trials:
+            if trial.state != TrialState.COMPLETE: continue
+            if not all(mt in trial.params for mt in self.motor_types): continue
+
+            params = {mt: self._snap_to_distribution(trial.params[mt] + offsets.get(mt, 0.0), distributions[mt]) for mt in self.motor_types}
+            if None in params.values(): continue
+
+            self.study.add_trial(optuna.trial.create_trial(params=params,
+                                                           distributions=distributions,
+                                                           values=trial.values,
+                                                           user_attrs=trial.user_attrs,
+                                                           system_attrs=trial.system_attrs))
+            n_added += 1
+
+        if start_params is not None:
+            start_params = {mt: self._snap_to_distribution(start_params[mt], distributions[mt]) for mt in self.motor_types}
+            if None not in start_params.values(): self.study.enqueue_trial(start_params)
+
+        return n_added
+
+    def _get_current_params(self) -> Dict[str, float]:
+        # the motors are at the position of the last finished trial (at the initial position before the first one)
+        for trial in reversed(self.study.get_trials(deepcopy=False, states=(TrialState.COMPLETE, TrialState.PRUNED, TrialState.FAIL))):
+            if all(mt in trial.params for mt in self.motor_types): return {mt: trial.params[mt] for mt in self.motor_types}
+
+        return {mt: 0.0 for mt in self.motor_types}
+
+    def enqueue_trials(self, params_list: List[Dict[str, float]], order_by_travel: bool = True) -> List[Dict[str, float]]:
+        """
+        Enqueues a batch of points (e.g. proposed by hand or by another study), to be evaluated before the sampler suggestions.
+        With order_by_travel, they are evaluated in the order with the shortest motion time of the motors from their current
+        position (travel_time_model of set_optimizer_options). Returns the parameters in the order of evaluation.
+        """
+        if order_by_travel and len(params_list) > 1:
+            current_params = self._get_current_params()
+            positions      = [[params.get(mt, current_params[mt]) for mt in self.motor_types] for params in params_list]
+            order          = get_travel_order(self._travel_time_model, self.motor_types, positions, start=[current_params[mt] for mt in self.motor_types])
+            params_list    = [params_list[index] for index in order]
+
+        for params in params_list: self.study.enqueue_trial(params)
+
+        return params_list
+
+    def _objective(self, trial: Trial, step_scale: float = 1):
+        current_params = []
+        for mot, distribution in self._get_distributions(step_scale).items():
+            current_params.append(trial.suggest_float(mot, distribution.low, distribution.high, step=distribution.step))
+
+        self.cp.reseed_noise_generator(trial.number)
+
+        if self._progressive_tracing:
+            self._kwargs["early_abort_check"] = self._early_abort_check
+            self._kwargs["pilot_fraction"]    = self._pilot_fraction
+        try:
+            loss = self._loss_fn_this(current_params)
+        except HardwareAbortException as e:
+            # the trial fails (state FAIL), the exception stops the study: the caller has to bring the motors to safe positions
+            trial.set_user_attr(HARDWARE_FAILURE_ATTR, str(e))
+            raise
+        except EarlyAbortException:
+            if self._raise_prune_exception: self._prune_trial(current_params)
+            elif self._multi_objective_optimization: return [1e4] * len(self._loss_function_list)
+            else: return 1e4
+        finally:
+            self._kwargs.pop("early_abort_check", None)
+            self._kwargs.pop("pilot_fraction", None)
 
         if self.cp.save_images:
             if trial.number % self.cp.every_n_images == 0:
@@ -305,9 +486,85 @@ class OptunaOptimizer(OptimizationCommon):
 
         trial.set_user_attr("dw", deepcopy(self.beam_state.dw))
         trial.set_user_attr("ws", self.get_weighted_sum_intensity())
+        if self._replicate_scheduler is not None: loss = self._replicate_measurement(trial, loss)
+        elif self._observation_noise_method is not None: trial.set_user_attr(OBSERVATION_NOISE_ATTR, self._get_loss_standard_error(trial.number, loss))
 
         return loss
 
+    def _get_direction_signs(self) -> np.ndarray:
+        return np.array([1.0 if direction == StudyDirection.MINIMIZE else -1.0 for direction in self.study.directions])
+
+    def _get_minimization_front(self) -> np.ndarray:
+        signs  = self._get_direction_signs()
+        values = [trial.values for trial in self.study.best_trials if np.all(np.array(trial.values) < self._no_beam_loss)]
+
+        return np.array(values).reshape(-1, len(signs)) * signs
+
+    def _replicate_measurement(self, trial: Trial, loss: Union[float, List[float]]) -> Union[float, List[float]]:
+        # the same configuration is measured again (without moving the motors) while its position with respect to the
+        # current front is uncertain: the trial value is the mean of the replicates
+        replicate_losses = [np.atleast_1d(loss).astype(float)]
+        replicate_dws    = [deepcopy(self.beam_state.dw)]
+        if np.all(replicate_losses[0] < self._no_beam_loss):
+            signs = self._get_direction_signs()
+            front = self._get_minimization_front()
+
+            if self._observation_noise_method is None: single_frame_standard_errors = None
+            else:                                      single_frame_standard_errors = np.array(self._get_loss_standard_error(trial.number, loss))
+
+            n_extra = self._replicate_scheduler.get_n_extra_replicates(np.array(replicate_losses) * signs, front, single_frame_standard_errors)
+            n_frames = 1
+            while n_extra > 0 and n_frames < self._replicate_scheduler.max_replicates:
+                for _ in range(n_extra):
+                    if n_frames >= self._replicate_scheduler.max_replicates: break # frames without beam count in the budget
+                    self._update_beam_state()
+                    n_frames += 1
+                    replicate_loss = self._get_replicate_loss()
+                    if np.all(replicate_loss < self._no_beam_loss): # frames without beam are discarded
+                        replicate_losses.append(replicate_loss)
+                        replicate_dws.append(deepcopy(self.beam_state.dw))
+                n_extra = self._replicate_scheduler.get_n_extra_replicates(np.array(replicate_losses) * signs, front, single_frame_standard_errors)
+
+            self._replicate_scheduler.record(np.array(replicate_losses))
+
+            standard_errors = self._replicate_scheduler.get_standard_errors(np.array(replicate_losses), single_frame_standard_errors)
+            if np.all(np.isfinite(standard_errors)): trial.set_user_attr(OBSERVATION_NOISE_ATTR, [float(value) for value in standard_errors])
+
+        trial.set_user_attr("n_replicates", len(replicate_losses))
+        trial.set_user_attr("replicate_losses", [[float(value) for value in replicate_loss] for replicate_loss in replicate_losses])
+
+        mean_loss = np.mean(replicate_losses, axis=0)
+
+        # distribution info of the frames in the mean: "dw" is the frame closest to the mean loss
+        trial.set_user_attr("replicate_dws", replicate_dws)
+        trial.set_user_attr("dw", replicate_dws[int(np.argmin(np.sum(np.square(np.array(replicate_losses) - mean_loss), axis=1)))])
+
+        return list(mean_loss) if self._multi_objective_optimization else float(mean_loss[0])
+
+    def _get_replicate_loss(self) -> np.ndarray:
+        # the same penalties of the loss of the first frame (_objective): NaN, intensity below the threshold, zero width
+        loss = np.atleast_1d(self.get_current_loss()).astype(float)
+        loss[np.isnan(loss)] = 1e4
+
+        if self._sum_intensity_threshold is not None:
+            if self.beam_state.hist.data_2D.sum() < self._sum_intensity_threshold: loss[:] = 1e4
+
+        for k in [OptimizationCriteria.SIGMA, OptimizationCriteria.FWHM]:
+            if k in self.loss_parameters:
+                width_idx = self.loss_parameters.index(k) if self._multi_objective_optimization else 0
+                if loss[width_idx] == 0: loss[width_idx] = 1e4
+
+        return loss
+
+    def _get_loss_standard_error(self, trial_number: int, loss: Union[float, List[float]]) -> List[float]:
+        # independent from the noise stream of the trial (SeedSequence child)
+        rng = np.random.default_rng(get_seed_sequence(self.cp.random_seed, self.cp.worker_index, trial_number).spawn(1)[0])
+
+        standard_error = np.atleast_1d(self.get_current_loss_standard_error(self._observation_noise_method, self._n_noise_replicates, rng))
+        standard_error[np.atleast_1d(loss) >= self._no_beam_loss] = np.nan # penalty values, not observations
+
+        return [float(value) for value in standard_error]
+
     def trials(self, n_trials: int, trial_motor_types: list = None, step_scale: float = 1):
         obj_this = lambda t: self._objective(t, step_scale=step_scale)
 
@@ -322,32 +579,59 @@ class OptunaOptimizer(OptimizationCommon):
 
         self.best_params.update(self.study.best_trials[0].params)
 
-    def select_best_trial_params(self, trials, algorithm=SelectionAlgorithm.TOPSIS): # TOPSIS ALGORITHM
-        if algorithm == SelectionAlgorithm.TOPSIS:
-            n_loss_parameters = len(self.loss_parameters)
-            n_trials = len(trials)
-            print(n_trials)
-
-            all_values = numpy.ones((n_trials, n_loss_parameters))
-            for ti in range(n_trials): all_values[ti, :] = trials[ti].values
-
-            weights = numpy.ones(n_loss_parameters)
-            weights[numpy.where(numpy.logical_or(self.loss_parameters == OptimizationCriteria.LOG_WEIGHTED_SUM_INTENSITY,
-                                                 self.loss_parameters == OptimizationCriteria.NEGATIVE_LOG_PEAK_INTENSITY))] = self._log_parameters_weight
-
-            v         = all_values / numpy.sqrt(numpy.sum(all_values, axis=0)**2)
-            v         = v * weights
-            v_minus   = numpy.amin(v, axis=0, keepdims=True)
-            v_plus    = numpy.amax(v, axis=0, keepdims=True)
-            s_plus    = numpy.sqrt(numpy.sum((v - v_plus)**2, axis=0))
-            s_minus   = numpy.sqrt(numpy.sum((v - v_minus)**2, axis=0))
-            closeness = s_minus / (s_plus + s_minus)
-
-            idx = np.argmax(closeness)
-            print(closeness)
-            print(idx)
-        elif algorithm == SelectionAlgorithm.NASH_EQUILIBRIUM:
-            _, idx, _ = select_nash_equil_trial_from_pareto_front(self.study)
+    def switch_to_trust_region(self, **trust_region_options) -> TrustRegionSampler:
+        """
+        Local Bayesian optimization around the best trial (TuRBO-like), e.g. after a first global autofocus phase: the next
+        trials use the same acquisition function and model options as the global sampler, with a local GP and candidates
+        in a trust region that expands after improvements and shrinks after failures (fewer and shorter motor moves).
+        trust_region_options are the options of TrustRegionSampler (e.g. length_init, length_min, failure_tolerance).
+        """
+        if self._sampler_options is None: raise ValueError("The trust region requires the default BoTorch sampler (set_optimizer_options without base_sampler)")
+
+        sampler_options = dict(self._sampler_options)
+
+        # the variational surrogate keeps the state of a sampler, learned in the coordinates normalized to its bounds
+        variational_surrogate = sampler_options.get("variational_surrogate", None)
+        if not variational_surrogate is None:
+            sampler_options["variational_surrogate"] = deepcopy(variational_surrogate)
+            sampler_options["variational_surrogate"].reset()
+
+        self._base_sampler = TrustRegionSampler(**sampler_options, **trust_region_options)
+        self.study.sampler = self._base_sampler
+
+        return self._base_sampler
+
+    def compute_sensitivity(self, motors: List[str] = None, **kwargs) -> Sensitivity:
+        """
+        Jacobian of the beam properties at the current motor positions, stored with the study (user attribute
+        "sensitivity"). kwargs are the options of sensitivity.compute_sensitivity (e.g. n_repeats, n_workers).
+        """
+        arguments = dict(self._kwargs)
+        for key in ["early_abort_check", "pilot_fraction"]: arguments.pop(key, None) # stencil points are always traced completely
+        arguments.update(kwargs)
+
+        self.sensitivity = compute_sensitivity(self.cp, self.focusing_system, self.motor_types if motors is None else motors, **arguments)
+        if not self.study is None: self.study.set_user_attr("sensitivity", self.sensitivity.to_dictionary())
+
+        return self.sensitivity
+
+    def select_trial_motor_types(self, quantities: List[str] = None, threshold: float = 0.1, significance: float = 2.0) -> List[str]:
+        """Motors with a significant effect on the quantities, to be used as trial_motor_types (see Sensitivity.select_motors)."""
+        if self.sensitivity is None: raise ValueError("Compute the sensitivity first")
+
+        selected_motors = self.sensitivity.select_motors(quantities, threshold, significance)
+
+        return [motor for motor in self.motor_types if motor in selected_motors]
+
+    def select_best_trial_params(self, trials, algorithm=SelectionAlgorithm.TOPSIS):
+        # the decision engine caches the objective values: only the trials completed since the last call are added
+        self._decision_engine.update(self.study.trials)
+
+        weights = numpy.ones(len(self.loss_parameters))
+        weights[numpy.isin(self.loss_parameters, [OptimizationCriteria.LOG_WEIGHTED_SUM_INTENSITY,
+                                                  OptimizationCriteria.NEGATIVE_LOG_PEAK_INTENSITY])] = self._log_parameters_weight
+
+        idx = self._decision_engine.select_trial(trials, algorithm=algorithm, weights=weights)
 
         return trials[idx].params, trials[idx].values
 
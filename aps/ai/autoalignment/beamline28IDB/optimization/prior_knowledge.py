@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------- #
+# Copyright (c) 2021, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2021. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# ----------------------------------------------------------------------- #
+"""
+Prior knowledge from the studies of previous runs.
+
+The studies dumped at the end of each run are indexed in a StudyArchive, by beamline and configuration (motors, loss
+parameters and any other relevant setting). A PriorModel is fitted offline on the archived trials, in absolute motor
+positions, and it is used as mean function of the BoTorch surrogate of a new study (HistoricalPriorMean), with a
+scale and an offset fitted together with the other hyperparameters of the GP.
+"""
+import os
+import json
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+import joblib
+import numpy as np
+import torch
+from botorch.fit import fit_gpytorch_mll
+from botorch.models import KroneckerMultiTaskGP, SingleTaskGP
+from botorch.models.transforms.outcome import Standardize
+from botorch.utils.transforms import normalize
+from gpytorch.means import Mean
+from gpytorch.mlls import ExactMarginalLogLikelihood
+from optuna.trial import FrozenTrial, TrialState
+
+DEFAULT_MAX_PRIOR_POINTS       = 1000
+DEFAULT_N_STARTUP_TRIALS_PRIOR = 3
+
+class StudyArchive:
+    INDEX_FILE = "index.json"
+
+    def __init__(self, archive_directory: str):
+        self.__archive_directory = archive_directory
+        if not os.path.exists(self.__archive_directory): os.makedirs(self.__archive_directory)
+
+        self.__index_path = os.path.join(self.__archive_directory, self.INDEX_FILE)
+        if os.path.exists(self.__index_path):
+            with open(self.__index_path, 'r') as fp: self.__records = json.load(fp)
+        else:
+            self.__records = []
+
+    @property
+    def records(self) -> List[Dict]: return list(self.__records)
+
+    def archive_study(self,
+                      trials: List[FrozenTrial],
+                      beamline: str,
+                      motor_types: List[str],
+                      loss_parameters: List[str],
+                      origin_positions: Dict[str, float] = None,
+                      configuration: Dict = None,
+                      file_name: str = None) -> Dict:
+        if file_name is None: file_name = f"study_{beamline}_{datetime.strftime(datetime.now(), '%Y-%m-%d_%H:%M:%S')}.gz"
+        joblib.dump(trials, os.path.join(self.__archive_directory, file_name))
+
+        return self.register(file_name, beamline, motor_types, loss_parameters, origin_positions, configuration)
+
+    def register(self,
+                 trials_file: str,
+                 beamline: str,
+                 motor_types: List[str],
+                 loss_parameters: List[str],
+                 origin_positions: Dict[str, float] = None,
+                 configuration: Dict = None) -> Dict:
+        """
+        Adds an existing joblib dump of trials to the index. Trials are stored with motor movements relative to the
+        origin positions: without them (e.g. old dumps), the relative movements are used as they are.
+        """
+        record = {
+            "file":             trials_file,
+            "beamline":         beamline,
+            "motor_types":      list(motor_types),
+            "loss_parameters":  list(loss_parameters),
+            "origin_positions": None if origin_positions is None else {k: float(v) for k, v in origin_positions.items()},
+            "configuration":    {} if configuration is None else dict(configuration),
+            "date":             datetime.strftime(datetime.now(), "%Y-%m-%d %H:%M:%S")
+        }
+        self.__records.append(record)
+        with open(self.__index_path, 'w') as fp: json.dump(self.__records, fp, indent=2)
+
+        return record
+
+    def search(self, beamline: str, motor_types: List[str], loss_parameters: List[str], **configuration) -> List[Dict]:
+        """Records of the same beamline and loss parameters, covering all the motors and matching the given configuration."""
+        records = []
+        for record in self.__records:
+            if record["beamline"] != beamline: continue
+            if record["loss_parameters"] != list(loss_parameters): continue
+            if not set(motor_types).issubset(record["motor_types"]): continue
+            if any(record["configuration"].get(k, None) != v for k, v in configuration.items()): continue
+            records.append(record)
+
+        return records
+
+    def load(self, records: List[Dict]) -> List[Tuple[List[FrozenTrial], Dict]]:
+        return [(joblib.load(os.path.join(self.__archive_directory, record["file"])), record) for record in records]
+
+class PriorModel:
+    """
+    Surrogate of the loss parameters as function of the absolute motor positions. Multi-objective data are modeled
+    with a KroneckerMultiTaskGP (one task per loss parameter), single-objective with a SingleTaskGP.
+    """
+    def __init__(self, model, motor_types: List[str], loss_parameters: List[str], x_bounds: torch.Tensor, y_mean: torch.Tensor, y_std: torch.Tensor):
+        self.model           = model
+        self.motor_types     = motor_types
+        self.loss_parameters = loss_parameters
+        self.x_bounds        = x_bounds
+        self.y_mean          = y_mean
+        self.y_std           = y_std
+
+        for parameter in self.model.parameters(): parameter.requires_grad_(False)
+        self.model.eval()
+
+    def predict(self, x_absolute: torch.Tensor) -> torch.Tensor:
+        """Posterior mean, shape (..., n, n_loss_parameters), for absolute positions of shape (..., n, n_motors)."""
+        # the posterior mean is pointwise: flattening the batch dimensions avoids the batch shape limitations of KroneckerMultiTaskGP
+        mean = self.model.posterior(normalize(x_absolute.reshape(-1, x_absolute.shape[-1]), bounds=self.x_bounds)).mean
+
+        return mean.reshape(x_absolute.shape[:-1] + (mean.shape[-1],))
+
+def fit_prior_model(archived_studies: List[Tuple[List[FrozenTrial], Dict]],
+                    motor_types: List[str],
+                    loss_parameters: List[str],
+                    max_points: int = DEFAULT_MAX_PRIOR_POINTS,
+                    random_seed: int = None) -> PriorModel:
+    x_list = []
+    y_list = []
+    for trials, record in archived_studies:
+        origin_positions = record["origin_positions"]
+        for trial in trials:
+            if trial.state != TrialState.COMPLETE or trial.values is None: continue
+            if not all(mt in trial.params for mt in motor_types): continue
+            if origin_positions is None: x_list.append([trial.params[mt] for mt in motor_types])
+            else:                        x_list.append([trial.params[mt] + origin_positions[mt] for mt in motor_types])
+            y_list.append(list(trial.values))
+
+    if len(x_list) == 0: raise ValueError("No completed trials in the archived studies")
+
+    train_x = torch.tensor(x_list, dtype=torch.float64)
+    train_y = torch.tensor(y_list, dtype=torch.float64)
+
+    if train_x.shape[0] > max_points: # exact GP: keep the cost bounded
+        idx = np.random.default_rng(random_seed).choice(train_x.shape[0], max_points, replace=False)
+        train_x = train_x[idx]
+        train_y = train_y[idx]
+
+    x_bounds = torch.stack([train_x.min(dim=0).values, train_x.max(dim=0).values])
+    x_bounds[1] = torch.where(x_bounds[1] > x_bounds[0], x_bounds[1], x_bounds[0] + 1.0)
+
+    if train_y.shape[-1] > 1: model = KroneckerMultiTaskGP(normalize(train_x, x_bounds), train_y, outcome_transform=Standardize(m=train_y.shape[-1]))
+    else:                     model = SingleTaskGP(normalize(train_x, x_bounds), train_y, outcome_transform=Standardize(m=1))
+    fit_gpytorch_mll(ExactMarginalLogLikelihood(model.likelihood, model))
+
+    return PriorModel(model, list(motor_types), list(loss_parameters), x_bounds, train_y.mean(dim=0), train_y.std(dim=0).clamp_min(1e-9))
+
+class HistoricalPriorMean(Mean):
+    """
+    Mean function of the surrogate of a running study, built on a PriorModel.
+
+    The surrogate works on the normalized search space of the study (parameter_names, bounds), i.e. on the movements
+    relative to the origin positions: motors not in the search space are kept at their fixed movement. The outputs
+    are the (signed) loss parameters followed by the constraints, which have no prior.
+    """
+    def __init__(self,
+                 prior_model: PriorModel,
+                 parameter_names: List[str],
+                 bounds: torch.Tensor,
+                 origin_positions: Dict[str, float],
+                 fixed_params: Dict[str, float],
+                 signs: List[float],
+                 n_outputs: int):
+        super().__init__()
+        self._prior_model = prior_model
+        self._bounds      = bounds
+        self._n_outputs   = n_outputs
+        self._columns     = [parameter_names.index(mt) if mt in parameter_names else None for mt in prior_model.motor_types]
+        self._origin      = [origin_positions[mt] for mt in prior_model.motor_types]
+        self._reference   = [origin_positions[mt] + fixed_params.get(mt, 0.0) for mt in prior_model.motor_types]
+
+        n_objectives = len(prior_model.loss_parameters)
+        signs        = torch.tensor(signs, dtype=torch.float64)
+        scale        = torch.zeros(n_outputs, dtype=torch.float64)
+        constant     = torch.zeros(n_outputs, dtype=torch.float64)
+        # initial guess: the standardized prior, the GP targets being standardized as well
+        scale[:n_objectives]    = 1 / prior_model.y_std
+        constant[:n_objectives] = -signs * prior_model.y_mean / prior_model.y_std
+        self._signs = signs
+
+        self.register_parameter(name="scale",    parameter=torch.nn.Parameter(scale))
+        self.register_parameter(name="constant", parameter=torch.nn.Parameter(constant))
+
+    def forward(self, x):
+        x_relative = self._bounds[0] + x * (self._bounds[1] - self._bounds[0])
+        x_absolute = torch.stack([x_relative[..., column] + origin if column is not None else torch.full_like(x[..., 0], reference)
+                                  for column, origin, reference in zip(self._columns, self._origin, self._reference)], dim=-1)
+
+        prediction = self._prior_model.predict(x_absolute) * self._signs # BoTorch maximizes
+        if self._n_outputs > prediction.shape[-1]:
+            prediction = torch.cat([prediction, torch.zeros(prediction.shape[:-1] + (self._n_outputs - prediction.shape[-1],), dtype=prediction.dtype)], dim=-1)
+
+        if self._n_outputs == 1: return prediction[..., 0] * self.scale + self.constant
+
+        # batched multi-output model: x has shape (..., 1 or n_outputs, n, d), the mean (..., n_outputs, n)
+        if x.shape[-3] == 1: prediction = prediction.squeeze(-3)
+        else:                prediction = torch.diagonal(prediction, dim1=-3, dim2=-1)
+
+        return prediction.transpose(-1, -2) * self.scale.unsqueeze(-1) + self.constant.unsqueeze(-1)
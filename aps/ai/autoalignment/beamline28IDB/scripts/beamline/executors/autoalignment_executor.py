@@ -89,6 +89,14 @@ multi_objective_optimization  = ini_file.get_boolean_from_ini(section="Optimizat
 selection_algorithm           = ini_file.get_string_from_ini( section="Optimization-Parameters", key="Selection-Algorithm",           default=SelectionAlgorithm.NASH_EQUILIBRIUM)
 n_trials                      = ini_file.get_int_from_ini(    section="Optimization-Parameters", key="N-Trials",                      default=100)
 
+tracking_mode                 = ini_file.get_boolean_from_ini(section="Tracking-Parameters", key="Tracking-Mode",         default=False)
+tracking_trust_region         = ini_file.get_float_from_ini(  section="Tracking-Parameters", key="Trust-Region-Fraction", default=0.1)
+n_tracking_trials             = ini_file.get_int_from_ini(    section="Tracking-Parameters", key="N-Tracking-Trials",     default=15)
+tracking_escalation_threshold = ini_file.get_float_from_ini(  section="Tracking-Parameters", key="Escalation-Threshold",  default=0.5)
+
+archive_studies               = ini_file.get_boolean_from_ini(section="Prior-Knowledge", key="Archive-Studies",     default=True)
+use_prior_knowledge           = ini_file.get_boolean_from_ini(section="Prior-Knowledge", key="Use-Prior-Knowledge", default=False)
+
 save_images                          =  ini_file.get_boolean_from_ini(section="Calculation-Parameters", key="Save-Images",                   default=False)
 every_n_images                       =  ini_file.get_int_from_ini(    section="Calculation-Parameters", key="Every-N-Images",                default=5)
 add_noise                            =  ini_file.get_boolean_from_ini(section="Calculation-Parameters", key="Add-Noise",                     default=False)
@@ -123,6 +131,14 @@ ini_file.set_value_at_ini(section="Optimization-Parameters", key="Multi-Objectiv
 ini_file.set_value_at_ini(section="Optimization-Parameters", key="Selection-Algorithm", value=selection_algorithm)
 ini_file.set_value_at_ini(section="Optimization-Parameters", key="N-Trials", value=n_trials)
 
+ini_file.set_value_at_ini(section="Tracking-Parameters", key="Tracking-Mode",         value=tracking_mode)
+ini_file.set_value_at_ini(section="Tracking-Parameters", key="Trust-Region-Fraction", value=tracking_trust_region)
+ini_file.set_value_at_ini(section="Tracking-Parameters", key="N-Tracking-Trials",     value=n_tracking_trials)
+ini_file.set_value_at_ini(section="Tracking-Parameters", key="Escalation-Threshold",  value=tracking_escalation_threshold)
+
+ini_file.set_value_at_ini(section="Prior-Knowledge", key="Archive-Studies",     value=archive_studies)
+ini_file.set_value_at_ini(section="Prior-Knowledge", key="Use-Prior-Knowledge", value=use_prior_knowledge)
+
 ini_file.set_value_at_ini(section="Calculation-Parameters", key="Save-Images",                   value=save_images)
 ini_file.set_value_at_ini(section="Calculation-Parameters", key="Every-N-Images",                value=every_n_images)
 ini_file.set_value_at_ini(section="Calculation-Parameters", key="Add-Noise",                     value=add_noise)
@@ -157,6 +173,9 @@ class AAOptimizationParameters(OptimizationParameters):
         self.params["selection_algorithm"]           =  selection_algorithm
         self.params["n_trials"]                      =  n_trials
 
+        self._set_tracking_parameters(tracking_mode, tracking_trust_region, n_tracking_trials, tracking_escalation_threshold)
+        self._set_prior_knowledge_parameters(archive_studies, use_prior_knowledge)
+
 
 class AutoalignmentScript(GenericScript):
     def __init__(self, root_directory, energy, period, n_cycles, get_new_reference, test_mode, mocking_mode, simulation_mode):
@@ -93,6 +93,14 @@ selection_algorithm                  =  ini_file.get_string_from_ini( section="O
 n_pitch_trans_motor_trials           =  ini_file.get_int_from_ini(    section="Optimization-Parameters", key="N-Pitch-Trans-Motor-Trials",    default=50)
 n_all_motor_trials                   =  ini_file.get_int_from_ini(    section="Optimization-Parameters", key="N-All-Motor-Trials",            default=100)
 
+tracking_mode                        =  ini_file.get_boolean_from_ini(section="Tracking-Parameters", key="Tracking-Mode",         default=False)
+tracking_trust_region                =  ini_file.get_float_from_ini(  section="Tracking-Parameters", key="Trust-Region-Fraction", default=0.1)
+n_tracking_trials                    =  ini_file.get_int_from_ini(    section="Tracking-Parameters", key="N-Tracking-Trials",     default=15)
+tracking_escalation_threshold        =  ini_file.get_float_from_ini(  section="Tracking-Parameters", key="Escalation-Threshold",  default=0.5)
+
+archive_studies                      =  ini_file.get_boolean_from_ini(section="Prior-Knowledge", key="Archive-Studies",     default=True)
+use_prior_knowledge                  =  ini_file.get_boolean_from_ini(section="Prior-Knowledge", key="Use-Prior-Knowledge", default=False)
+
 save_images                          =  ini_file.get_boolean_from_ini(section="Calculation-Parameters", key="Save-Images",                   default=False)
 every_n_images                       =  ini_file.get_int_from_ini(    section="Calculation-Parameters", key="Every-N-Images",                default=5)
 use_denoised                         =  ini_file.get_boolean_from_ini(section="Calculation-Parameters", key="Use-Denoised-Image",            default=True)
@@ -136,6 +144,14 @@ ini_file.set_value_at_ini(section="Optimization-Parameters", key="Selection-Algo
 ini_file.set_value_at_ini(section="Optimization-Parameters", key="N-Pitch-Trans-Motor-Trials",    value=n_pitch_trans_motor_trials)
 ini_file.set_value_at_ini(section="Optimization-Parameters", key="N-All-Motor-Trials",            value=n_all_motor_trials)
 
+ini_file.set_value_at_ini(section="Tracking-Parameters", key="Tracking-Mode",         value=tracking_mode)
+ini_file.set_value_at_ini(section="Tracking-Parameters", key="Trust-Region-Fraction", value=tracking_trust_region)
+ini_file.set_value_at_ini(section="Tracking-Parameters", key="N-Tracking-Trials",     value=n_tracking_trials)
+ini_file.set_value_at_ini(section="Tracking-Parameters", key="Escalation-Threshold",  value=tracking_escalation_threshold)
+
+ini_file.set_value_at_ini(section="Prior-Knowledge", key="Archive-Studies",     value=archive_studies)
+ini_file.set_value_at_ini(section="Prior-Knowledge", key="Use-Prior-Knowledge", value=use_prior_knowledge)
+
 ini_file.set_value_at_ini(section="Calculation-Parameters", key="Save-Images",                   value=save_images)
 ini_file.set_value_at_ini(section="Calculation-Parameters", key="Every-N-Images",                value=every_n_images)
 ini_file.set_value_at_ini(section="Calculation-Parameters", key="Use-Denoised-Image",            value=use_denoised)
@@ -177,6 +193,9 @@ class AFOptimizationParameters(OptimizationParameters):
         self.params["n_pitch_trans_motor_trials"]    = n_pitch_trans_motor_trials
         self.params["n_all_motor_trials"]            = n_all_motor_trials
 
+        self._set_tracking_parameters(tracking_mode, tracking_trust_region, n_tracking_trials, tracking_escalation_threshold)
+        self._set_prior_knowledge_parameters(archive_studies, use_prior_knowledge)
+
 class AutofocusingScript(GenericScript):
     def __init__(self, root_directory, energy, period, n_cycles, test_mode, mocking_mode, simulation_mode):
         super(AutofocusingScript, self).__init__(root_directory,
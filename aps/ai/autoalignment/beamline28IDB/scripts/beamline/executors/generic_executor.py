@@ -66,8 +66,11 @@ from aps.ai.autoalignment.common.util.common import AspectRatio, ColorMap, PlotM
 
 from aps.ai.autoalignment.common.util import clean_up
 from aps.ai.autoalignment.common.util.common import plot_2D
+from aps.ai.autoalignment.common.util.feasibility import FeasibilityClassifier
+from aps.ai.autoalignment.common.util.scheduler import CycleScheduler, TriggerMode
 from aps.ai.autoalignment.common.util.wrappers import plot_distribution
 from aps.ai.autoalignment.common.facade.parameters import DistanceUnits, AngularUnits
+from aps.ai.autoalignment.common.hardware.epics.watchdog import HardwareAbortException
 from aps.ai.autoalignment.common.util.shadow.common import PreProcessorFiles, load_shadow_beam
 
 from aps.ai.autoalignment.beamline28IDB.optimization.common import OptimizationCriteria, MooThresholds, CalculationParameters
@@ -77,6 +80,7 @@ import aps.ai.autoalignment.beamline28IDB.optimization.common as opt_common
 from aps.ai.autoalignment.beamline28IDB.facade.focusing_optics_factory import ExecutionMode
 from aps.ai.autoalignment.beamline28IDB.scripts.beamline import AA_28ID_BEAMLINE_SCRIPTS
 from aps.ai.autoalignment.beamline28IDB.optimization.optuna_botorch import OptunaOptimizer
+from aps.ai.autoalignment.beamline28IDB.optimization.prior_knowledge import StudyArchive, fit_prior_model
 
 
 from aps.ai.autoalignment.beamline28IDB.facade.focusing_optics_factory import focusing_optics_factory_method
@@ -84,6 +88,8 @@ from aps.ai.autoalignment.beamline28IDB.simulation.facade.focusing_optics_interf
 
 
 DEFAULT_RANDOM_SEED = numpy.random.randint(100000)
+BEAMLINE_NAME       = "28-ID-B"
+MAX_ABORTED_CYCLES  = 3 # consecutive cycles aborted by hardware failures, before stopping the script
 
 class OptimizationParameters:
     def __init__(self):
@@ -120,6 +126,16 @@ class OptimizationParameters:
                                    MooThresholds.SUM_INTENSITY]: moo_thresholds_dict[moo_threshold] = moo_threshold_intensity
         return  moo_thresholds_dict
 
+    def _set_tracking_parameters(self, tracking_mode, tracking_trust_region, n_tracking_trials, tracking_escalation_threshold):
+        self.params["tracking_mode"]                 = tracking_mode
+        self.params["tracking_trust_region"]         = tracking_trust_region # fraction of the movement ranges
+        self.params["n_tracking_trials"]             = n_tracking_trials
+        self.params["tracking_escalation_threshold"] = tracking_escalation_threshold # relative loss degradation
+
+    def _set_prior_knowledge_parameters(self, archive_studies, use_prior_knowledge):
+        self.params["archive_studies"]     = archive_studies
+        self.params["use_prior_knowledge"] = use_prior_knowledge
+
 
 class PlotParameters(object):
     def __init__(self,
@@ -168,6 +184,7 @@ class SimulationParameters(PlotParameters):
         self.params.percentage_fluctutation = percentage_fluctutation
         self.params.calculate_over_noise    = calculate_over_noise
         self.params.noise_threshold         = noise_threshold
+        self.params.initialize_random_generators() # random_seed has been changed
 
 class HardwareParameters(PlotParameters):
     def __init__(self,
@@ -213,11 +230,27 @@ class GenericScript(AbstractCMDScript):
         self._period          = period * 60.0 # in seconds
         self._n_cycles        = n_cycles
 
+        try:    self._max_aborted_cycles = kwargs["max_aborted_cycles"]
+        except: self._max_aborted_cycles = MAX_ABORTED_CYCLES
+        try:    self._trigger_mode = kwargs["trigger_mode"] # cycles on deadlines (period) and/or trigger events
+        except: self._trigger_mode = TriggerMode.PERIOD
+        try:    self._trigger_pv = kwargs["trigger_pv"] # PV triggering the cycles, with condition on its value (e.g. the traffic light)
+        except: self._trigger_pv = None
+        try:    self._trigger_condition = kwargs["trigger_condition"]
+        except: self._trigger_condition = None
+
+        self._scheduler = None
+
         self.__traffic_light  = get_registered_traffic_light_instance(application_name=AA_28ID_BEAMLINE_SCRIPTS)
 
         self._optimization_parameters = None
         self._parameters              = None
         self._focusing_system         = None
+        self._tracking_state          = None
+        self._study_archive           = None
+        self._prior_model             = None
+        self._safe_positions          = None
+        self._feasibility_classifier  = FeasibilityClassifier() # outcomes of the random initializations and trials of all the cycles
         
         self._data_directory = os.path.join(self._root_directory, "AI", self._get_script_name().lower())
         
@@ -260,12 +293,18 @@ class GenericScript(AbstractCMDScript):
             print("Optimization parameters")
             print(self._optimization_parameters.params)
 
+            self._study_archive = StudyArchive(os.path.join(self._root_directory, "AI", "study_archive"))
+            if self._optimization_parameters.params["use_prior_knowledge"]: self._prior_model = self._get_prior_model()
+
     def execute_script(self, **kwargs):
-        cycles = 0
+        aborted_cycles = 0
+
+        # the post-processing of a cycle runs while waiting for the next one
+        self._scheduler = CycleScheduler(period=self._period, n_cycles=self._n_cycles, trigger_mode=self._trigger_mode)
+        if not self._trigger_pv is None: self._scheduler.add_trigger_pv(self._trigger_pv, condition=self._trigger_condition)
 
         try:
-            while(cycles < self._n_cycles):
-                cycles += 1
+            for cycles in self._scheduler.cycles():
                 self.__traffic_light.request_red_light()
 
                 print("Running " + self._get_script_name() + " #" + str(cycles))
@@ -274,22 +313,43 @@ class GenericScript(AbstractCMDScript):
                     print("Mocking Mode: do nothing and wait 10 second")
                     time.sleep(10)
                 else:
-                    self._execute_script_inner(current_cycle=cycles, **kwargs)
+                    try:
+                        self._execute_script_inner(current_cycle=cycles, **kwargs)
+                        aborted_cycles = 0
+                    except HardwareAbortException as e:
+                        aborted_cycles += 1
+                        self._abort_cycle(e)
+                        if aborted_cycles >= self._max_aborted_cycles: raise e
 
                 self.__traffic_light.set_green_light()
 
-                print(self._get_script_name() + " #" + str(cycles) + " completed.")
+                if aborted_cycles == 0: print(self._get_script_name() + " #" + str(cycles) + " completed.")
+                else:                   print(self._get_script_name() + " #" + str(cycles) + " aborted.")
 
-                if self._n_cycles > 1:
-                    print("Pausing for " + str(self._period) + " seconds.")
-                    time.sleep(self._period)
+            self._scheduler.close()
+
+            if self._n_cycles > 1: print("Scheduling jitter (s):", self._scheduler.get_jitter_statistics())
         except Exception as e:
             try:    self.__traffic_light.set_green_light()
             except: pass
+            try:    self._scheduler.close()
+            except: pass
 
             print("Script interrupted by the following exception:\n" + str(e))
 
             raise e
+        finally:
+            self._scheduler = None
+
+    def _abort_cycle(self, exception):
+        # safe abort: the cycle is stopped and the motors go back to the positions at the beginning of the cycle
+        print("Hardware failure, cycle aborted:\n" + str(exception))
+
+        self._tracking_state = None # the optimum is not reliable anymore
+
+        if not self._safe_positions is None:
+            print("Moving motors to safe positions", self._safe_positions)
+            movers.move_motors(self._focusing_system, list(self._safe_positions.keys()), list(self._safe_positions.values()), movement="absolute")
 
     def manage_keyboard_interrupt(self):
         print("\n" + self._get_script_name() + " interrupted by user")
@@ -314,15 +374,17 @@ class GenericScript(AbstractCMDScript):
                                   **self._parameters.as_kwargs())
 
             motors = list(self._optimization_parameters.move_motors_ranges.keys())
-            initial_absolute_positions = {k: movers.get_absolute_positions(self._focusing_system, k)[0] for k in motors}
+            initial_absolute_positions = dict(zip(motors, movers.get_absolute_positions(self._focusing_system, motors)))
             print("Focused absolute position are", initial_absolute_positions)
+            self._safe_positions = initial_absolute_positions
 
-            # Adding random perturbation to the motor values
+            # Adding random perturbation to the motor values (a small drift, when tracking)
             initial_movement, self._focusing_system, (beam_init, hist_init, dw_init) = \
                 opt_common.get_random_init(cp=self._parameters.params,
                                            focusing_system=self._focusing_system,
-                                           motor_types_and_ranges=self._optimization_parameters.move_motors_ranges,
+                                           motor_types_and_ranges=self._optimization_parameters.move_motors_ranges if self._tracking_state is None else self._get_drift_ranges(),
                                            intensity_sum_threshold=self._optimization_parameters.params["sum_intensity_hard_constraint"],
+                                           feasibility_classifier=self._feasibility_classifier,
                                            **kwargs)
 
             self._print_beam_attributes(hist_init, dw_init, "Perturbed")
@@ -336,9 +398,10 @@ class GenericScript(AbstractCMDScript):
                                   **self._parameters.as_kwargs())
         else:
             motors = list(self._optimization_parameters.move_motors_ranges.keys())
-            initial_absolute_positions = {k: movers.get_absolute_positions(self._focusing_system, k)[0] for k in motors}
+            initial_absolute_positions = dict(zip(motors, movers.get_absolute_positions(self._focusing_system, motors)))
 
             print("Focused absolute position are", initial_absolute_positions)
+            self._safe_positions = initial_absolute_positions
             with open(os.path.join(self._data_directory, "initial_motor_positions.json"), 'w') as fp: json.dump(initial_absolute_positions, fp)
 
             # taking initial image of the beam
@@ -356,11 +419,13 @@ class GenericScript(AbstractCMDScript):
                         save_image=True,
                         save_path=self._data_directory)
 
-        opt_trial = self._get_optimizer()
-        n_trials  = self._run_optimization(opt_trial)
+        if self._tracking_state is None: opt_trial, n_trials = self._run_full_optimization()
+        else:                            opt_trial, n_trials = self._run_tracking_optimization()
+
+        self._feasibility_classifier.record_trials(opt_trial.motor_types, opt_trial.study.trials, origin=opt_trial.initial_motor_positions)
 
         print("Selecting the optimal parameters, with algorithm: " + self._optimization_parameters.params["selection_algorithm"])
-        optimal_params, values = opt_trial.select_best_trial_params(opt_trial.study.best_trials, algorithm=self._optimization_parameters.params["selection_algorithm"])
+        optimal_params, values = self._select_best_trial_params(opt_trial)
 
         print("Optimal parameters")
         print(optimal_params)
@@ -371,6 +436,8 @@ class GenericScript(AbstractCMDScript):
         opt_trial.study.enqueue_trial(optimal_params)
         opt_trial.trials(1)
 
+        if self._optimization_parameters.params["tracking_mode"]: self._update_tracking_state(opt_trial, values)
+
         if self._simulation_mode:
             if self._test_mode:
                 plot_distribution(beam=opt_trial.beam_state.photon_beam,
@@ -392,12 +459,26 @@ class GenericScript(AbstractCMDScript):
                         save_image=True,
                         save_path=self._data_directory)
 
+        # study.trials is a copy: every task gets its own trials
         datetime_str = datetime.strftime(datetime.now(), "%Y-%m-%d_%H:%M")
         chkpt_name = f"optimization_final_{n_trials}_{datetime_str}.gz"
-        joblib.dump(opt_trial.study.trials, chkpt_name)
+        self._submit_postprocessing(joblib.dump, opt_trial.study.trials, chkpt_name, background=True)
         print(f"Saving all trials in {chkpt_name}")
 
-        if self._test_mode: self._postprocess_optimization(opt_trial.study.trials)
+        if self._optimization_parameters.params["archive_studies"]:
+            self._submit_postprocessing(self._study_archive.archive_study, opt_trial.study.trials,
+                                        beamline=BEAMLINE_NAME,
+                                        motor_types=opt_trial.motor_types,
+                                        loss_parameters=opt_trial.loss_parameters,
+                                        origin_positions=dict(zip(opt_trial.motor_types, opt_trial.initial_motor_positions)),
+                                        configuration=self._get_study_configuration(),
+                                        background=True)
+
+        if self._test_mode: self._submit_postprocessing(self._postprocess_optimization, opt_trial.study.trials) # matplotlib: main thread
+
+    def _submit_postprocessing(self, function, *args, background=False, **kwargs):
+        if self._scheduler is None: function(*args, **kwargs) # outside of execute_script
+        else:                       self._scheduler.submit(function, *args, background=background, **kwargs)
 
     def _get_script_name(self):                                        raise NotImplementedError()
     def _get_optimization_parameters(self):                            raise NotImplementedError()
@@ -482,7 +563,102 @@ class GenericScript(AbstractCMDScript):
         if OptimizationCriteria.NEGATIVE_LOG_PEAK_INTENSITY in self._optimization_parameters.params["loss_parameters"]: print(title + f" system peak intensity: {opt_common._get_peak_intensity_from_dw(dw):8.1e}")
         if OptimizationCriteria.LOG_WEIGHTED_SUM_INTENSITY  in self._optimization_parameters.params["loss_parameters"]: print(title + f" system sum intensity:  {opt_common._get_weighted_sum_intensity_from_hist(hist):8.1e}")
 
-    def _get_optimizer(self, **kwargs):
+    def _run_full_optimization(self):
+        opt_trial = self._get_optimizer()
+        n_trials  = self._run_optimization(opt_trial)
+
+        return opt_trial, n_trials
+
+    def _run_tracking_optimization(self):
+        motors            = list(self._optimization_parameters.move_motors_ranges.keys())
+        current_positions = dict(zip(motors, movers.get_absolute_positions(self._focusing_system, motors)))
+        optimal_positions = self._tracking_state["optimal_positions"]
+        optimal_values    = self._tracking_state["optimal_values"]
+
+        opt_trial = self._get_optimizer(motor_ranges=self._get_trust_region_ranges(optimal_positions, current_positions))
+
+        current_values = opt_trial.get_current_loss()
+        print("Tracking: current loss", current_values, ", loss at the last optimum", optimal_values)
+
+        if self._is_loss_degraded(current_values, optimal_values):
+            print("Tracking: loss degraded beyond the escalation threshold, running a full optimization.")
+            return self._run_full_optimization()
+
+        # previous trials are brought into the reference frame of the new optimizer (relative to the current positions)
+        origin_positions = self._tracking_state["origin_positions"]
+        n_prior_trials   = opt_trial.warm_start(self._tracking_state["trials"],
+                                                offsets={k: origin_positions[k] - current_positions[k] for k in motors},
+                                                start_params={k: optimal_positions[k] - current_positions[k] for k in motors})
+
+        n_trials = self._optimization_parameters.params["n_tracking_trials"]
+        print(f"Tracking: optimizing all motors in the trust region for {n_trials} trials, warm started with {n_prior_trials} previous trials.")
+        opt_trial.trials(n_trials)
+
+        _, values = self._select_best_trial_params(opt_trial)
+
+        if self._is_loss_degraded(values, optimal_values):
+            print("Tracking: local optimization did not recover the last optimum, running a full optimization.")
+            opt_trial, n_full_trials = self._run_full_optimization()
+            n_trials += n_full_trials
+
+        return opt_trial, n_trials
+
+    def _get_trust_region_ranges(self, optimal_positions, current_positions):
+        trust_region = self._optimization_parameters.params["tracking_trust_region"]
+        trust_region_ranges = {}
+        for motor, (r_min, r_max) in self._optimization_parameters.move_motors_ranges.items():
+            half_width = 0.5 * trust_region * (r_max - r_min)
+            center     = numpy.clip(optimal_positions[motor] - current_positions[motor], r_min, r_max)
+            # the current position (0.0) is always enqueued as first trial
+            trust_region_ranges[motor] = [min(max(center - half_width, r_min), 0.0),
+                                          max(min(center + half_width, r_max), 0.0)]
+
+        return trust_region_ranges
+
+    def _get_drift_ranges(self):
+        trust_region = self._optimization_parameters.params["tracking_trust_region"]
+
+        return {motor: [0.5 * trust_region * r_min, 0.5 * trust_region * r_max] for motor, (r_min, r_max) in self._optimization_parameters.move_motors_ranges.items()}
+
+    def _is_loss_degraded(self, values, reference_values):
+        values           = numpy.atleast_1d(values)
+        reference_values = numpy.atleast_1d(reference_values)
+
+        return bool(numpy.any(values - reference_values > self._optimization_parameters.params["tracking_escalation_threshold"] * numpy.abs(reference_values)))
+
+    def _update_tracking_state(self, opt_trial, values):
+        motors = list(self._optimization_parameters.move_motors_ranges.keys())
+
+        self._tracking_state = {
+            "optimal_positions": dict(zip(motors, movers.get_absolute_positions(self._focusing_system, motors))),
+            "optimal_values":    values,
+            "origin_positions":  dict(zip(opt_trial.motor_types, opt_trial.initial_motor_positions)),
+            "trials":            opt_trial.study.trials
+        }
+
+    def _get_study_configuration(self):
+        return {"script": self._get_script_name(),
+                "execution_mode": self._parameters.params.execution_mode,
+                "energy": self._energy}
+
+    def _get_prior_model(self):
+        motors  = list(self._optimization_parameters.move_motors_ranges.keys())
+        records = self._study_archive.search(BEAMLINE_NAME, motors, self._optimization_parameters.params["loss_parameters"], **self._get_study_configuration())
+
+        if len(records) == 0:
+            print("No archived studies for this configuration: optimization without prior knowledge")
+            return None
+
+        print(f"Fitting the prior model on {len(records)} archived studies")
+        return fit_prior_model(self._study_archive.load(records),
+                               motor_types=motors,
+                               loss_parameters=self._optimization_parameters.params["loss_parameters"],
+                               random_seed=self._parameters.params.random_seed)
+
+    def _select_best_trial_params(self, opt_trial):
+        return opt_trial.select_best_trial_params(opt_trial.study.best_trials, algorithm=self._optimization_parameters.params["selection_algorithm"])
+
+    def _get_optimizer(self, motor_ranges=None, **kwargs):
         opt_trial = OptunaOptimizer(calculation_parameters=self._parameters.params,
                                     focusing_system=self._focusing_system,
                                     motor_types=list(self._optimization_parameters.move_motors_ranges.keys()),
@@ -493,13 +669,16 @@ class GenericScript(AbstractCMDScript):
         
         moo_thresholds, constraints = self._get_optimizer_moo_thresholds_and_contraints(opt_trial)
 
+        if motor_ranges is None: motor_ranges = self._optimization_parameters.move_motors_ranges
+
         opt_trial.set_optimizer_options(
-            motor_ranges=list(self._optimization_parameters.move_motors_ranges.values()),
+            motor_ranges=list(motor_ranges.values()),
             raise_prune_exception=True,
             use_discrete_space=True,
             sum_intensity_threshold=self._optimization_parameters.params["sum_intensity_hard_constraint"],
             constraints=constraints,
-            moo_thresholds=moo_thresholds
+            moo_thresholds=moo_thresholds,
+            prior_model=self._prior_model
         )
 
         return opt_trial
@@ -50,9 +50,8 @@ import numpy
 import Shadow
 
 from orangecontrib.shadow.util.shadow_objects import ShadowOpticalElement, ShadowBeam
-from orangecontrib.shadow.widgets.special_elements.bl import hybrid_control
 from aps.ai.autoalignment.beamline28IDB.simulation.shadow.focusing_optics.focusing_optics_common import FocusingOpticsCommonAbstract
-from aps.ai.autoalignment.common.util.shadow.common import HybridFailureException, get_hybrid_input_parameters
+from aps.ai.autoalignment.common.util.shadow.common import HybridFailureException
 
 from aps.ai.autoalignment.beamline28IDB.simulation.shadow.focusing_optics.calibrated_bender import TwoMotorsCalibratedBenderManager, OneMotorCalibratedBenderManager, HKBMockWidget
 from aps.ai.autoalignment.common.facade.parameters import Movement, AngularUnits, DistanceUnits
@@ -188,6 +187,10 @@ class BendableFocusingOptics(FocusingOpticsCommonAbstract):
         self._h_bendable_mirror = [ShadowOpticalElement(h_bendable_mirror_up), ShadowOpticalElement(h_bendable_mirror_down)]
         self._v_bimorph_mirror = ShadowOpticalElement(v_bimorph_mirror)
 
+    def _discard_pilot_trace(self):
+        self.__hkb_bender_manager.q_upstream_previous   = None # the bender surface was fitted on the pilot rays
+        self.__hkb_bender_manager.q_downstream_previous = None
+
     def _trace_h_bendable_mirror(self, near_field_calculation, random_seed, remove_lost_rays, verbose):
         upstream_widget   = self.__hkb_bender_manager._kb_upstream
         downstream_widget = self.__hkb_bender_manager._kb_downstream
@@ -268,30 +271,32 @@ class BendableFocusingOptics(FocusingOpticsCommonAbstract):
                                                 oe_name="H-KB_DOWNSTREAM",
                                                 remove_lost_rays=False)
 
-        def run_hybrid(output_beam, increment):
+        def get_hybrid_parameters(increment):
             # NOTE: Near field not possible for vkb (beam is untraceable)
-            try:
-                if not near_field_calculation:
-                    return hybrid_control.hy_run(get_hybrid_input_parameters(output_beam,
-                                                                             diffraction_plane=2,  # Tangential
-                                                                             calcType=3,  # Diffraction by Mirror Size + Errors
-                                                                             verbose=verbose,
-                                                                             random_seed=None if random_seed is None else (random_seed + increment))).ff_beam
-                else:
-                    return hybrid_control.hy_run(get_hybrid_input_parameters(output_beam,
-                                                                             diffraction_plane=2,  # Tangential
-                                                                             calcType=3,  # Diffraction by Mirror Size + Errors
-                                                                             nf=1,
-                                                                             image_distance=self._h_bendable_mirror[0]._oe.T_IMAGE + self._v_bimorph_mirror._oe.T_SOURCE + self._v_bimorph_mirror._oe.T_IMAGE,
-                                                                             verbose=verbose,
-                                                                             random_seed=None if random_seed is None else (random_seed + increment))).nf_beam
-            except Exception:
-                raise HybridFailureException(oe="V-KB")
-
-        output_beam_upstream = run_hybrid(output_beam_upstream, increment=200)
-        output_beam_upstream._beam.rays = output_beam_upstream._beam.rays[upstream_beam_cursor]
-
-        output_beam_downstream = run_hybrid(output_beam_downstream, increment=201)
+            if not near_field_calculation:
+                return "ff_beam", dict(diffraction_plane=2,  # Tangential
+                                       calcType=3,  # Diffraction by Mirror Size + Errors
+                                       verbose=verbose,
+                                       random_seed=None if random_seed is None else (random_seed + increment))
+            else:
+                return "nf_beam", dict(diffraction_plane=2,  # Tangential
+                                       calcType=3,  # Diffraction by Mirror Size + Errors
+                                       nf=1,
+                                       image_distance=self._h_bendable_mirror[0]._oe.T_IMAGE + self._v_bimorph_mirror._oe.T_SOURCE + self._v_bimorph_mirror._oe.T_IMAGE,
+                                       verbose=verbose,
+                                       random_seed=None if random_seed is None else (random_seed + increment))
+
+        # the two sides of the mirror are independent: concurrent HYBRID calculations with n_hybrid_processes > 1
+        beam_type, hybrid_parameters_upstream   = get_hybrid_parameters(increment=200)
+        _,         hybrid_parameters_downstream = get_hybrid_parameters(increment=201)
+
+        try:
+            output_beam_upstream, output_beam_downstream = self._run_hybrid_concurrently([(output_beam_upstream,   beam_type, hybrid_parameters_upstream),
+                                                                                          (output_beam_downstream, beam_type, hybrid_parameters_downstream)])
+        except Exception:
+            raise HybridFailureException(oe="V-KB")
+
+        output_beam_upstream._beam.rays   = output_beam_upstream._beam.rays[upstream_beam_cursor]
         output_beam_downstream._beam.rays = output_beam_downstream._beam.rays[downstream_beam_cursor]
 
         output_beam = ShadowBeam.mergeBeams(output_beam_upstream, output_beam_downstream, which_flux=3, merge_history=0)
@@ -312,18 +317,20 @@ class BendableFocusingOptics(FocusingOpticsCommonAbstract):
         def run_hybrid(output_beam, increment):
             try:
                 if not near_field_calculation:
-                    return hybrid_control.hy_run(get_hybrid_input_parameters(output_beam,
-                                                                             diffraction_plane=2,  # Tangential
-                                                                             calcType=3,  # Diffraction by Mirror Size
-                                                                             verbose=verbose,
-                                                                             random_seed=None if random_seed is None else (random_seed + increment))).ff_beam
+                    return self._run_hybrid(output_beam,
+                                            beam_type="ff_beam",
+                                            diffraction_plane=2,  # Tangential
+                                            calcType=3,  # Diffraction by Mirror Size
+                                            verbose=verbose,
+                                            random_seed=None if random_seed is None else (random_seed + increment))
                 else:
-                    return hybrid_control.hy_run(get_hybrid_input_parameters(output_beam,
-                                                                             diffraction_plane=2,  # Tangential
-                                                                             calcType=3,  # Diffraction by Mirror Size
-                                                                             nf=1,
-                                                                             verbose=verbose,
-                                                                             random_seed=None if random_seed is None else (random_seed + increment))).nf_beam
+                    return self._run_hybrid(output_beam,
+                                            beam_type="nf_beam",
+                                            diffraction_plane=2,  # Tangential
+                                            calcType=3,  # Diffraction by Mirror Size
+                                            nf=1,
+                                            verbose=verbose,
+                                            random_seed=None if random_seed is None else (random_seed + increment))
             except Exception as e:
                 print(e)
                 raise HybridFailureException(oe="V-KB")
@@ -48,11 +48,13 @@ import numpy
 
 from orangecontrib.shadow.util.shadow_util import ShadowPhysics
 
-from aps.ai.autoalignment.common.util.shadow.common import TTYInibitor, PreProcessorFiles, write_reflectivity_file, plot_shadow_beam_spatial_distribution
+from aps.ai.autoalignment.common.util.shadow.common import TTYInibitor, PreProcessorFiles, EmptyBeamException, HybridFailureException, EarlyAbortException, write_reflectivity_file, plot_shadow_beam_spatial_distribution
 from aps.ai.autoalignment.common.simulation.shadow.focusing_optics import AbstractShadowFocusingOptics
 from aps.ai.autoalignment.beamline28IDB.simulation.facade.focusing_optics_interface import AbstractSimulatedFocusingOptics, get_default_input_features, Layout
 from aps.ai.autoalignment.common.facade.parameters import MotorResolutionRegistry
 
+DEFAULT_PILOT_FRACTION = 0.1
+
 class FocusingOpticsCommonAbstract(AbstractShadowFocusingOptics, AbstractSimulatedFocusingOptics):
     def __init__(self):
         super(FocusingOpticsCommonAbstract, self).__init__()
@@ -108,35 +110,29 @@ class FocusingOpticsCommonAbstract(AbstractShadowFocusingOptics, AbstractSimulat
         except: debug_mode = False
         try:    random_seed = kwargs["random_seed"]
         except: random_seed = None
+        # progressive tracing: early_abort_check(pilot_beam, pilot_fraction) -> True to abort
+        try:    early_abort_check = kwargs["early_abort_check"]
+        except: early_abort_check = None
+        try:    pilot_fraction = kwargs["pilot_fraction"]
+        except: pilot_fraction = DEFAULT_PILOT_FRACTION
 
         if self._input_beam is None: raise ValueError("Focusing Optical System is not initialized")
 
-        self._input_beam = self._check_beam(self._input_beam, "Primary Optical System", remove_lost_rays)
+        self._input_beam = self._check_beam(self._input_beam, "Primary Optical System", remove_lost_rays) # a shared input beam is copied if it has lost rays
 
         if not verbose:
             fortran_suppressor = TTYInibitor()
             fortran_suppressor.start()
 
-        output_beam = None
-
         try:
             run_all = self._modified_elements == [] or len(self._modified_elements) == 2
 
-            if run_all or self._h_bendable_mirror in self._modified_elements:
-                self._h_bendable_mirror_beam = self._trace_h_bendable_mirror(False, random_seed, remove_lost_rays, verbose)
-                if near_field_calculation: self._h_bendable_mirror_beam_nf = self._trace_h_bendable_mirror(True, random_seed, remove_lost_rays, verbose)
-                else:                      self._h_bendable_mirror_beam_nf = None
-                output_beam    = self._h_bendable_mirror_beam
-
-                if debug_mode: plot_shadow_beam_spatial_distribution(self._h_bendable_mirror_beam, title="H-Bendable-Mirror", xrange=None, yrange=None)
-
-            if run_all or self._v_bimorph_mirror in self._modified_elements:
-                if near_field_calculation: self._v_bimorph_mirror_beam    = self.__generate_v_bimorph_mirror_beam_nf(remove_lost_rays, random_seed, verbose)
-                else:                      self._v_bimorph_mirror_beam, _ = self._trace_v_bimorph_mirror(False, random_seed, remove_lost_rays, verbose)
-
-                output_beam = self._v_bimorph_mirror_beam
-
-                if debug_mode: plot_shadow_beam_spatial_distribution(self._v_bimorph_mirror_beam, title="V-Bimorph-Mirror", xrange=None, yrange=None)
+            # the pilot trace is worth only when the H mirror (bender + 2 HYBRID runs) has to be retraced.
+            # Near field calculation needs the ray-by-ray correspondence of the two mirrors, so it is always complete
+            if not early_abort_check is None and not near_field_calculation and (run_all or self._h_bendable_mirror in self._modified_elements):
+                output_beam = self.__trace_progressively(early_abort_check, pilot_fraction, random_seed, remove_lost_rays, debug_mode, verbose)
+            else:
+                output_beam = self.__trace_modified_elements(run_all, near_field_calculation, random_seed, remove_lost_rays, debug_mode, verbose)
 
             # after every run, the list of modified elements must be empty
             self._modified_elements = []
@@ -154,6 +150,63 @@ class FocusingOpticsCommonAbstract(AbstractShadowFocusingOptics, AbstractSimulat
 
         return output_beam.duplicate(history=False)
 
+    def __trace_modified_elements(self, run_all, near_field_calculation, random_seed, remove_lost_rays, debug_mode, verbose):
+        output_beam = None
+
+        if run_all or self._h_bendable_mirror in self._modified_elements:
+            self._h_bendable_mirror_beam = self._trace_h_bendable_mirror(False, random_seed, remove_lost_rays, verbose)
+            if near_field_calculation: self._h_bendable_mirror_beam_nf = self._trace_h_bendable_mirror(True, random_seed, remove_lost_rays, verbose)
+            else:                      self._h_bendable_mirror_beam_nf = None
+            output_beam    = self._h_bendable_mirror_beam
+
+            if debug_mode: plot_shadow_beam_spatial_distribution(self._h_bendable_mirror_beam, title="H-Bendable-Mirror", xrange=None, yrange=None)
+
+        if run_all or self._v_bimorph_mirror in self._modified_elements:
+            if near_field_calculation: self._v_bimorph_mirror_beam    = self.__generate_v_bimorph_mirror_beam_nf(remove_lost_rays, random_seed, verbose)
+            else:                      self._v_bimorph_mirror_beam, _ = self._trace_v_bimorph_mirror(False, random_seed, remove_lost_rays, verbose)
+
+            output_beam = self._v_bimorph_mirror_beam
+
+            if debug_mode: plot_shadow_beam_spatial_distribution(self._v_bimorph_mirror_beam, title="V-Bimorph-Mirror", xrange=None, yrange=None)
+
+        return output_beam
+
+    def __trace_progressively(self, early_abort_check, pilot_fraction, random_seed, remove_lost_rays, debug_mode, verbose):
+        full_input_beam = self._input_beam
+        n_rays          = full_input_beam._beam.rays.shape[0]
+        step            = max(1, int(round(1 / pilot_fraction)))
+
+        if step > 1 and n_rays >= 2 * step:
+            pilot_cursor = numpy.zeros(n_rays, dtype=bool)
+            pilot_cursor[::step] = True # evenly spread subset: the source rays are already randomly sampled
+
+            # the pilot is only used for the abort decision: geometric trace (HYBRID is not reliable with few rays),
+            # then discarded. Failures of the pilot are left to the complete trace.
+            try:
+                self._input_beam     = self.__get_sub_beam(full_input_beam, pilot_cursor)
+                self._geometric_only = True
+
+                pilot_beam = self.__trace_modified_elements(True, False, random_seed, remove_lost_rays, False, verbose)
+            except (EmptyBeamException, HybridFailureException):
+                pilot_beam = None
+            finally:
+                self._input_beam        = full_input_beam
+                self._geometric_only    = False
+                self._modified_elements = [self._h_bendable_mirror, self._v_bimorph_mirror] # the cached beams are the pilot ones
+                self._discard_pilot_trace()
+
+            if not pilot_beam is None and early_abort_check(pilot_beam, numpy.count_nonzero(pilot_cursor) / n_rays):
+                raise EarlyAbortException("beam out of bounds or below the intensity threshold")
+
+        return self.__trace_modified_elements(True, False, random_seed, remove_lost_rays, debug_mode, verbose)
+
+    @classmethod
+    def __get_sub_beam(cls, beam, cursor):
+        sub_beam = beam.duplicate(history=False)
+        sub_beam._beam.rays = sub_beam._beam.rays[cursor]
+
+        return sub_beam
+
     def __generate_v_bimorph_mirror_beam_nf(self, remove_lost_rays, random_seed, verbose):
         v_bimorph_mirror_beam, go_orig = self._trace_v_bimorph_mirror(True, random_seed, False, verbose)
         go = numpy.where(v_bimorph_mirror_beam._beam.rays[:, 9] == 1)
@@ -170,6 +223,7 @@ class FocusingOpticsCommonAbstract(AbstractShadowFocusingOptics, AbstractSimulat
 
         return v_bimorph_mirror_beam
 
+    def _discard_pilot_trace(self): pass # state computed on the pilot rays, to be recomputed on the complete beam
     def _trace_h_bendable_mirror(self, near_field_calculation, random_seed, remove_lost_rays, verbose): raise NotImplementedError()
     def _trace_v_bimorph_mirror(self,  near_field_calculation, random_seed, remove_lost_rays, verbose): raise NotImplementedError()
     def _initialize_mirrors(self, input_features, reflectivity_file, h_bendable_mirror_error_profile_file): raise NotImplementedError()
@@ -44,6 +44,7 @@
 # ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
 # POSSIBILITY OF SUCH DAMAGE.                                             #
 # ----------------------------------------------------------------------- #
+from contextlib import nullcontext
 
 from aps.ai.autoalignment.common.facade.parameters import AngularUnits, DistanceUnits, Movement
 from aps.ai.autoalignment.common.hardware.facade.parameters import Directions
@@ -58,6 +59,8 @@ class __BlueskyFocusingOptics():
     def initialize(self, **kwargs):
         pass
 
+    def position_snapshot(self): return nullcontext()
+
     #####################################################################################
     # This methods represent the run-time interface, to interact with the optical system
     # in real time, like in the real beamline
@@ -55,6 +55,7 @@ from aps.ai.autoalignment.common.facade.parameters import AngularUnits, Distance
 from aps.ai.autoalignment.common.hardware.facade.parameters import Beamline, Directions
 
 from aps.ai.autoalignment.common.hardware.epics.focusing_optics import AbstractEpicsOptics
+from aps.ai.autoalignment.common.hardware.epics.watchdog import OperationType
 from aps.ai.autoalignment.beamline34IDC.facade.focusing_optics_interface import AbstractFocusingOptics
 
 def epics_focusing_optics_factory_method(**kwargs):
@@ -94,7 +95,14 @@ class Motors:
 class __EpicsFocusingOptics(AbstractEpicsOptics, AbstractFocusingOptics):
     
     def __init__(self, **kwargs):
-        super().__init__(translational_units=DistanceUnits.MICRON, angular_units=AngularUnits.MILLIRADIANS)
+        try:    move_planner = kwargs["move_planner"] # approach direction/backlash of the motors (keys: PV names)
+        except: move_planner = None
+        try:    watchdog = kwargs["watchdog"] # timing budgets and retries of the hardware operations
+        except: watchdog = None
+        try:    position_cache = kwargs["position_cache"] # monitored positions of the motors
+        except: position_cache = None
+
+        super().__init__(translational_units=DistanceUnits.MICRON, angular_units=AngularUnits.MILLIRADIANS, move_planner=move_planner, watchdog=watchdog, position_cache=position_cache)
 
         try:    beamline = kwargs["beamline"]
         except: beamline = Beamline.REAL
@@ -166,7 +174,7 @@ class __EpicsFocusingOptics(AbstractEpicsOptics, AbstractFocusingOptics):
         return self._get_translational_motor_position(Motors.HKB_MOTOR_1[self.__beamline], units)
 
     def move_hkb_motor_2_bender(self, pos_downstream, movement=Movement.ABSOLUTE, units=DistanceUnits.MICRON):
-        self.__move_translational_motor(Motors.HKB_MOTOR_2[self.__beamline], pos_downstream, movement, units)
+        self._move_translational_motor(Motors.HKB_MOTOR_2[self.__beamline], pos_downstream, movement, units)
 
     def get_hkb_motor_2_bender(self, units=DistanceUnits.MICRON): 
         return self._get_translational_motor_position(Motors.HKB_MOTOR_2[self.__beamline], units)
@@ -175,7 +183,7 @@ class __EpicsFocusingOptics(AbstractEpicsOptics, AbstractFocusingOptics):
         self._move_rotational_motor(Motors.HKB_MOTOR_3[self.__beamline], angle, movement, units)
         
     def get_hkb_motor_3_pitch(self, units=AngularUnits.MILLIRADIANS): 
-        return self.__get_rotational_motor_angle(Motors.HKB_MOTOR_3[self.__beamline], units)
+        return self._get_rotational_motor_angle(Motors.HKB_MOTOR_3[self.__beamline], units)
 
     def move_hkb_motor_4_translation(self, translation, movement=Movement.ABSOLUTE, units=DistanceUnits.MICRON): 
         self._move_translational_motor(Motors.HKB_MOTOR_4[self.__beamline], translation, movement, units)
@@ -217,11 +225,10 @@ class __EpicsFocusingOptics(AbstractEpicsOptics, AbstractFocusingOptics):
 
         for i in range(steps):
             motor.put(first + i * stepsize)
-            Scan.ACQUIRE[self.__beamline].put(1)
-
-            time.sleep(0.2)
 
-            while Scan.ACQUIRE[self.__beamline].get() != 0: time.sleep(0.1)
+            self.watchdog.run(Scan.ACQUIRE[self.__beamline].pvname, OperationType.IMAGE_ACQUISITION,
+                              function=self.__acquire,
+                              recovery=lambda: Scan.ACQUIRE[self.__beamline].put(0)) # stop the acquisition
     
             data[i, 0] = i * stepsize + first
             data[i, 1] = COUNTS.get()
@@ -230,3 +237,11 @@ class __EpicsFocusingOptics(AbstractEpicsOptics, AbstractFocusingOptics):
         motor.put(data[numpy.argmax(data[:, 1]), 0])
 
         return data
+
+    def __acquire(self):
+        ACQUIRE = Scan.ACQUIRE[self.__beamline]
+        ACQUIRE.put(1)
+
+        time.sleep(0.2)
+
+        self.watchdog.wait_for(ACQUIRE.pvname, OperationType.IMAGE_ACQUISITION, is_done=lambda: ACQUIRE.get() == 0)
@@ -58,7 +58,7 @@ from aps.ai.autoalignment.common.util.shadow.common import EmptyBeamException, H
                                              get_shadow_beam_spatial_distribution, load_shadow_beam
 
 from aps.ai.autoalignment.beamline34IDC.facade.focusing_optics_factory import focusing_optics_factory_method
-from aps.ai.autoalignment.beamline34IDC.optimization_old import configs, movers
+from aps.ai.autoalignment.beamline34IDC.optimization.__OLD__ import configs, movers
 from aps.ai.autoalignment.beamline34IDC.simulation.facade.focusing_optics_interface import get_default_input_features
 
 
@@ -50,8 +50,8 @@ from typing import List, NoReturn, Tuple
 import gym
 import numpy as np
 
-from aps_ai.beamline34IDC.optimization import common as opt_common
-from aps_ai.beamline34IDC.optimization import configs
+from aps.ai.autoalignment.beamline34IDC.optimization.__OLD__ import common as opt_common
+from aps.ai.autoalignment.beamline34IDC.optimization.__OLD__ import configs
 
 
 class BareOptimization(opt_common.OptimizationCommon):
@@ -65,6 +65,15 @@ class BareOptimization(opt_common.OptimizationCommon):
         pass
 
 
+def _get_optimization_backend(surrogate: object = None) -> type:
+    """With a surrogate (see openai_rl_vec_gym.BeamSurrogate), the focusing system is replaced by the surrogate model."""
+    if surrogate is None: return BareOptimization
+
+    from aps.ai.autoalignment.beamline34IDC.optimization.__OLD__.openai_rl_vec_gym import SurrogateFocusingSystem, SurrogateOptimization
+
+    return lambda focusing_system, *args, **kwargs: SurrogateOptimization(SurrogateFocusingSystem(surrogate), *args, **kwargs)
+
+
 class AdaptiveCameraEnv(gym.Env):
     """Where the camera center and resolution is adaptive.
 
@@ -83,10 +92,11 @@ class AdaptiveCameraEnv(gym.Env):
         use_gaussian_fit: bool = False,
         camera_count_scaling_factor: float = 1.0,
         verbose: bool = False,
+        surrogate: object = None,
     ):
         super().__init__()
         self._verbose = verbose
-        self.optimizer = BareOptimization(
+        self.optimizer = _get_optimization_backend(surrogate)(
             focusing_system,
             motor_types,
             random_seed=random_seed,
@@ -195,10 +205,11 @@ class FixedCameraEnv(gym.Env):
         use_gaussian_fit: bool = False,
         camera_count_scaling_factor: float = 1.0,
         verbose: bool = False,
+        surrogate: object = None,
     ):
         super().__init__()
         self._verbose = verbose
-        self.optimizer = BareOptimization(
+        self.optimizer = _get_optimization_backend(surrogate)(
             focusing_system,
             motor_types,
             random_seed=random_seed,
@@ -0,0 +1,409 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------- #
+# Copyright (c) 2021, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2021. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# ----------------------------------------------------------------------- #
+
+"""
+Vectorized version of the camera environments: N environments stepped in parallel worker processes (SubprocCameraVecEnv)
+or sequentially (DummyCameraVecEnv, useful with the surrogate backend). Observations are stacked along a first axis of
+size N, environments are automatically reset at the end of an episode (the last observation is in
+info["terminal_observation"]).
+
+The surrogate backend (BeamSurrogate) is trained from traces recorded on the real simulator (TraceRecorder) and
+keeps the same observation and action spaces, so that a policy pretrained on it can be fine-tuned on SHADOW.
+"""
+
+import os
+import multiprocessing
+from typing import Callable, Dict, List, Tuple
+
+import gym
+import joblib
+import numpy as np
+
+from aps.ai.autoalignment.common.facade.parameters import Movement
+from aps.ai.autoalignment.common.util.common import DictionaryWrapper, Histogram
+from aps.ai.autoalignment.beamline34IDC.optimization.__OLD__ import movers
+from aps.ai.autoalignment.beamline34IDC.optimization.__OLD__.common import BeamState
+from aps.ai.autoalignment.beamline34IDC.optimization.__OLD__.openai_rl_gym import BareOptimization
+
+BEAM_PARAMETERS = ["h_centroid", "v_centroid", "h_sigma", "v_sigma", "integral_intensity"]
+
+# --------------------------------------------------------------------------------------------
+# SURROGATE BACKEND
+# --------------------------------------------------------------------------------------------
+
+class TraceRecorder(gym.Wrapper):
+    """Records motor movements (relative to the initial positions) and beam parameters at each reset/step of a camera environment."""
+    def __init__(self, env: gym.Env):
+        super().__init__(env)
+        self.positions        = []
+        self.beam_parameters  = []
+        self.hh = None
+        self.vv = None
+
+    def reset(self, **kwargs):
+        observation = self.env.reset(**kwargs)
+        self.__record()
+        return observation
+
+    def step(self, action):
+        observation, reward, done, info = self.env.step(action)
+        self.__record()
+        return observation, reward, done, info
+
+    def __record(self):
+        optimizer = self.env.optimizer
+        positions = np.array(movers.get_absolute_positions(optimizer.focusing_system, optimizer.motor_types)) - np.array(optimizer.initial_motor_positions)
+        dw        = optimizer.beam_state.dw
+
+        self.positions.append(positions)
+        self.beam_parameters.append(np.zeros(len(BEAM_PARAMETERS)) if dw is None else np.array([dw.get_parameter(p) for p in BEAM_PARAMETERS]))
+        if self.hh is None: self.hh, self.vv = optimizer.beam_state.hist.hh, optimizer.beam_state.hist.vv
+
+    def get_traces(self) -> Dict:
+        return {"motor_types":     list(self.env.optimizer.motor_types),
+                "positions":       np.array(self.positions),
+                "beam_parameters": np.array(self.beam_parameters),
+                "hh":              self.hh,
+                "vv":              self.vv}
+
+    def save_traces(self, file_name: str):
+        joblib.dump(self.get_traces(), file_name)
+
+class BeamSurrogate:
+    """
+    Quadratic (ridge) regression of centroids, log-sigmas and log-intensity of the beam as function of the motor
+    movements: the camera image is rendered as a 2D gaussian on the recorded camera bins.
+    """
+    def __init__(self, motor_types: List[str], hh: np.ndarray, vv: np.ndarray, regularization: float = 1e-6):
+        self.motor_types     = motor_types
+        self.hh              = hh
+        self.vv              = vv
+        self._regularization = regularization
+        self._coefficients   = None
+        self._scale          = None
+
+    @classmethod
+    def fit_from_traces(cls, traces: List[Dict], regularization: float = 1e-6):
+        motor_types = traces[0]["motor_types"]
+        for trace in traces:
+            if trace["motor_types"] != motor_types: raise ValueError("Traces recorded with different motors")
+
+        surrogate = BeamSurrogate(motor_types, traces[0]["hh"], traces[0]["vv"], regularization)
+        surrogate.fit(np.concatenate([trace["positions"] for trace in traces]), np.concatenate([trace["beam_parameters"] for trace in traces]))
+
+        return surrogate
+
+    def fit(self, positions: np.ndarray, beam_parameters: np.ndarray):
+        beam = beam_parameters[:, 4] > 0 # the beam out of the camera is modeled by the intensity only
+        if not np.any(beam): raise ValueError("No beam in the recorded traces")
+
+        self._scale = np.maximum(np.abs(positions).max(axis=0), 1e-12)
+        features    = self._get_features(positions)
+        targets     = np.column_stack([beam_parameters[:, 0],
+                                       beam_parameters[:, 1],
+                                       np.log(np.maximum(beam_parameters[:, 2], 1e-12)),
+                                       np.log(np.maximum(beam_parameters[:, 3], 1e-12)),
+                                       np.log1p(beam_parameters[:, 4])])
+
+        self._coefficients = np.zeros((features.shape[1], targets.shape[1]))
+        self._coefficients[:, :4] = self.__solve(features[beam], targets[beam, :4])
+        self._coefficients[:, 4:] = self.__solve(features, targets[:, 4:])
+
+    def __solve(self, features, targets):
+        a = features.T @ features + self._regularization * np.eye(features.shape[1])
+        return np.linalg.solve(a, features.T @ targets)
+
+    def _get_features(self, positions: np.ndarray) -> np.ndarray:
+        x = np.atleast_2d(positions) / self._scale
+        i, j = np.triu_indices(x.shape[1])
+        return np.column_stack([np.ones(x.shape[0]), x, x[:, i] * x[:, j]])
+
+    def predict(self, positions: np.ndarray) -> np.ndarray:
+        """Beam parameters (see BEAM_PARAMETERS), shape (n, 5), for motor movements of shape (n, n_motors)."""
+        prediction = self._get_features(positions) @ self._coefficients
+
+        return np.column_stack([prediction[:, 0], prediction[:, 1], np.exp(prediction[:, 2]), np.exp(prediction[:, 3]), np.expm1(prediction[:, 4])])
+
+    def get_beam_state(self, positions: np.ndarray) -> BeamState:
+        h_centroid, v_centroid, h_sigma, v_sigma, intensity = self.predict(positions)[0]
+
+        if intensity < 1.0: return BeamState(None, None, None)
+
+        profile_h = np.exp(-0.5 * ((self.hh - h_centroid) / h_sigma) ** 2)
+        profile_v = np.exp(-0.5 * ((self.vv - v_centroid) / v_sigma) ** 2)
+        data_2D   = np.outer(profile_h, profile_v)
+        if data_2D.sum() == 0: return BeamState(None, None, None) # out of the camera
+        data_2D  *= intensity / data_2D.sum()
+
+        return BeamState(None,
+                         Histogram(hh=self.hh, vv=self.vv, data_2D=data_2D),
+                         DictionaryWrapper(h_sigma=h_sigma,
+                                           h_fwhm=2.355 * h_sigma,
+                                           h_centroid=h_centroid,
+                                           h_peak=self.hh[np.argmax(profile_h)],
+                                           v_sigma=v_sigma,
+                                           v_fwhm=2.355 * v_sigma,
+                                           v_centroid=v_centroid,
+                                           v_peak=self.vv[np.argmax(profile_v)],
+                                           integral_intensity=data_2D.sum(),
+                                           peak_intensity=np.average(data_2D[np.where(data_2D >= np.max(data_2D) * 0.95)]),
+                                           gaussian_fit={}))
+
+class SurrogateFocusingSystem:
+    """Stand-in of the focusing system for the movers: motor positions are movements relative to the start."""
+    __MOTOR_METHODS = {"hkb_4": "hkb_motor_4_translation",
+                       "hkb_3": "hkb_motor_3_pitch",
+                       "vkb_4": "vkb_motor_4_translation",
+                       "vkb_3": "vkb_motor_3_pitch",
+                       "hkb_1": "hkb_motor_1_bender",
+                       "hkb_2": "hkb_motor_2_bender",
+                       "vkb_1": "vkb_motor_1_bender",
+                       "vkb_2": "vkb_motor_2_bender"}
+
+    def __init__(self, surrogate: BeamSurrogate):
+        self.surrogate = surrogate
+        self.positions = {motor: 0.0 for motor in self.__MOTOR_METHODS.keys()}
+
+    def __getattr__(self, name):
+        for motor, suffix in SurrogateFocusingSystem.__MOTOR_METHODS.items():
+            if name == "move_" + suffix: return lambda translation, movement=Movement.ABSOLUTE, motor=motor: self.__move(motor, translation, movement)
+            if name == "get_" + suffix:  return lambda motor=motor: self.positions[motor]
+        if name in ["get_hkb_q_distance", "get_vkb_q_distance"]: return lambda: np.nan
+
+        raise AttributeError(name)
+
+    def __move(self, motor, translation, movement):
+        if movement == Movement.RELATIVE: self.positions[motor] += translation
+        else:                             self.positions[motor] = translation
+
+    def get_beam_state(self) -> BeamState:
+        return self.surrogate.get_beam_state(np.array([self.positions[motor] for motor in self.surrogate.motor_types]))
+
+class SurrogateOptimization(BareOptimization):
+    def _update_beam_state(self) -> bool:
+        current_beam, current_hist, current_dw = self.focusing_system.get_beam_state()
+
+        if current_hist is None:
+            current_hist = Histogram(hh=self.focusing_system.surrogate.hh,
+                                     vv=self.focusing_system.surrogate.vv,
+                                     data_2D=np.zeros((len(self.focusing_system.surrogate.hh), len(self.focusing_system.surrogate.vv))))
+        self.beam_state = BeamState(current_beam, current_hist, current_dw)
+        return True
+
+# --------------------------------------------------------------------------------------------
+# VECTORIZED ENVIRONMENTS
+# --------------------------------------------------------------------------------------------
+
+def make_camera_env_fns(env_class: type,
+                        n_envs: int,
+                        motor_types: List[str],
+                        focusing_system_fn: Callable[[], object] = None,
+                        surrogate: BeamSurrogate = None,
+                        random_seed: int = None,
+                        **env_kwargs) -> List[Callable[[], gym.Env]]:
+    """
+    Builders of N camera environments (AdaptiveCameraEnv or FixedCameraEnv), each one with an independent random seed.
+    The focusing system is built inside the worker (focusing_system_fn) or replaced by the surrogate.
+    """
+    if (focusing_system_fn is None) == (surrogate is None): raise ValueError("Supply one of focusing_system_fn and surrogate")
+
+    seeds = [int(seed_sequence.generate_state(1)[0]) for seed_sequence in np.random.SeedSequence(random_seed).spawn(n_envs)]
+
+    def get_env_fn(seed):
+        def env_fn():
+            np.random.seed(seed) # initialization of the episodes
+            if surrogate is None: return env_class(focusing_system_fn(), motor_types, random_seed=seed, **env_kwargs)
+            else:                 return env_class(None, motor_types, random_seed=seed, surrogate=surrogate, **env_kwargs)
+        return env_fn
+
+    return [get_env_fn(seed) for seed in seeds]
+
+class CameraVecEnv:
+    def __init__(self, n_envs: int, observation_space: gym.Space, action_space: gym.Space):
+        self.n_envs            = n_envs
+        self.observation_space = observation_space
+        self.action_space      = action_space
+
+    def reset(self) -> Dict[str, np.ndarray]: raise NotImplementedError()
+    def step_async(self, actions: np.ndarray): raise NotImplementedError()
+    def step_wait(self) -> Tuple[Dict[str, np.ndarray], np.ndarray, np.ndarray, List[Dict]]: raise NotImplementedError()
+    def env_method(self, method_name: str, *args, **kwargs) -> List: raise NotImplementedError()
+    def get_attr(self, attr_name: str) -> List: raise NotImplementedError()
+    def close(self): pass
+
+    def step(self, actions: np.ndarray) -> Tuple[Dict[str, np.ndarray], np.ndarray, np.ndarray, List[Dict]]:
+        self.step_async(actions)
+        return self.step_wait()
+
+    def set_initialization_range_per_motor(self, range_per_motor: List[float]):
+        self.env_method("set_initialization_range_per_motor", range_per_motor)
+
+    @classmethod
+    def _stack_observations(cls, observations: List[Dict[str, np.ndarray]]) -> Dict[str, np.ndarray]:
+        return {key: np.stack([observation[key] for observation in observations]) for key in observations[0].keys()}
+
+    @classmethod
+    def _step_env(cls, env: gym.Env, action: np.ndarray) -> Tuple:
+        observation, reward, done, info = env.step(action)
+        if done:
+            info["terminal_observation"] = observation
+            observation = env.reset()
+        return observation, reward, done, info
+
+class DummyCameraVecEnv(CameraVecEnv):
+    def __init__(self, env_fns: List[Callable[[], gym.Env]]):
+        self.envs = [env_fn() for env_fn in env_fns]
+        super(DummyCameraVecEnv, self).__init__(len(self.envs), self.envs[0].observation_space, self.envs[0].action_space)
+        self.__actions = None
+
+    def reset(self):
+        return self._stack_observations([env.reset() for env in self.envs])
+
+    def step_async(self, actions):
+        self.__actions = actions
+
+    def step_wait(self):
+        observations, rewards, dones, infos = zip(*[self._step_env(env, action) for env, action in zip(self.envs, self.__actions)])
+        return self._stack_observations(observations), np.array(rewards), np.array(dones), list(infos)
+
+    def env_method(self, method_name, *args, **kwargs):
+        return [getattr(env, method_name)(*args, **kwargs) for env in self.envs]
+
+    def get_attr(self, attr_name):
+        return [getattr(env, attr_name) for env in self.envs]
+
+    def close(self):
+        for env in self.envs: env.close()
+
+def _worker(remote, parent_remote, env_fn, working_directory):
+    parent_remote.close()
+    # SHADOW writes its files in the current directory
+    if working_directory is not None:
+        os.makedirs(working_directory, exist_ok=True)
+        os.chdir(working_directory)
+
+    env = env_fn()
+    while True:
+        command, data = remote.recv()
+        try:
+            if   command == "step":       result = CameraVecEnv._step_env(env, data)
+            elif command == "reset":      result = env.reset()
+            elif command == "env_method": result = getattr(env, data[0])(*data[1], **data[2])
+            elif command == "get_attr":   result = getattr(env, data)
+            elif command == "get_spaces": result = (env.observation_space, env.action_space)
+            elif command == "close":
+                env.close()
+                remote.close()
+                break
+            else: raise ValueError("Unknown command " + str(command))
+            remote.send((True, result))
+        except Exception as e:
+            remote.send((False, e))
+
+class SubprocCameraVecEnv(CameraVecEnv):
+    """
+    Each environment runs in its own process, started with the given multiprocessing start method (fork by default,
+    so that env_fns do not need to be picklable), and possibly in its own working directory.
+    """
+    def __init__(self, env_fns: List[Callable[[], gym.Env]], working_directories: List[str] = None, start_method: str = None):
+        if working_directories is None: working_directories = [None] * len(env_fns)
+        if len(working_directories) != len(env_fns): raise ValueError("One working directory per environment")
+
+        context = multiprocessing.get_context(start_method)
+
+        self.__remotes, work_remotes = zip(*[context.Pipe() for _ in env_fns])
+        self.__processes = []
+        for work_remote, remote, env_fn, working_directory in zip(work_remotes, self.__remotes, env_fns, working_directories):
+            process = context.Process(target=_worker, args=(work_remote, remote, env_fn, working_directory), daemon=True)
+            process.start()
+            self.__processes.append(process)
+            work_remote.close()
+
+        self.__closed = False
+
+        self.__remotes[0].send(("get_spaces", None))
+        observation_space, action_space = self.__receive(self.__remotes[0])
+        super(SubprocCameraVecEnv, self).__init__(len(env_fns), observation_space, action_space)
+
+    @classmethod
+    def __receive(cls, remote):
+        success, result = remote.recv()
+        if not success: raise result
+        return result
+
+    def __receive_all(self):
+        # every pipe is drained before raising the first error, otherwise the next call would read stale replies
+        replies = [remote.recv() for remote in self.__remotes]
+        for success, result in replies:
+            if not success: raise result
+        return [result for _, result in replies]
+
+    def __send_all(self, command, data=None):
+        for remote in self.__remotes: remote.send((command, data))
+        return self.__receive_all()
+
+    def reset(self):
+        return self._stack_observations(self.__send_all("reset"))
+
+    def step_async(self, actions):
+        for remote, action in zip(self.__remotes, actions): remote.send(("step", action))
+
+    def step_wait(self):
+        observations, rewards, dones, infos = zip(*self.__receive_all())
+        return self._stack_observations(observations), np.array(rewards), np.array(dones), list(infos)
+
+    def env_method(self, method_name, *args, **kwargs):
+        return self.__send_all("env_method", (method_name, args, kwargs))
+
+    def get_attr(self, attr_name):
+        return self.__send_all("get_attr", attr_name)
+
+    def close(self):
+        if self.__closed: return
+        for remote in self.__remotes: remote.send(("close", None))
+        for process in self.__processes: process.join()
+        self.__closed = True
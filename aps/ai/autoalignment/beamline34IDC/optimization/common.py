@@ -46,6 +46,7 @@
 # ----------------------------------------------------------------------- #
 
 import abc
+import copy
 from typing import Dict, List, NamedTuple, NoReturn, Tuple, Union
 
 import numpy as np
@@ -67,12 +68,25 @@ from aps.ai.autoalignment.common.util.common import AspectRatio, ColorMap, PlotM
 from aps.ai.autoalignment.common.util.wrappers import get_distribution_info as get_simulated_distribution_info
 from aps.ai.autoalignment.common.util.wrappers import plot_distribution as plot_distribution_internal
 from aps.ai.autoalignment.common.util.common import calculate_projections_over_noise
+from aps.ai.autoalignment.common.util.feasibility import FeasibilityClassifier
+from aps.ai.autoalignment.common.util.noise import NoiseGenerator, get_random_generator
+from aps.ai.autoalignment.common.util.observation_noise import (
+    DEFAULT_N_REPLICATES,
+    ObservationNoiseMethods,
+    get_bootstrap_beams,
+    get_count_weight,
+    get_counting_distribution_info,
+    get_counting_histograms,
+    get_standard_errors,
+)
+from aps.ai.autoalignment.common.util.shadow.compact_beam import CompactBeam, compact_beam, compact_beam_caustic
 from aps.ai.autoalignment.common.util.shadow.common import (
     EmptyBeamException,
     HybridFailureException,
     PreProcessorFiles,
     load_shadow_beam,
 )
+from aps.ai.autoalignment.common.util.shadow.shared_beam import SharedBeamDescriptor, attach_shared_beam
 
 class OptimizationCriteria:
     CENTROID                    = "centroid"
@@ -86,8 +100,10 @@ class OptimizationCriteria:
 
 
 class SelectionAlgorithm:
-    TOPSIS           = "topsis"
-    NASH_EQUILIBRIUM = "nash-equilibrium"
+    TOPSIS             = "topsis"
+    NASH_EQUILIBRIUM   = "nash-equilibrium"
+    KNEE_POINT         = "knee-point"
+    WEIGHTED_CHEBYSHEV = "weighted-chebyshev"
 
 
 class BeamState(NamedTuple):
@@ -123,10 +139,38 @@ class CalculationParameters:
     reference_v : float = 0.0
     save_images : bool = False
     every_n_images : int = 5
+    worker_index : int = None
+    compact_beam : bool = False # keep only good rays and the analysis columns of the simulated beams
+    compact_beam_dtype : str = "float32"
+    compact_beam_tolerance : float = None # if not None, validates every compact beam against the full one
+    common_random_numbers : bool = False # same rays and HYBRID sampling (random_seed) for all the trials: only the explicit noise is random
     rng: np.random.Generator = dt.field(init=False)
+    noise_generator: NoiseGenerator = dt.field(init=False)
 
     def __post_init__(self):
-        self.rng = np.random.default_rng(self.random_seed)
+        if self.common_random_numbers and self.random_seed is None: raise ValueError("Common random numbers need a random_seed")
+
+        self.initialize_random_generators()
+
+    def initialize_random_generators(self):
+        # to be called again whenever random_seed or worker_index are changed after the creation
+        self.rng             = get_random_generator(self.random_seed, self.worker_index)
+        self.noise_generator = NoiseGenerator(get_random_generator(self.random_seed, self.worker_index, trial_number=0))
+
+    def reseed_noise_generator(self, trial_number: int):
+        # independent noise stream for each trial: the result does not depend on the order of execution of the trials
+        self.noise_generator.reseed(get_random_generator(self.random_seed, self.worker_index, trial_number=trial_number))
+
+    def spawn(self, n_workers: int) -> List["CalculationParameters"]:
+        # one copy per parallel worker, each with its own independent random streams
+        workers_parameters = []
+        for worker_index in range(n_workers):
+            worker_parameters = copy.copy(self)
+            worker_parameters.worker_index = worker_index
+            worker_parameters.initialize_random_generators()
+            workers_parameters.append(worker_parameters)
+
+        return workers_parameters
 
 @dt.dataclass
 class PlotParameters:
@@ -156,6 +200,7 @@ def get_distribution_info(cp: CalculationParameters, photon_beam: object = None,
             percentage_fluctuation=cp.percentage_fluctuation,
             calculate_over_noise=cp.calculate_over_noise,
             noise_threshold=cp.noise_threshold,
+            noise_generator=cp.noise_generator,
             **kwargs
         )
     elif cp.execution_mode == ExecutionMode.HARDWARE:
@@ -194,6 +239,7 @@ def get_random_init(cp : CalculationParameters,
                     motor_types_and_ranges: dict = None,
                     verbose : bool = True,
                     intensity_sum_threshold: float = None,
+                    feasibility_classifier: FeasibilityClassifier = None,
                     **kwargs):
     error_msg = "Need to supply one of 'motor_types' and 'motor_types_and_ranges'."
     if motor_types_and_ranges is not None:
@@ -212,10 +258,13 @@ def get_random_init(cp : CalculationParameters,
     regenerate              = True
 
     while regenerate:
-        initial_guess = [cp.rng.uniform(m1, m2) for (m1, m2) in init_range]
+        initial_guess = _get_random_guess(cp, motor_types, initial_motor_positions, init_range, feasibility_classifier, verbose)
         focusing_system = movers.move_motors(focusing_system, motor_types, initial_guess, movement="relative")
         centroid, photon_beam, hist, dw = get_centroid_distance(cp, focusing_system, None, **kwargs)
 
+        feasible = centroid < 1e4 and (intensity_sum_threshold is None or hist.data_2D.sum() > intensity_sum_threshold)
+        if feasibility_classifier is not None: feasibility_classifier.record(motor_types, np.array(initial_motor_positions) + np.array(initial_guess), feasible)
+
         if not (centroid < 1e4):
             if verbose: print("Random guess", initial_guess, "produces beam out of bounds. Trying another guess.")
             focusing_system = movers.move_motors(focusing_system, motor_types, initial_motor_positions, movement="absolute")
@@ -232,7 +281,22 @@ def get_random_init(cp : CalculationParameters,
 
     return initial_guess, focusing_system, BeamState(photon_beam, hist, dw)
 
-def reinitialize(input_beam_path: str,
+def _get_random_guess(cp : CalculationParameters,
+                      motor_types: List[str],
+                      initial_motor_positions: List[float],
+                      init_range: List[List[float]],
+                      feasibility_classifier: FeasibilityClassifier = None,
+                      verbose: bool = True) -> List[float]:
+    # uniform guess without history, otherwise a guess away from the known failures
+    if feasibility_classifier is None or feasibility_classifier.get_n_records(motor_types) == 0:
+        return [cp.rng.uniform(m1, m2) for (m1, m2) in init_range]
+
+    initial_guess, probability = feasibility_classifier.propose(motor_types, initial_motor_positions, init_range, cp.rng)
+    if verbose: print("Random guess", initial_guess, f"has feasibility probability {probability:.2f}")
+
+    return initial_guess
+
+def reinitialize(input_beam_path: Union[str, SharedBeamDescriptor],
                  layout: int,
                  input_features: DictionaryWrapper,
                  bender: bool = True,
@@ -242,7 +306,11 @@ def reinitialize(input_beam_path: str,
     if execution_mode == ExecutionMode.SIMULATION:
         clean_up()
         focusing_system = focusing_optics_factory_method(execution_mode=execution_mode, implementor=implementor, bender=bender, **kwargs)
-        focusing_system.initialize(input_photon_beam=load_shadow_beam(input_beam_path), rewrite_preprocessor_files=PreProcessorFiles.NO, layout=layout, input_features=input_features, **kwargs)
+        # in multi-process runs the input beam can be published once in shared memory (SharedBeam.descriptor)
+        if isinstance(input_beam_path, SharedBeamDescriptor): input_photon_beam = attach_shared_beam(input_beam_path)
+        else:                                                 input_photon_beam = load_shadow_beam(input_beam_path)
+
+        focusing_system.initialize(input_photon_beam=input_photon_beam, rewrite_preprocessor_files=PreProcessorFiles.NO, layout=layout, input_features=input_features, **kwargs)
     else:
         focusing_system = focusing_optics_factory_method(execution_mode=execution_mode, implementor=implementor, **kwargs)
         focusing_system.initialize(**kwargs)
@@ -292,10 +360,37 @@ def get_beam_hist_dw(cp : CalculationParameters, focusing_system: AbstractFocusi
 
     if photon_beam is None: return BeamState(None, None, None)
 
+    if cp.compact_beam and cp.execution_mode == ExecutionMode.SIMULATION and cp.implementor == Implementors.SHADOW \
+            and not isinstance(photon_beam, CompactBeam):
+        photon_beam = compact_beam(photon_beam,
+                                   dtype=cp.compact_beam_dtype,
+                                   validate=not cp.compact_beam_tolerance is None,
+                                   tolerance=cp.compact_beam_tolerance,
+                                   nbins_h=cp.nbins_h, nbins_v=cp.nbins_v, xrange=cp.xrange, yrange=cp.yrange)
+
     hist, dw = get_distribution_info(cp, photon_beam, **kwargs)
 
     return BeamState(photon_beam, hist, dw)
 
+def get_caustic_hist_dw(cp : CalculationParameters, focusing_system: AbstractFocusingOptics, photon_beam : object, distances : List[float], **kwargs) -> List[BeamState]:
+    """
+    Histograms and statistics at the planes at the given distances from the image plane (units of the beam),
+    from a single trace: focus and depth-of-focus calculations without re-running the simulation.
+    """
+    if not (cp.execution_mode == ExecutionMode.SIMULATION and cp.implementor == Implementors.SHADOW): raise ValueError("Caustic is available for SHADOW simulations only")
+
+    kwargs["random_seed"] = cp.random_seed
+    photon_beam = check_beam_out_of_bounds(focusing_system=focusing_system, photon_beam=photon_beam, **kwargs)
+
+    if photon_beam is None: return [BeamState(None, None, None) for _ in distances]
+
+    beam_states = []
+    for plane_beam in compact_beam_caustic(photon_beam, distances):
+        hist, dw = get_distribution_info(cp, plane_beam, **kwargs)
+        beam_states.append(BeamState(plane_beam, hist, dw))
+
+    return beam_states
+
 # -------------------------------------------------------------------- #
 
 def get_fwhm(cp : CalculationParameters, focusing_system: AbstractFocusingOptics, photon_beam : object, no_beam_value : float = 1e4, **kwargs) -> BeamParameterOutput:
@@ -701,13 +796,62 @@ class OptimizationCommon(abc.ABC):
 
 
 
+    def get_current_loss(self) -> Union[float, "np.ndarray"]:
+        """Loss of the current beam state, without moving the motors."""
+        loss = np.array([lossfn() for lossfn in self._loss_function_list])
+        if not self._multi_objective_optimization: loss = loss.sum()
+
+        return loss
+
+    def get_current_loss_standard_error(self,
+                                        method: str = ObservationNoiseMethods.COUNTING,
+                                        n_replicates: int = DEFAULT_N_REPLICATES,
+                                        rng: np.random.Generator = None,
+                                        count_weight: float = None) -> Union[float, "np.ndarray"]:
+        """Standard error of the loss of the current beam state, from replicates of the observation (NaN without beam)."""
+        n_losses = len(self._loss_function_list) if self._multi_objective_optimization else 1
+
+        if self.beam_state.dw is None: standard_error = np.full(n_losses, np.nan)
+        else:
+            if method == ObservationNoiseMethods.BOOTSTRAP:
+                if not (self.cp.execution_mode == ExecutionMode.SIMULATION and self.cp.implementor == Implementors.SHADOW):
+                    raise ValueError("Bootstrap over rays is available for SHADOW simulations only")
+                replicate_cp = copy.copy(self.cp)
+                replicate_cp.initialize_random_generators() # the noise stream of the trial is not consumed
+
+                replicate_states = (BeamState(beam, *get_distribution_info(replicate_cp, beam, **self._kwargs))
+                                    for beam in get_bootstrap_beams(self.beam_state.photon_beam, n_replicates, rng))
+            elif method == ObservationNoiseMethods.COUNTING:
+                if count_weight is None:
+                    count_weight = get_count_weight(self.beam_state.photon_beam) if self.cp.execution_mode == ExecutionMode.SIMULATION else 1.0
+
+                replicate_states = (BeamState(self.beam_state.photon_beam, *get_counting_distribution_info(hist,
+                                                                                                           do_gaussian_fit=self.cp.do_gaussian_fit,
+                                                                                                           calculate_over_noise=self.cp.calculate_over_noise,
+                                                                                                           noise_threshold=self.cp.noise_threshold))
+                                    for hist in get_counting_histograms(self.beam_state.hist, n_replicates, rng, count_weight))
+            else:
+                raise ValueError("Observation noise method not recognized: " + str(method))
+
+            beam_state       = self.beam_state
+            replicate_losses = []
+            try:
+                for replicate_state in replicate_states:
+                    self.beam_state = replicate_state
+                    replicate_losses.append(np.atleast_1d(self.get_current_loss()))
+            finally:
+                self.beam_state = beam_state
+
+            standard_error = get_standard_errors(replicate_losses)
+
+        return standard_error if self._multi_objective_optimization else standard_error[0]
+
     def loss_function(self, translations: Union[List[float], "np.ndarray"], verbose: bool = True) -> float:
         """This mutates the state of the focusing system."""
         self.focusing_system = movers.move_motors(self.focusing_system, self.motor_types, translations, movement="relative")
         self._update_beam_state()
 
-        loss = np.array([lossfn() for lossfn in self._loss_function_list])
-        if not self._multi_objective_optimization: loss = loss.sum()
+        loss = self.get_current_loss()
         self._opt_trials_motor_positions.append(translations)
         self._opt_trials_losses.append(loss)
         self._opt_fn_call_counter += 1
@@ -734,21 +878,25 @@ class OptimizationCommon(abc.ABC):
 
         return guess_range
 
-    def get_random_init(self, guess_range: List[float] = None, verbose=True):
+    def get_random_init(self, guess_range: List[float] = None, verbose=True, feasibility_classifier: FeasibilityClassifier = None):
         guess_range = self._get_guess_ranges(guess_range)
 
-        initial_guess = [self.cp.rng.uniform(m1, m2) for (m1, m2) in guess_range]
+        initial_guess = _get_random_guess(self.cp, self.motor_types, self.initial_motor_positions, guess_range, feasibility_classifier, verbose)
         lossfn_obj_this = self.TrialInstanceLossFunction(self, verbose=verbose)
         guess_loss = lossfn_obj_this.loss(initial_guess, verbose=False)
         if verbose: print("Random guess", initial_guess, "has loss", guess_loss)
 
         while guess_loss >= self._no_beam_loss or np.isnan(guess_loss):
+            if feasibility_classifier is not None: feasibility_classifier.record(self.motor_types, np.array(self.initial_motor_positions) + np.array(initial_guess), False)
             self.reset()
+            lossfn_obj_this.x_absolute_prev = 0 # the motors are back to the initial positions
             if verbose: print("Random guess", initial_guess, "produces beam out of bounds. Trying another guess.")
-            initial_guess = [np.random.uniform(m1, m2) for (m1, m2) in guess_range]
+            initial_guess = _get_random_guess(self.cp, self.motor_types, self.initial_motor_positions, guess_range, feasibility_classifier, verbose)
             if verbose: print("Random guess is", initial_guess)
             guess_loss = lossfn_obj_this.loss(initial_guess, verbose=False)
 
+        if feasibility_classifier is not None: feasibility_classifier.record(self.motor_types, np.array(self.initial_motor_positions) + np.array(initial_guess), True)
+
         return initial_guess
 
     @abc.abstractmethod
@@ -52,6 +52,7 @@ from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
 import botorch.utils.multi_objective.pareto
 import numpy
 import torch
+from botorch.acquisition.acquisition import AcquisitionFunction
 from botorch.acquisition.monte_carlo import qExpectedImprovement, qNoisyExpectedImprovement
 from botorch.acquisition.multi_objective.monte_carlo import (
     qExpectedHypervolumeImprovement,
@@ -60,7 +61,7 @@ from botorch.acquisition.multi_objective.monte_carlo import (
 from botorch.acquisition.multi_objective.objective import IdentityMCMultiOutputObjective
 from botorch.acquisition.objective import ConstrainedMCObjective, GenericMCObjective
 from botorch.fit import fit_gpytorch_mll
-from botorch.models import SingleTaskGP
+from botorch.models import FixedNoiseGP, HeteroskedasticSingleTaskGP, SingleTaskGP, SingleTaskVariationalGP
 from botorch.models.transforms.outcome import Standardize
 from botorch.optim import optimize_acqf
 from botorch.sampling.normal import SobolQMCNormalSampler
@@ -68,7 +69,10 @@ from botorch.utils.multi_objective.box_decompositions import NondominatedPartiti
 from botorch.utils.multi_objective.scalarization import get_chebyshev_scalarization
 from botorch.utils.sampling import manual_seed, sample_simplex
 from botorch.utils.transforms import normalize, unnormalize
-from gpytorch.mlls import ExactMarginalLogLikelihood
+from gpytorch.constraints import GreaterThan
+from gpytorch.likelihoods import GaussianLikelihood
+from gpytorch.mlls import ExactMarginalLogLikelihood, VariationalELBO
+from gpytorch.priors import GammaPrior
 from optuna import logging
 from optuna._transform import _SearchSpaceTransform
 from optuna.distributions import BaseDistribution
@@ -77,9 +81,257 @@ from optuna.samplers._base import _CONSTRAINTS_KEY, _process_constraints_after_t
 from optuna.study import Study, StudyDirection
 from optuna.trial import FrozenTrial, TrialState
 
+from aps.ai.autoalignment.common.util.travel import TravelTimeModel
+
 _logger = logging.get_logger(__name__)
 
 
+# Lower bound of the observation variances passed to the fixed-noise models, relative to the variance of the outcomes
+MIN_OBSERVATION_VARIANCE_FRACTION = 1e-6
+
+
+def _get_train_yvar(
+    train_obj_var: Optional["torch.Tensor"],
+    train_con: Optional["torch.Tensor"],
+) -> Optional["torch.Tensor"]:
+    if train_obj_var is None or train_con is None:
+        return train_obj_var
+
+    # Constraints are treated as (almost) noise-free observations.
+    train_con_var = MIN_OBSERVATION_VARIANCE_FRACTION * torch.nan_to_num(train_con).var(dim=0, keepdim=True).clamp_min(1.0)
+
+    return torch.cat([train_obj_var, train_con_var.expand_as(train_con)], dim=-1)
+
+
+class VariationalGPSurrogate:
+    """Sparse variational GP (SVGP) surrogate, for long-running studies.
+
+    The fit of the exact GPs scales as ``O(n_trials^3)``. From ``min_trials`` trials, a
+    ``SingleTaskVariationalGP`` with at most ``n_inducing_points`` inducing points is fitted
+    instead, with a fixed number of Adam steps on mini-batches of ``batch_size`` trials: the fit
+    time of each sampling is bounded, whatever the length of the study.
+
+    The hyperparameters, the variational distribution and the inducing points of the previous fit
+    are the starting point of the next one, so that ``n_training_steps`` steps are enough to
+    update the model with the new trials. Every ``refresh_interval`` fits (or when the search
+    space or the bounds used to normalize it change), the inducing points are allocated again
+    from the current trials and the model is trained with ``n_initial_training_steps`` steps.
+
+    An instance keeps the state of one study: it *should not be shared between samplers*.
+
+    Args:
+        n_inducing_points:
+            Maximum number of inducing points.
+        batch_size:
+            Number of trials in each mini-batch.
+        n_training_steps:
+            Number of optimizer steps of a warm-started fit.
+        n_initial_training_steps:
+            Number of optimizer steps of the first fit, and of the fits refreshing the inducing
+            points.
+        learning_rate:
+            Learning rate of the Adam optimizer.
+        refresh_interval:
+            Number of fits between two allocations of the inducing points.
+        min_trials:
+            Minimum number of trials to use the variational model: with fewer trials, the exact GP
+            is fitted.
+    """
+
+    def __init__(
+        self,
+        n_inducing_points: int = 128,
+        batch_size: int = 256,
+        n_training_steps: int = 100,
+        n_initial_training_steps: int = 500,
+        learning_rate: float = 0.05,
+        refresh_interval: int = 20,
+        min_trials: int = 200,
+    ):
+        self.n_inducing_points = n_inducing_points
+        self.batch_size = batch_size
+        self.n_training_steps = n_training_steps
+        self.n_initial_training_steps = n_initial_training_steps
+        self.learning_rate = learning_rate
+        self.refresh_interval = refresh_interval
+        self.min_trials = min_trials
+
+        self._state: Optional[Dict[str, "torch.Tensor"]] = None
+        self._bounds: Optional["torch.Tensor"] = None
+        self._n_fits_since_refresh = 0
+
+    def reset(self) -> None:
+        self._state = None
+        self._bounds = None
+        self._n_fits_since_refresh = 0
+
+    def _load_previous_state(self, model: SingleTaskVariationalGP, bounds: Optional["torch.Tensor"]) -> bool:
+        # The outcome transform is always recomputed from the current trials.
+        if self._state is None or self._n_fits_since_refresh >= self.refresh_interval:
+            return False
+        # The inducing points are in the coordinates normalized to the bounds of the previous fit.
+        if (self._bounds is None) != (bounds is None):
+            return False
+        if bounds is not None and (self._bounds.shape != bounds.shape or not torch.equal(self._bounds, bounds)):
+            return False
+        state = {key: value for key, value in self._state.items() if not key.startswith("outcome_transform")}
+        for key, value in model.state_dict().items():
+            if not key.startswith("outcome_transform") and (key not in state or state[key].shape != value.shape):
+                return False
+        model.load_state_dict(state, strict=False)
+
+        return True
+
+    def fit(
+        self,
+        train_x: "torch.Tensor",
+        train_y: "torch.Tensor",
+        model_likelihood: Optional[object] = None,
+        model_mean_module: Optional[object] = None,
+        model_covar_module: Optional[object] = None,
+        bounds: Optional["torch.Tensor"] = None,
+    ) -> SingleTaskVariationalGP:
+        n_trials, n_outputs = train_y.shape
+
+        model = SingleTaskVariationalGP(
+            train_x,
+            train_y,
+            likelihood=model_likelihood if n_outputs == 1 else None,
+            num_outputs=n_outputs,
+            inducing_points=min(self.n_inducing_points, n_trials),
+            outcome_transform=Standardize(m=n_outputs),
+            mean_module=model_mean_module,
+            covar_module=model_covar_module,
+        )
+
+        if self._load_previous_state(model, bounds):
+            n_steps = self.n_training_steps
+            self._n_fits_since_refresh += 1
+        else:
+            n_steps = self.n_initial_training_steps
+            self._n_fits_since_refresh = 1
+
+        model.outcome_transform.train()
+        train_targets, _ = model.outcome_transform(train_y)
+        model.outcome_transform.eval()
+        if n_outputs == 1:
+            train_targets = train_targets.squeeze(-1)
+
+        model.train()
+        mll = VariationalELBO(model.likelihood, model.model, num_data=n_trials)
+        optimizer = torch.optim.Adam(model.parameters(), lr=self.learning_rate)
+        batch_size = min(self.batch_size, n_trials)
+
+        for _ in range(n_steps):
+            batch = torch.randperm(n_trials)[:batch_size]
+            optimizer.zero_grad()
+            loss = -mll(model.model(train_x[batch]), train_targets[batch]).sum()
+            loss.backward()
+            optimizer.step()
+        model.eval()
+
+        self._state = {key: value.detach().clone() for key, value in model.state_dict().items()}
+        self._bounds = None if bounds is None else bounds.detach().clone()
+
+        return model
+
+
+def _get_surrogate_model(
+    train_x: "torch.Tensor",
+    train_y: "torch.Tensor",
+    train_yvar: Optional["torch.Tensor"] = None,
+    heteroscedastic: bool = False,
+    model_likelihood: Optional[object] = None,
+    model_mean_module: Optional[object] = None,
+    model_covar_module: Optional[object] = None,
+    variational_surrogate: Optional[VariationalGPSurrogate] = None,
+    bounds: Optional["torch.Tensor"] = None,
+) -> Union[SingleTaskGP, FixedNoiseGP, HeteroskedasticSingleTaskGP, SingleTaskVariationalGP]:
+    """Surrogate model of the objectives (and constraints).
+
+    Without observation variances, a ``SingleTaskGP`` infers one noise level for all the trials.
+    With the per-trial variances ``train_yvar``, a ``FixedNoiseGP`` uses them as known noise, or
+    a ``HeteroskedasticSingleTaskGP`` (``heteroscedastic=True``) models the noise level as a
+    function of the parameters, fitted to them (custom mean and covariance modules are not
+    supported by this model).
+
+    With a ``variational_surrogate`` and enough trials, the sparse variational GP is used instead
+    (already fitted), and the per-trial variances are ignored. ``bounds`` are the bounds used to
+    normalize ``train_x``: the variational model is warm-started only if they did not change.
+
+    """
+    if variational_surrogate is not None and train_x.size(0) >= variational_surrogate.min_trials:
+        if train_yvar is not None:
+            warnings.warn("The variational surrogate does not support observation variances: they are ignored.")
+        return variational_surrogate.fit(
+            train_x,
+            train_y,
+            model_likelihood=model_likelihood,
+            model_mean_module=model_mean_module,
+            model_covar_module=model_covar_module,
+            bounds=bounds,
+        )
+    elif train_yvar is None:
+        return SingleTaskGP(
+            train_x,
+            train_y,
+            outcome_transform=Standardize(m=train_y.size(-1)),
+            likelihood=model_likelihood,
+            mean_module=model_mean_module,
+            covar_module=model_covar_module,
+        )
+    elif heteroscedastic:
+        return HeteroskedasticSingleTaskGP(
+            train_x,
+            train_y,
+            train_yvar,
+            outcome_transform=Standardize(m=train_y.size(-1)),
+        )
+    else:
+        return FixedNoiseGP(
+            train_x,
+            train_y,
+            train_yvar,
+            outcome_transform=Standardize(m=train_y.size(-1)),
+            mean_module=model_mean_module,
+            covar_module=model_covar_module,
+        )
+
+
+class TravelCostAwareAcquisition(AcquisitionFunction):
+    """Acquisition value discounted by the travel cost of the motors (cost-aware Bayesian optimization).
+
+    The value of ``acq_function`` (non-negative for the improvement-based acquisition functions of
+    this module) is multiplied by ``exp(-travel_cost(X))``, where ``travel_cost`` is the weighted
+    travel time of the motors from their current position to the candidates ``X``: the logarithm
+    of the acquisition value is penalized linearly in the travel time, and distant candidates must
+    promise a larger improvement to be chosen.
+    """
+
+    def __init__(self, acq_function: AcquisitionFunction, travel_cost: Callable[["torch.Tensor"], "torch.Tensor"]):
+        super().__init__(model=acq_function.model)
+        self.acq_function = acq_function
+        self.travel_cost = travel_cost
+
+    @property
+    def X_pending(self) -> Optional["torch.Tensor"]:
+        return self.acq_function.X_pending
+
+    def set_X_pending(self, X_pending: Optional["torch.Tensor"] = None) -> None:
+        self.acq_function.set_X_pending(X_pending)
+
+    def forward(self, X: "torch.Tensor") -> "torch.Tensor":
+        return self.acq_function(X) * torch.exp(-self.travel_cost(X))
+
+
+def _fit_surrogate_model(
+    model: Union[SingleTaskGP, FixedNoiseGP, HeteroskedasticSingleTaskGP, SingleTaskVariationalGP],
+) -> None:
+    # The variational surrogate is already trained by VariationalGPSurrogate.fit.
+    if not isinstance(model, SingleTaskVariationalGP):
+        fit_gpytorch_mll(ExactMarginalLogLikelihood(model.likelihood, model))
+
+
 def qnei_candidates_func(
     train_x: "torch.Tensor",
     train_obj: "torch.Tensor",
@@ -87,6 +339,11 @@ def qnei_candidates_func(
     bounds: "torch.Tensor",
     model_mean_module: Optional[object] = None,
     model_covar_module: Optional[object] = None,
+    model_likelihood: Optional[object] = None,
+    train_obj_var: Optional["torch.Tensor"] = None,
+    heteroscedastic: bool = False,
+    variational_surrogate: Optional[VariationalGPSurrogate] = None,
+    travel_cost: Optional[Callable[["torch.Tensor"], "torch.Tensor"]] = None,
 ) -> Tuple["SingleTaskGP", "torch.Tensor"]:
     """Quasi MC-based batch Noisy Expected Improvement (qEI).
 
@@ -143,15 +400,18 @@ def qnei_candidates_func(
 
     train_x = normalize(train_x, bounds=bounds)
 
-    model = SingleTaskGP(
+    model = _get_surrogate_model(
         train_x,
         train_y,
-        outcome_transform=Standardize(m=train_y.size(-1)),
-        mean_module=model_mean_module,
-        covar_module=model_covar_module,
+        _get_train_yvar(train_obj_var, train_con),
+        heteroscedastic=heteroscedastic,
+        variational_surrogate=variational_surrogate,
+        bounds=bounds,
+        model_likelihood=model_likelihood,
+        model_mean_module=model_mean_module,
+        model_covar_module=model_covar_module,
     )
-    mll = ExactMarginalLogLikelihood(model.likelihood, model)
-    fit_gpytorch_mll(mll)
+    _fit_surrogate_model(model)
 
     acqf = qNoisyExpectedImprovement(
         model=model,
@@ -159,8 +419,12 @@ def qnei_candidates_func(
         sampler=SobolQMCNormalSampler(256),
         objective=objective,
         prune_baseline=True,
+        cache_root=not isinstance(model, SingleTaskVariationalGP),
     )
 
+    if travel_cost is not None:
+        acqf = TravelCostAwareAcquisition(acqf, travel_cost)
+
     standard_bounds = torch.zeros_like(bounds)
     standard_bounds[1] = 1
 
@@ -187,6 +451,11 @@ def qnehvi_candidates_func(
     ref_point: List,
     model_mean_module: Optional[object] = None,
     model_covar_module: Optional[object] = None,
+    model_likelihood: Optional[object] = None,
+    train_obj_var: Optional["torch.Tensor"] = None,
+    heteroscedastic: bool = False,
+    variational_surrogate: Optional[VariationalGPSurrogate] = None,
+    travel_cost: Optional[Callable[["torch.Tensor"], "torch.Tensor"]] = None,
 ) -> Tuple[SingleTaskGP, "torch.Tensor"]:
     """Quasi MC-based batch Expected Hypervolume Improvement (qnehvi).
 
@@ -224,15 +493,18 @@ def qnehvi_candidates_func(
 
     train_x = normalize(train_x, bounds=bounds)
 
-    model = SingleTaskGP(
+    model = _get_surrogate_model(
         train_x,
         train_y,
-        outcome_transform=Standardize(m=train_y.shape[-1]),
-        mean_module=model_mean_module,
-        covar_module=model_covar_module,
+        _get_train_yvar(train_obj_var, train_con),
+        heteroscedastic=heteroscedastic,
+        variational_surrogate=variational_surrogate,
+        bounds=bounds,
+        model_likelihood=model_likelihood,
+        model_mean_module=model_mean_module,
+        model_covar_module=model_covar_module,
     )
-    mll = ExactMarginalLogLikelihood(model.likelihood, model)
-    fit_gpytorch_mll(mll)
+    _fit_surrogate_model(model)
 
     # Approximate box decomposition similar to Ax when the number of objectives is large.
     # https://github.com/facebook/Ax/blob/master/ax/models/torch/botorch_moo_defaults
@@ -259,10 +531,14 @@ def qnehvi_candidates_func(
         ref_point=ref_point_list,
         X_baseline=train_x,
         prune_baseline=True,
+        cache_root=not isinstance(model, SingleTaskVariationalGP),
         sampler=SobolQMCNormalSampler(256),
         **additional_qnehvi_kwargs,
     )
 
+    if travel_cost is not None:
+        acqf = TravelCostAwareAcquisition(acqf, travel_cost)
+
     standard_bounds = torch.zeros_like(bounds)
     standard_bounds[1] = 1
 
@@ -288,6 +564,11 @@ def qei_candidates_func(
     bounds: "torch.Tensor",
     model_mean_module: Optional[object] = None,
     model_covar_module: Optional[object] = None,
+    model_likelihood: Optional[object] = None,
+    train_obj_var: Optional["torch.Tensor"] = None,
+    heteroscedastic: bool = False,
+    variational_surrogate: Optional[VariationalGPSurrogate] = None,
+    travel_cost: Optional[Callable[["torch.Tensor"], "torch.Tensor"]] = None,
 ) -> Tuple[SingleTaskGP, "torch.Tensor"]:
     """Quasi MC-based batch Expected Improvement (qEI).
 
@@ -353,15 +634,18 @@ def qei_candidates_func(
 
     train_x = normalize(train_x, bounds=bounds)
 
-    model = SingleTaskGP(
+    model = _get_surrogate_model(
         train_x,
         train_y,
-        outcome_transform=Standardize(m=train_y.size(-1)),
-        mean_module=model_mean_module,
-        covar_module=model_covar_module,
+        _get_train_yvar(train_obj_var, train_con),
+        heteroscedastic=heteroscedastic,
+        variational_surrogate=variational_surrogate,
+        bounds=bounds,
+        model_likelihood=model_likelihood,
+        model_mean_module=model_mean_module,
+        model_covar_module=model_covar_module,
     )
-    mll = ExactMarginalLogLikelihood(model.likelihood, model)
-    fit_gpytorch_mll(mll)
+    _fit_surrogate_model(model)
 
     acqf = qExpectedImprovement(
         model=model,
@@ -370,6 +654,9 @@ def qei_candidates_func(
         objective=objective,
     )
 
+    if travel_cost is not None:
+        acqf = TravelCostAwareAcquisition(acqf, travel_cost)
+
     standard_bounds = torch.zeros_like(bounds)
     standard_bounds[1] = 1
 
@@ -395,6 +682,11 @@ def qehvi_candidates_func(
     bounds: "torch.Tensor",
     model_mean_module: Optional[object] = None,
     model_covar_module: Optional[object] = None,
+    model_likelihood: Optional[object] = None,
+    train_obj_var: Optional["torch.Tensor"] = None,
+    heteroscedastic: bool = False,
+    variational_surrogate: Optional[VariationalGPSurrogate] = None,
+    travel_cost: Optional[Callable[["torch.Tensor"], "torch.Tensor"]] = None,
 ) -> Tuple[SingleTaskGP, "torch.Tensor"]:
     """Quasi MC-based batch Expected Hypervolume Improvement (qEHVI).
 
@@ -432,15 +724,18 @@ def qehvi_candidates_func(
 
     train_x = normalize(train_x, bounds=bounds)
 
-    model = SingleTaskGP(
+    model = _get_surrogate_model(
         train_x,
         train_y,
-        outcome_transform=Standardize(m=train_y.shape[-1]),
-        mean_module=model_mean_module,
-        covar_module=model_covar_module,
+        _get_train_yvar(train_obj_var, train_con),
+        heteroscedastic=heteroscedastic,
+        variational_surrogate=variational_surrogate,
+        bounds=bounds,
+        model_likelihood=model_likelihood,
+        model_mean_module=model_mean_module,
+        model_covar_module=model_covar_module,
     )
-    mll = ExactMarginalLogLikelihood(model.likelihood, model)
-    fit_gpytorch_mll(mll)
+    _fit_surrogate_model(model)
 
     # Approximate box decomposition similar to Ax when the number of objectives is large.
     # https://github.com/facebook/Ax/blob/master/ax/models/torch/botorch_moo_defaults
@@ -463,6 +758,9 @@ def qehvi_candidates_func(
         **additional_qehvi_kwargs,
     )
 
+    if travel_cost is not None:
+        acqf = TravelCostAwareAcquisition(acqf, travel_cost)
+
     standard_bounds = torch.zeros_like(bounds)
     standard_bounds[1] = 1
 
@@ -488,6 +786,11 @@ def qparego_candidates_func(
     bounds: "torch.Tensor",
     model_mean_module: Optional[object] = None,
     model_covar_module: Optional[object] = None,
+    model_likelihood: Optional[object] = None,
+    train_obj_var: Optional["torch.Tensor"] = None,
+    heteroscedastic: bool = False,
+    variational_surrogate: Optional[VariationalGPSurrogate] = None,
+    travel_cost: Optional[Callable[["torch.Tensor"], "torch.Tensor"]] = None,
 ) -> Tuple[SingleTaskGP, "torch.Tensor"]:
     """Quasi MC-based extended ParEGO (qParEGO) for constrained multi-objective optimization.
 
@@ -524,15 +827,18 @@ def qparego_candidates_func(
 
     train_x = normalize(train_x, bounds=bounds)
 
-    model = SingleTaskGP(
+    model = _get_surrogate_model(
         train_x,
         train_y,
-        outcome_transform=Standardize(m=train_y.size(-1)),
-        mean_module=model_mean_module,
-        covar_module=model_covar_module,
+        _get_train_yvar(train_obj_var, train_con),
+        heteroscedastic=heteroscedastic,
+        variational_surrogate=variational_surrogate,
+        bounds=bounds,
+        model_likelihood=model_likelihood,
+        model_mean_module=model_mean_module,
+        model_covar_module=model_covar_module,
     )
-    mll = ExactMarginalLogLikelihood(model.likelihood, model)
-    fit_gpytorch_mll(mll)
+    _fit_surrogate_model(model)
 
     acqf = qExpectedImprovement(
         model=model,
@@ -541,6 +847,9 @@ def qparego_candidates_func(
         objective=objective,
     )
 
+    if travel_cost is not None:
+        acqf = TravelCostAwareAcquisition(acqf, travel_cost)
+
     standard_bounds = torch.zeros_like(bounds)
     standard_bounds[1] = 1
 
@@ -562,7 +871,17 @@ def qparego_candidates_func(
 def _get_default_candidates_func(
     n_objectives: int,
 ) -> Callable[
-    ["torch.Tensor", "torch.Tensor", Optional["torch.Tensor"], "torch.Tensor", Optional[object], Optional[object]],
+    [
+        "torch.Tensor",
+        "torch.Tensor",
+        Optional["torch.Tensor"],
+        "torch.Tensor",
+        Optional[object],
+        Optional[object],
+        Optional[object],
+        Optional["torch.Tensor"],
+        bool,
+    ],
     Tuple[SingleTaskGP, "torch.Tensor"],
 ]:
     if n_objectives > 3:
@@ -573,6 +892,48 @@ def _get_default_candidates_func(
         return qei_candidates_func
 
 
+def get_common_random_numbers_likelihood(n_outputs: int, noise_lower_bound: float = 1e-6) -> GaussianLikelihood:
+    """Gaussian likelihood for objectives evaluated with common random numbers.
+
+    When all the trials reuse the same source rays, the differences between the observations
+    are not dominated by Monte-Carlo noise: the noise prior is moved from the BoTorch default
+    (``GammaPrior(1.1, 0.05)``, mode ~2 on the standardized outcomes) to values ~100 times
+    smaller, and the lower bound of the noise is relaxed accordingly.
+
+    Args:
+        n_outputs:
+            Number of outputs of the model (objectives and constraints).
+        noise_lower_bound:
+            Lower bound of the noise variance on the standardized outcomes.
+
+    Returns:
+        A ``GaussianLikelihood`` to be passed to ``SingleTaskGP``.
+
+    """
+    return GaussianLikelihood(
+        noise_prior=GammaPrior(1.1, 5.0),
+        batch_shape=torch.Size([n_outputs]) if n_outputs > 1 else torch.Size(),
+        noise_constraint=GreaterThan(noise_lower_bound, transform=None, initial_value=0.01),
+    )
+
+
+def _fill_observation_variances(values_var: numpy.ndarray, values: numpy.ndarray) -> Optional[numpy.ndarray]:
+    # Trials without a (finite) standard error get the median variance of the other trials.
+    # Without any standard error, the noise is inferred by the model (None).
+    values_var = values_var.copy()
+    for obj_idx in range(values_var.shape[1]):
+        column = values_var[:, obj_idx]
+        valid = numpy.isfinite(column)
+        if not valid.any():
+            return None
+
+        column[~valid] = numpy.median(column[valid])
+        min_variance = MIN_OBSERVATION_VARIANCE_FRACTION * max(numpy.var(values[:, obj_idx]), 1e-12)
+        values_var[:, obj_idx] = numpy.maximum(column, min_variance)
+
+    return values_var
+
+
 class BoTorchSampler(BaseSampler):
     """A sampler that uses BoTorch, a Bayesian optimization library built on top of PyTorch.
 
@@ -628,6 +989,28 @@ class BoTorchSampler(BaseSampler):
             conditional.
         seed:
             Seed for random number generator.
+        likelihood_factory:
+            An optional function that builds the likelihood of the surrogate at each sampling
+            (e.g. :func:`get_common_random_numbers_likelihood`). It must take the number of
+            outputs (objectives and constraints).
+        observation_noise_attr:
+            An optional name of the trial user attribute with the standard errors of the objectives
+            of the trial. If given, the per-trial variances are passed to ``candidates_func``
+            (``train_obj_var``) and the surrogate is a fixed-noise GP. Missing values are replaced
+            by the median of the other trials.
+        heteroscedastic:
+            With ``observation_noise_attr``, fit a heteroscedastic GP to the per-trial variances
+            instead of using them as known noise.
+        variational_surrogate:
+            An optional :class:`VariationalGPSurrogate`, passed to ``candidates_func``: from its
+            ``min_trials`` trials, the surrogate is a sparse variational GP with a bounded fit time.
+        travel_time_model:
+            An optional ``TravelTimeModel`` of the motors (the parameters of the search space).
+            With a positive ``travel_cost_weight``, the acquisition value is multiplied by
+            ``exp(-travel_cost_weight * travel_time)``, with the travel time from the parameters of
+            the last finished trial (the current position of the motors) to the candidate.
+        travel_cost_weight:
+            Weight of the travel time (1/s): 0 disables the travel cost.
     """
 
     def __init__(
@@ -650,6 +1033,12 @@ class BoTorchSampler(BaseSampler):
         seed: Optional[int] = None,
         model_mean_module: Optional[object] = None,
         model_covar_module: Optional[object] = None,
+        likelihood_factory: Optional[Callable[[int], object]] = None,
+        observation_noise_attr: Optional[str] = None,
+        heteroscedastic: bool = False,
+        variational_surrogate: Optional[VariationalGPSurrogate] = None,
+        travel_time_model: Optional[TravelTimeModel] = None,
+        travel_cost_weight: float = 0.0,
     ):
         self._candidates_func = candidates_func
         self._constraints_func = constraints_func
@@ -658,6 +1047,12 @@ class BoTorchSampler(BaseSampler):
         self._seed = seed
         self._model_mean_module = model_mean_module
         self._model_covar_module = model_covar_module
+        self._likelihood_factory = likelihood_factory
+        self._observation_noise_attr = observation_noise_attr
+        self._heteroscedastic = heteroscedastic
+        self._variational_surrogate = variational_surrogate
+        self._travel_time_model = travel_time_model
+        self._travel_cost_weight = travel_cost_weight
 
         self._study_id: Optional[int] = None
         self._search_space = IntersectionSearchSpace()
@@ -710,6 +1105,9 @@ class BoTorchSampler(BaseSampler):
         con: Optional[Union[numpy.ndarray, torch.Tensor]] = None
         bounds: Union[numpy.ndarray, torch.Tensor] = trans.bounds
         params = numpy.empty((n_trials, trans.bounds.shape[0]), dtype=numpy.float64)
+        values_var: Optional[Union[numpy.ndarray, torch.Tensor]] = None
+        if self._observation_noise_attr is not None:
+            values_var = numpy.full((n_trials, n_objectives), numpy.nan, dtype=numpy.float64)
         for trial_idx, trial in enumerate(trials):
             params[trial_idx] = trans.transform(trial.params)
             assert len(study.directions) == len(trial.values)
@@ -720,6 +1118,10 @@ class BoTorchSampler(BaseSampler):
                     value *= -1
                 values[trial_idx, obj_idx] = value
 
+            if values_var is not None:
+                standard_errors = trial.user_attrs.get(self._observation_noise_attr)
+                if standard_errors is not None and len(standard_errors) == n_objectives:
+                    values_var[trial_idx] = numpy.square(standard_errors)  # the sign of the values does not matter
             if self._constraints_func is not None:
                 constraints = study._storage.get_trial_system_attrs(trial._trial_id).get(_CONSTRAINTS_KEY)
                 if constraints is not None:
@@ -744,6 +1146,9 @@ class BoTorchSampler(BaseSampler):
                     "constraints. Constraints passed to `candidates_func` will contain NaN."
                 )
 
+        if values_var is not None:
+            values_var = _fill_observation_variances(values_var, values)
+
         values = torch.from_numpy(values)
         params = torch.from_numpy(params)
         if con is not None:
@@ -755,9 +1160,36 @@ class BoTorchSampler(BaseSampler):
                 con.unsqueeze_(-1)
         bounds.transpose_(0, 1)
 
+        trial_mask, candidates_bounds = self._get_local_region(params, values, con, bounds)
+        if trial_mask is not None:
+            params = params[trial_mask]
+            values = values[trial_mask]
+            if con is not None:
+                con = con[trial_mask]
+            if values_var is not None:
+                values_var = values_var[trial_mask.numpy()]
+
         if self._candidates_func is None:
             self._candidates_func = _get_default_candidates_func(n_objectives=n_objectives)
 
+        n_outputs = n_objectives if con is None else n_objectives + con.size(-1)
+        model_likelihood = None if self._likelihood_factory is None else self._likelihood_factory(n_outputs)
+
+        model_options = {}
+        if values_var is not None:
+            model_options["train_obj_var"] = torch.from_numpy(values_var)
+            model_options["heteroscedastic"] = self._heteroscedastic
+        if self._variational_surrogate is not None:
+            model_options["variational_surrogate"] = self._variational_surrogate
+        if self._travel_time_model is not None and self._travel_cost_weight > 0:
+            current_params = self._get_current_params(study, search_space)
+            if current_params is not None:
+                model_options["travel_cost"] = self._get_travel_cost(
+                    list(search_space.keys()),
+                    torch.from_numpy(trans.transform(current_params)),
+                    candidates_bounds,
+                )
+
         with manual_seed(self._seed):
             # `manual_seed` makes the default candidates functions reproducible.
             # `SobolQMCNormalSampler`'s constructor has a `seed` argument, but its behavior is
@@ -766,9 +1198,11 @@ class BoTorchSampler(BaseSampler):
                 params,
                 values,
                 con,
-                bounds,
+                candidates_bounds,
                 model_mean_module=self._model_mean_module,
                 model_covar_module=self._model_covar_module,
+                model_likelihood=model_likelihood,
+                **model_options,
             )
             if self._seed is not None:
                 self._seed += 1
@@ -793,6 +1227,52 @@ class BoTorchSampler(BaseSampler):
 
         return trans.untransform(candidates.numpy())
 
+    @staticmethod
+    def _get_current_params(study: Study, search_space: Dict[str, BaseDistribution]) -> Optional[Dict[str, Any]]:
+        # The motors are at the position of the last finished trial.
+        finished_states = (TrialState.COMPLETE, TrialState.PRUNED, TrialState.FAIL)
+        for finished_trial in reversed(study.get_trials(deepcopy=False, states=finished_states)):
+            if all(name in finished_trial.params for name in search_space):
+                return {name: finished_trial.params[name] for name in search_space}
+        return None
+
+    def _get_travel_cost(
+        self,
+        parameter_names: List[str],
+        current_params: "torch.Tensor",
+        candidates_bounds: "torch.Tensor",
+    ) -> Callable[["torch.Tensor"], "torch.Tensor"]:
+        # Weighted travel time (without settle times) from the current position to the candidates, which are
+        # normalized to candidates_bounds: motors without a travel model do not contribute.
+        motor_models = self._travel_time_model.motor_models
+        inverse_velocities = torch.tensor(
+            [1.0 / motor_models[name].velocity if name in motor_models else 0.0 for name in parameter_names],
+            dtype=candidates_bounds.dtype,
+        )
+        seconds_per_unit = (candidates_bounds[1] - candidates_bounds[0]) * inverse_velocities
+        start = normalize(current_params, bounds=candidates_bounds)
+        simultaneous = self._travel_time_model.simultaneous
+        travel_cost_weight = self._travel_cost_weight
+
+        def travel_cost(X: "torch.Tensor") -> "torch.Tensor":
+            path = torch.cat([start.expand(*X.shape[:-2], 1, X.size(-1)), X], dim=-2)
+            move_times = path.diff(dim=-2).abs() * seconds_per_unit
+            move_times = move_times.max(dim=-1).values if simultaneous else move_times.sum(dim=-1)
+            return travel_cost_weight * move_times.sum(dim=-1)
+
+        return travel_cost
+
+    def _get_local_region(
+        self,
+        params: "torch.Tensor",
+        values: "torch.Tensor",
+        con: Optional["torch.Tensor"],
+        bounds: "torch.Tensor",
+    ) -> Tuple[Optional["torch.Tensor"], "torch.Tensor"]:
+        # Trials used to fit the surrogate (boolean mask, None for all of them) and bounds of the candidates.
+        # Global optimization: all the trials and the whole search space (see TrustRegionSampler).
+        return None, bounds
+
     def sample_independent(
         self,
         study: Study,
@@ -817,3 +1297,155 @@ class BoTorchSampler(BaseSampler):
         if self._constraints_func is not None:
             _process_constraints_after_trial(self._constraints_func, study, trial, state)
         self._independent_sampler.after_trial(study, trial, state, values)
+
+
+class TrustRegionSampler(BoTorchSampler):
+    """A BoTorch sampler for local optimization in a trust region (TuRBO-like).
+
+    The candidates are searched in a hyper-rectangle centered on the best trial, of side
+    ``length`` in the search space normalized to the unit cube, and the surrogate is a local
+    GP fitted on the trials close to the center. After ``success_tolerance`` consecutive
+    improvements the trust region is doubled (up to ``length_max``), after ``failure_tolerance``
+    consecutive trials without improvement it is halved (down to ``length_min``). Unlike TuRBO,
+    the trust region is not restarted when it reaches ``length_min``: a restart would mean large
+    moves of the motors.
+
+    The state of the trust region is recomputed from the trials completed after the first
+    suggestion of the sampler: the previous trials (e.g. of a global optimization, with
+    :class:`BoTorchSampler`) only define the initial best trial. With more objectives, a trial
+    is an improvement when it is not dominated by any previous trial, and the center is the
+    point of the Pareto front with the best sum of the objectives (normalized to the front).
+    Infeasible trials are never improvements.
+
+    The other arguments are the ones of :class:`BoTorchSampler`.
+
+    Args:
+        length_init:
+            Initial side of the trust region (the search space is the unit cube).
+        length_min:
+            Minimum side of the trust region.
+        length_max:
+            Maximum side of the trust region.
+        success_tolerance:
+            Number of consecutive improvements to expand the trust region.
+        failure_tolerance:
+            Number of consecutive failures to shrink the trust region. If omitted, it is
+            ``max(4, n_params)``.
+        improvement_threshold:
+            Minimum relative improvement of the best objective (single-objective studies).
+        min_local_trials:
+            Minimum number of trials of the local GP. The local GP is fitted on the trials within
+            ``length`` of the center (Chebyshev distance, i.e. a box twice as large as the trust
+            region), completed with the trials closest to the center.
+    """
+
+    def __init__(
+        self,
+        *,
+        length_init: float = 0.8,
+        length_min: float = 0.5**7,
+        length_max: float = 1.6,
+        success_tolerance: int = 3,
+        failure_tolerance: Optional[int] = None,
+        improvement_threshold: float = 1e-3,
+        min_local_trials: int = 10,
+        **kwargs: Any,
+    ):
+        super().__init__(**kwargs)
+
+        self._length_init = length_init
+        self._length_min = length_min
+        self._length_max = length_max
+        self._success_tolerance = success_tolerance
+        self._failure_tolerance = failure_tolerance
+        self._improvement_threshold = improvement_threshold
+        self._min_local_trials = min_local_trials
+
+        self._n_history_trials: Optional[int] = None
+        self._n_params: Optional[int] = None
+        self.length = length_init
+
+    def _is_improvement(self, value: "torch.Tensor", previous_values: "torch.Tensor") -> bool:
+        if previous_values.size(0) == 0:
+            return True
+        if value.size(-1) == 1:
+            best = previous_values.max()
+            return bool(value[0] > best + self._improvement_threshold * best.abs())
+        return not bool((previous_values >= value).all(dim=-1).any())
+
+    def _get_center_index(self, values: "torch.Tensor", feasible: "torch.Tensor") -> Optional[int]:
+        if not feasible.any():
+            return None
+        candidates = torch.nonzero(feasible).squeeze(-1)
+        candidate_values = values[candidates]
+        if values.size(-1) > 1:
+            is_pareto = botorch.utils.multi_objective.pareto.is_non_dominated(candidate_values)
+            candidates = candidates[is_pareto]
+            candidate_values = candidate_values[is_pareto]
+            low = candidate_values.min(dim=0).values
+            scale = (candidate_values.max(dim=0).values - low).clamp_min(1e-12)
+            candidate_values = ((candidate_values - low) / scale).sum(dim=-1, keepdim=True)
+
+        return int(candidates[candidate_values[:, 0].argmax()])
+
+    def _update_length(self, values: "torch.Tensor", feasible: "torch.Tensor") -> None:
+        # Replay of the trials suggested in the trust region (deterministic, robust to resumed studies).
+        failure_tolerance = self._failure_tolerance
+        if failure_tolerance is None:
+            failure_tolerance = max(4, self._n_params)
+
+        self.length = self._length_init
+        n_successes = 0
+        n_failures = 0
+        for trial_idx in range(self._n_history_trials, values.size(0)):
+            previous_values = values[:trial_idx][feasible[:trial_idx]]
+            if feasible[trial_idx] and self._is_improvement(values[trial_idx], previous_values):
+                n_successes += 1
+                n_failures = 0
+            else:
+                n_successes = 0
+                n_failures += 1
+
+            if n_successes == self._success_tolerance:
+                self.length = min(2.0 * self.length, self._length_max)
+                n_successes = 0
+            elif n_failures == failure_tolerance:
+                self.length = max(self.length / 2.0, self._length_min)
+                n_failures = 0
+
+    def _get_local_region(
+        self,
+        params: "torch.Tensor",
+        values: "torch.Tensor",
+        con: Optional["torch.Tensor"],
+        bounds: "torch.Tensor",
+    ) -> Tuple[Optional["torch.Tensor"], "torch.Tensor"]:
+        if self._n_history_trials is None:
+            self._n_history_trials = values.size(0)
+        self._n_params = params.size(-1)
+
+        feasible = torch.ones(values.size(0), dtype=torch.bool)
+        if con is not None:
+            feasible = (con <= 0).all(dim=-1)  # NaN constraints are not feasible.
+        self._update_length(values, feasible)
+
+        center_idx = self._get_center_index(values, feasible)
+        if center_idx is None:
+            center_idx = int(values.sum(dim=-1).argmax())
+
+        unit_params = normalize(params, bounds=bounds)
+        center = unit_params[center_idx]
+
+        distances = (unit_params - center).abs().max(dim=-1).values
+        n_local_trials = max(int((distances <= self.length).sum()), min(self._min_local_trials, values.size(0)))
+        trial_mask = torch.zeros(values.size(0), dtype=torch.bool)
+        trial_mask[distances.argsort()[:n_local_trials]] = True
+
+        trust_region = torch.stack(
+            [
+                (center - self.length / 2).clamp(0.0, 1.0),
+                (center + self.length / 2).clamp(0.0, 1.0),
+            ]
+        )
+
+        return trial_mask, unnormalize(trust_region, bounds=bounds)
@@ -124,8 +124,9 @@ def get_absolute_positions(focusing_system, motors):
     if np.ndim(motors) == 0: motors = [motors]
 
     positions = []
-    for motor in motors:
-        unit = configs.UNITS_PER_MOTOR[motor]
-        position = get_motor_absolute_position_fn(focusing_system, motor)(units=unit)
-        positions.append(position)
+    with focusing_system.position_snapshot(): # all the motors read at the same time
+        for motor in motors:
+            unit = configs.UNITS_PER_MOTOR[motor]
+            position = get_motor_absolute_position_fn(focusing_system, motor)(units=unit)
+            positions.append(position)
     return positions
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------- #
+# Copyright (c) 2021, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2021. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# ----------------------------------------------------------------------- #
+"""
+Local sensitivity of the beam properties with respect to the motors.
+
+Central differences around the current positions, for all the motors at once: the 2M+1 points of the stencil are
+measured by the scan engine (in parallel with a focusing_system_factory) with common random numbers, i.e. with the
+same random seed for all the points, so that the differences are not dominated by the Monte-Carlo noise of the
+ray tracing. Repeating the stencil with different seeds gives the uncertainty of the Jacobian.
+"""
+import os
+import shutil
+import tempfile
+import dataclasses as dt
+from typing import Dict, List
+
+import numpy as np
+
+import aps.ai.autoalignment.beamline34IDC.optimization.configs as configs
+from aps.ai.autoalignment.beamline34IDC.facade.focusing_optics_interface import AbstractFocusingOptics
+from aps.ai.autoalignment.beamline34IDC.optimization import movers
+from aps.ai.autoalignment.beamline34IDC.optimization.common import CalculationParameters, get_beam_hist_dw
+from aps.ai.autoalignment.common.util.scan import ScanEngine, ScanMotor
+
+DEFAULT_STEP_FRACTION = 0.1 # of the half width of DEFAULT_MOVEMENT_RANGES
+DEFAULT_SENSITIVITY_QUANTITIES = ("h_fwhm", "v_fwhm", "h_centroid", "v_centroid", "integral_intensity", "peak_intensity")
+
+class Sensitivity():
+    def __init__(self, motors, quantities, positions, steps, values, jacobian, jacobian_uncertainty, second_derivative, random_seeds):
+        self.motors               = list(motors)
+        self.quantities           = list(quantities)
+        self.positions            = np.asarray(positions, dtype=float)            # motors
+        self.steps                = np.asarray(steps, dtype=float)                # motors
+        self.values               = np.asarray(values, dtype=float)               # quantities, at the current positions
+        self.jacobian             = np.asarray(jacobian, dtype=float)             # quantities x motors
+        self.jacobian_uncertainty = np.asarray(jacobian_uncertainty, dtype=float) # quantities x motors, NaN with one repetition
+        self.second_derivative    = np.asarray(second_derivative, dtype=float)    # quantities x motors
+        self.random_seeds         = list(random_seeds)
+
+    def get_derivative(self, quantity, motor):
+        return self.jacobian[self.quantities.index(quantity), self.motors.index(motor)]
+
+    def get_range_effect(self, motor_ranges: Dict = None):
+        """Change of each quantity over the movement range of each motor, at the linear order."""
+        if motor_ranges is None: motor_ranges = configs.DEFAULT_MOVEMENT_RANGES
+        widths = np.array([np.abs(np.diff(motor_ranges[motor]))[0] for motor in self.motors])
+
+        return np.abs(self.jacobian) * widths, self.jacobian_uncertainty * widths
+
+    def select_motors(self, quantities: List[str] = None, threshold: float = 0.1, significance: float = 2.0, motor_ranges: Dict = None) -> List[str]:
+        """
+        Motors with an effect over their range larger than threshold times the largest one, for at least one quantity,
+        and (when the uncertainty is known) significant, i.e. larger than significance times its uncertainty.
+        """
+        if quantities is None: quantities = self.quantities
+        rows = [self.quantities.index(quantity) for quantity in quantities]
+
+        effect, uncertainty = self.get_range_effect(motor_ranges)
+        effect, uncertainty = effect[rows], uncertainty[rows]
+
+        largest  = np.nanmax(effect, axis=1, initial=0.0)[:, np.newaxis]
+        selected = (effect >= threshold * largest) & (effect > 0)
+        selected &= np.where(np.isnan(uncertainty), True, effect > significance * uncertainty)
+
+        return [motor for index, motor in enumerate(self.motors) if np.any(selected[:, index])]
+
+    def to_dictionary(self) -> Dict:
+        return {"motors"               : self.motors,
+                "quantities"           : self.quantities,
+                "positions"            : self.positions.tolist(),
+                "steps"                : self.steps.tolist(),
+                "values"               : self.values.tolist(),
+                "jacobian"             : self.jacobian.tolist(),
+                "jacobian_uncertainty" : self.jacobian_uncertainty.tolist(),
+                "second_derivative"    : self.second_derivative.tolist(),
+                "random_seeds"         : self.random_seeds}
+
+    @classmethod
+    def from_dictionary(cls, dictionary: Dict):
+        return Sensitivity(**dictionary)
+
+class _BeamPropertiesMeasure():
+    def __init__(self, cp: CalculationParameters, quantities, random_seed, **kwargs):
+        self.__cp         = dt.replace(cp, random_seed=random_seed) # common random numbers: same seed for all the points
+        self.__quantities = quantities
+        self.__kwargs     = kwargs
+
+    def __call__(self, focusing_system):
+        self.__cp.reseed_noise_generator(0) # and same noise realization
+        _, _, dw = get_beam_hist_dw(self.__cp, focusing_system, None, **self.__kwargs)
+
+        if dw is None: return {quantity: np.nan for quantity in self.__quantities}
+        else:          return {quantity: dw.get_parameter(quantity) for quantity in self.__quantities}
+
+def get_default_steps(motors: List[str], step_fraction: float = DEFAULT_STEP_FRACTION) -> np.ndarray:
+    return np.array([max(step_fraction * np.abs(np.diff(configs.DEFAULT_MOVEMENT_RANGES[motor]))[0] / 2, configs.DEFAULT_MOTOR_RESOLUTIONS[motor])
+                     for motor in motors])
+
+def compute_sensitivity(cp: CalculationParameters,
+                        focusing_system: AbstractFocusingOptics,
+                        motors: List[str] = None,
+                        steps: List[float] = None,
+                        step_fraction: float = DEFAULT_STEP_FRACTION,
+                        quantities: List[str] = DEFAULT_SENSITIVITY_QUANTITIES,
+                        n_repeats: int = 1,
+                        random_seed: int = None,
+                        n_workers: int = 1,
+                        focusing_system_factory: object = None,
+                        results_directory: str = None,
+                        verbose: bool = False,
+                        **kwargs) -> Sensitivity:
+    """
+    Jacobian of the quantities (parameters of the beam distribution info) with respect to the motors, by central
+    differences around the current positions. With n_workers > 1 the points are measured in parallel, on focusing
+    systems built by focusing_system_factory (picklable callable, see ScanEngine) and moved to the same positions.
+    With results_directory the measured points are kept there, and an interrupted calculation is resumed.
+    """
+    if motors is None: motors = list(configs.DEFAULT_MOVEMENT_RANGES.keys())
+    steps = get_default_steps(motors, step_fraction) if steps is None else np.asarray(steps, dtype=float)
+
+    if random_seed is None: random_seed = 0 if cp.random_seed is None else cp.random_seed
+    random_seeds = [int(random_seed) + repeat for repeat in range(n_repeats)]
+
+    positions    = np.array(movers.get_absolute_positions(focusing_system, motors), dtype=float)
+    n_motors     = len(motors)
+    stencil      = np.tile(positions, (2*n_motors + 1, 1)) # center, then +h and -h for each motor
+    for index in range(n_motors):
+        stencil[1 + 2*index,     index] += steps[index]
+        stencil[1 + 2*index + 1, index] -= steps[index]
+
+    scan_motors = [ScanMotor(name=movers.get_motor_move_fn(focusing_system, motor).__name__[len("move_"):],
+                             start=positions[index] - steps[index],
+                             stop=positions[index] + steps[index],
+                             units=configs.UNITS_PER_MOTOR[motor])
+                   for index, motor in enumerate(motors)]
+
+    keep_results = not results_directory is None
+    if not keep_results: results_directory = tempfile.mkdtemp(prefix="sensitivity_")
+    elif not os.path.exists(results_directory): os.makedirs(results_directory)
+
+    values = np.full((n_repeats, len(quantities), 2*n_motors + 1), np.nan)
+
+    try:
+        for repeat, seed in enumerate(random_seeds):
+            results = ScanEngine(scan_motors,
+                                 _BeamPropertiesMeasure(cp, quantities, seed, **kwargs),
+                                 results_file=os.path.join(results_directory, "sensitivity_" + str(seed) + ".jsonl"),
+                                 focusing_system=focusing_system,
+                                 focusing_system_factory=focusing_system_factory,
+                                 n_workers=n_workers,
+                                 positions=stencil,
+                                 verbose=verbose).run()
+
+            for index, quantity in enumerate(quantities):
+                if quantity in results.values: values[repeat, index] = results.get_value(quantity)
+    finally:
+        if n_workers == 1: movers.move_motors(focusing_system, motors, positions, movement="absolute") # back to the initial positions
+        if not keep_results: shutil.rmtree(results_directory, ignore_errors=True)
+
+    center  = values[:, :, 0]
+    plus    = values[:, :, 1::2]
+    minus   = values[:, :, 2::2]
+
+    jacobians         = (plus - minus) / (2 * steps)
+    second_derivative = np.mean((plus - 2 * center[:, :, np.newaxis] + minus) / steps**2, axis=0)
+
+    if n_repeats > 1: jacobian_uncertainty = np.std(jacobians, axis=0, ddof=1) / np.sqrt(n_repeats)
+    else:             jacobian_uncertainty = np.full(jacobians.shape[1:], np.nan)
+
+    return Sensitivity(motors=motors,
+                       quantities=quantities,
+                       positions=positions,
+                       steps=steps,
+                       values=np.mean(center, axis=0),
+                       jacobian=np.mean(jacobians, axis=0),
+                       jacobian_uncertainty=jacobian_uncertainty,
+                       second_derivative=second_derivative,
+                       random_seeds=random_seeds)
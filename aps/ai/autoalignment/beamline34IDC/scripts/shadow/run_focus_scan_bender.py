@@ -45,28 +45,21 @@
 # POSSIBILITY OF SUCH DAMAGE.                                             #
 # ----------------------------------------------------------------------- #
 import os, numpy
+from functools import partial
 
 from aps.ai.autoalignment.common.simulation.facade.parameters import Implementors
 from aps.ai.autoalignment.beamline34IDC.facade.focusing_optics_factory import focusing_optics_factory_method, ExecutionMode
-from aps.ai.autoalignment.beamline34IDC.facade.focusing_optics_interface import Movement, DistanceUnits
+from aps.ai.autoalignment.beamline34IDC.facade.focusing_optics_interface import DistanceUnits
 from aps.ai.autoalignment.beamline34IDC.simulation.facade.focusing_optics_interface import get_default_input_features
 
-from aps.ai.autoalignment.common.util.shadow.common import get_shadow_beam_spatial_distribution, load_shadow_beam, PreProcessorFiles
+from aps.ai.autoalignment.common.util.shadow.common import PreProcessorFiles
+from aps.ai.autoalignment.common.util.shadow.shared_beam import SharedBeam, attach_shared_beam
+from aps.ai.autoalignment.common.util.scan import ScanEngine, ScanMotor, ScanType, BeamStatistics
 from aps.ai.autoalignment.common.util import clean_up
 
 from plot_focus_scan_bender import plot_3D
 
-if __name__ == "__main__":
-    verbose = False
-
-    os.chdir("../../../../../../work_directory/34-ID")
-
-    clean_up()
-
-    input_beam = load_shadow_beam("primary_optics_system_beam.dat")
-
-    # Focusing Optics System -------------------------
-
+def create_focusing_system(input_beam_descriptor):
     focusing_system = focusing_optics_factory_method(execution_mode=ExecutionMode.SIMULATION, implementor=Implementors.SHADOW, bender=2)
 
     input_features = get_default_input_features()
@@ -77,43 +70,82 @@ if __name__ == "__main__":
     input_features.set_parameter("hkb_motor_1_bender_position", 215.5)
     input_features.set_parameter("hkb_motor_2_bender_position", 110.5)
 
-    focusing_system.initialize(input_photon_beam=input_beam,
+    focusing_system.initialize(input_photon_beam=attach_shared_beam(input_beam_descriptor),
                                input_features=input_features,
                                power=1,
                                rewrite_preprocessor_files=PreProcessorFiles.NO,
                                rewrite_height_error_profile_files=False)
 
-    print("Initial V-KB bender positions and q (up, down) ",
-          focusing_system.get_vkb_motor_1_bender(units=DistanceUnits.MICRON),
-          focusing_system.get_vkb_motor_2_bender(units=DistanceUnits.MICRON),
-          focusing_system.get_vkb_q_distance())
-    print("Initial H-KB bender positions and q (up, down)",
-          focusing_system.get_hkb_motor_1_bender(units=DistanceUnits.MICRON),
-          focusing_system.get_hkb_motor_2_bender(units=DistanceUnits.MICRON),
-          focusing_system.get_hkb_q_distance())
+    return focusing_system
 
-    random_seed = 2120 # for repeatability
+if __name__ == "__main__":
+    verbose   = False
+    n_workers = 4
 
-    output_beam = focusing_system.get_photon_beam(verbose=verbose, near_field_calculation=True, debug_mode=False, random_seed=random_seed)
+    os.chdir("../../../../../../work_directory/34-ID")
 
-    v_pos_up   = focusing_system.get_vkb_motor_1_bender(units=DistanceUnits.MICRON)
-    v_pos_down = focusing_system.get_vkb_motor_2_bender(units=DistanceUnits.MICRON)
-    h_pos_up   = focusing_system.get_hkb_motor_1_bender(units=DistanceUnits.MICRON)
-    h_pos_down = focusing_system.get_hkb_motor_2_bender(units=DistanceUnits.MICRON)
+    clean_up()
 
-    n_points = [25, 25]
-    rel_pos = [-6.0, 6.0]
-    xrange = [-0.005, 0.005]
-    yrange = [-0.005, 0.005]
+    # the primary optics beam is loaded once and shared with the workers
+    with SharedBeam.from_file("primary_optics_system_beam.dat") as input_beam:
+
+        # Focusing Optics System -------------------------
+
+        focusing_system = create_focusing_system(input_beam.descriptor)
+
+        print("Initial V-KB bender positions and q (up, down) ",
+              focusing_system.get_vkb_motor_1_bender(units=DistanceUnits.MICRON),
+              focusing_system.get_vkb_motor_2_bender(units=DistanceUnits.MICRON),
+              focusing_system.get_vkb_q_distance())
+        print("Initial H-KB bender positions and q (up, down)",
+              focusing_system.get_hkb_motor_1_bender(units=DistanceUnits.MICRON),
+              focusing_system.get_hkb_motor_2_bender(units=DistanceUnits.MICRON),
+              focusing_system.get_hkb_q_distance())
+
+        random_seed = 2120 # for repeatability
+
+        v_pos_up   = focusing_system.get_vkb_motor_1_bender(units=DistanceUnits.MICRON)
+        v_pos_down = focusing_system.get_vkb_motor_2_bender(units=DistanceUnits.MICRON)
+        h_pos_up   = focusing_system.get_hkb_motor_1_bender(units=DistanceUnits.MICRON)
+        h_pos_down = focusing_system.get_hkb_motor_2_bender(units=DistanceUnits.MICRON)
+
+        n_points = [25, 25]
+        rel_pos = [-6.0, 6.0]
+        xrange = [-0.005, 0.005]
+        yrange = [-0.005, 0.005]
+
+        # upstream motors of the two KBs on the first axis, downstream on the second
+        motors = [ScanMotor("vkb_motor_1_bender", v_pos_up   + rel_pos[0], v_pos_up   + rel_pos[1], units=DistanceUnits.MICRON, axis="up"),
+                  ScanMotor("hkb_motor_1_bender", h_pos_up   + rel_pos[0], h_pos_up   + rel_pos[1], units=DistanceUnits.MICRON, axis="up"),
+                  ScanMotor("vkb_motor_2_bender", v_pos_down + rel_pos[0], v_pos_down + rel_pos[1], units=DistanceUnits.MICRON, axis="down"),
+                  ScanMotor("hkb_motor_2_bender", h_pos_down + rel_pos[0], h_pos_down + rel_pos[1], units=DistanceUnits.MICRON, axis="down")]
+
+        measure_function = BeamStatistics(parameters=("h_sigma", "v_sigma"),
+                                          beam_kwargs=dict(verbose=verbose, near_field_calculation=True, debug_mode=False, random_seed=random_seed),
+                                          xrange=xrange, yrange=yrange)
+
+        # points already in focus_scan_bender.jsonl (interrupted run) are not measured again
+        scan_engine = ScanEngine(motors,
+                                 measure_function,
+                                 scan_type=ScanType.GRID,
+                                 n_points=n_points,
+                                 results_file="focus_scan_bender.jsonl",
+                                 focusing_system=focusing_system,
+                                 focusing_system_factory=partial(create_focusing_system, input_beam.descriptor),
+                                 n_workers=n_workers,
+                                 verbose=True)
+
+        def print_progress(index, position, record):
+            if "error" in record: print("Point " + str(index) + " failed: " + record["error"])
+            else:                 print("Point " + str(index) + " " + str(numpy.round(position, 2)) + ": " + str(record["result"]))
+
+        results = scan_engine.run(callback=print_progress)
 
     v_abs_pos_up   = numpy.linspace(rel_pos[0], rel_pos[1], n_points[0]) + v_pos_up
     v_abs_pos_down = numpy.linspace(rel_pos[0], rel_pos[1], n_points[1]) + v_pos_down
     h_abs_pos_up   = numpy.linspace(rel_pos[0], rel_pos[1], n_points[0]) + h_pos_up
     h_abs_pos_down = numpy.linspace(rel_pos[0], rel_pos[1], n_points[1]) + h_pos_down
 
-    sigma_v = numpy.zeros((len(v_abs_pos_up), len(v_abs_pos_down)))
-    sigma_h = numpy.zeros((len(h_abs_pos_up), len(h_abs_pos_down)))
-
     positions_up = numpy.zeros((2, n_points[0]))
     positions_up[0, :] = v_abs_pos_up
     positions_up[1, :] = h_abs_pos_up
@@ -123,58 +155,17 @@ if __name__ == "__main__":
     with open("positions_up.npy", 'wb') as f: numpy.save(f, positions_up, allow_pickle=False)
     with open("positions_down.npy", 'wb') as f: numpy.save(f, positions_down, allow_pickle=False)
 
-    min_v = +numpy.inf
-    pos_min_v = None
-    min_h = +numpy.inf
-    pos_min_h = None
-
-    for i in range(n_points[0]):
-        focusing_system.move_vkb_motor_1_bender(pos_upstream=v_abs_pos_up[i],
-                                                movement=Movement.ABSOLUTE,
-                                                units=DistanceUnits.MICRON)
-        focusing_system.move_hkb_motor_1_bender(pos_upstream=h_abs_pos_up[i],
-                                                movement=Movement.ABSOLUTE,
-                                                units=DistanceUnits.MICRON)
-
-        for j in range(n_points[1]):
-            focusing_system.move_vkb_motor_2_bender(pos_downstream=v_abs_pos_down[j],
-                                                    movement=Movement.ABSOLUTE,
-                                                    units=DistanceUnits.MICRON)
-            focusing_system.move_hkb_motor_2_bender(pos_downstream=h_abs_pos_down[j],
-                                                    movement=Movement.ABSOLUTE,
-                                                    units=DistanceUnits.MICRON)
-
-            try:
-                _, dict = get_shadow_beam_spatial_distribution(focusing_system.get_photon_beam(verbose=verbose,
-                                                                                               near_field_calculation=True,
-                                                                                               debug_mode=False,
-                                                                                               random_seed=random_seed),
-                                                               xrange=xrange, yrange=yrange)
-
-                s_v = dict.get_parameter("v_sigma")
-                s_h = dict.get_parameter("h_sigma")
-
-                if s_v < min_v:
-                    min_v = s_v
-                    pos_min_v = [v_abs_pos_up[i], v_abs_pos_down[j]]
-
-                if s_h < min_h:
-                    min_h = s_h
-                    pos_min_h = [h_abs_pos_up[i], h_abs_pos_down[j]]
-
-                sigma_v[i, j] = s_v
-                sigma_h[i, j] = s_h
-            except Exception as e:
-                pass
-                raise e
-
-        print("Percentage completed: " + str(round(100*(1+i)*n_points[0] / (n_points[0]*n_points[1]), 2)))
+    sigma_v = results.get_value("v_sigma", shape=n_points)
+    sigma_h = results.get_value("h_sigma", shape=n_points)
 
     with open("sigma_v.npy", 'wb') as f: numpy.save(f, sigma_v, allow_pickle=False)
     with open("sigma_h.npy", 'wb') as f: numpy.save(f, sigma_h, allow_pickle=False)
 
-    print("V-KB: sigma min " + str(min_v) + " found at (U,D): " + str(pos_min_v))
-    print("H-KB: sigma min " + str(min_h) + " found at (U,D): " + str(pos_min_h))
+    i_v, j_v = numpy.unravel_index(numpy.nanargmin(sigma_v), sigma_v.shape)
+    i_h, j_h = numpy.unravel_index(numpy.nanargmin(sigma_h), sigma_h.shape)
+
+    print("V-KB: sigma min " + str(sigma_v[i_v, j_v]) + " found at (U,D): " + str([v_abs_pos_up[i_v], v_abs_pos_down[j_v]]))
+    print("H-KB: sigma min " + str(sigma_h[i_h, j_h]) + " found at (U,D): " + str([h_abs_pos_up[i_h], h_abs_pos_down[j_h]]))
 
     plot_3D(v_abs_pos_up, v_abs_pos_down, sigma_v*1e6, "Sigma (V)")
     plot_3D(h_abs_pos_up, h_abs_pos_down, sigma_h*1e6, "Sigma (H)")
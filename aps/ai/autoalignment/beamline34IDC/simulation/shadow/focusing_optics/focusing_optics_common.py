@@ -50,9 +50,8 @@ import Shadow
 
 from orangecontrib.shadow.util.shadow_objects import ShadowOpticalElement
 from orangecontrib.shadow.util.shadow_util import ShadowPhysics
-from orangecontrib.shadow.widgets.special_elements.bl import hybrid_control
 
-from aps.ai.autoalignment.common.util.shadow.common import TTYInibitor, HybridFailureException, PreProcessorFiles, write_reflectivity_file, write_dabam_file, get_hybrid_input_parameters, plot_shadow_beam_spatial_distribution
+from aps.ai.autoalignment.common.util.shadow.common import TTYInibitor, HybridFailureException, PreProcessorFiles, write_reflectivity_file, write_dabam_file, plot_shadow_beam_spatial_distribution
 from aps.ai.autoalignment.common.facade.parameters import DistanceUnits, MotorResolutionRegistry
 from aps.ai.autoalignment.common.simulation.shadow.focusing_optics import AbstractShadowFocusingOptics
 
@@ -170,7 +169,7 @@ class FocusingOpticsCommonAbstract(AbstractShadowFocusingOptics, AbstractSimulat
 
         if self._input_beam is None: raise ValueError("Focusing Optical System is not initialized")
 
-        self._check_beam(self._input_beam, "Primary Optical System", remove_lost_rays)
+        self._input_beam = self._check_beam(self._input_beam, "Primary Optical System", remove_lost_rays) # a shared input beam is copied if it has lost rays
 
         if not verbose:
             fortran_suppressor = TTYInibitor()
@@ -248,11 +247,12 @@ class FocusingOpticsCommonAbstract(AbstractShadowFocusingOptics, AbstractSimulat
 
         # HYBRID CORRECTION TO CONSIDER DIFFRACTION FROM SLITS
         try:
-            return hybrid_control.hy_run(get_hybrid_input_parameters(output_beam,
-                                                                     diffraction_plane=4,  # BOTH 1D+1D (3 is 2D)
-                                                                     calcType=1,  # Diffraction by Simple Aperture
-                                                                     verbose=verbose,
-                                                                     random_seed=None if random_seed is None else (random_seed + 100))).ff_beam
+            return self._run_hybrid(output_beam,
+                                    beam_type="ff_beam",
+                                    diffraction_plane=4,  # BOTH 1D+1D (3 is 2D)
+                                    calcType=1,  # Diffraction by Simple Aperture
+                                    verbose=verbose,
+                                    random_seed=None if random_seed is None else (random_seed + 100))
         except Exception:
             raise HybridFailureException(oe="Coherence Slits")
 
@@ -50,9 +50,8 @@ import numpy
 import Shadow
 
 from orangecontrib.shadow.util.shadow_objects import ShadowOpticalElement
-from orangecontrib.shadow.widgets.special_elements.bl import hybrid_control
 
-from aps.ai.autoalignment.common.util.shadow.common import HybridFailureException, rotate_axis_system, get_hybrid_input_parameters
+from aps.ai.autoalignment.common.util.shadow.common import HybridFailureException, rotate_axis_system
 from aps.ai.autoalignment.common.facade.parameters import Movement, AngularUnits, DistanceUnits
 
 from aps.ai.autoalignment.beamline34IDC.simulation.shadow.focusing_optics.focusing_optics_common import FocusingOpticsCommonAbstract
@@ -210,19 +209,21 @@ class IdealFocusingOptics(FocusingOpticsCommonAbstract):
         # NOTE: Near field not possible for vkb (beam is untraceable)
         try:
             if not near_field_calculation:
-                output_beam =  hybrid_control.hy_run(get_hybrid_input_parameters(output_beam,
-                                                                                 diffraction_plane=2,  # Tangential
-                                                                                 calcType=3,  # Diffraction by Mirror Size + Errors
-                                                                                 verbose=verbose,
-                                                                                 random_seed=None if random_seed is None else (random_seed + 200))).ff_beam
+                output_beam =  self._run_hybrid(output_beam,
+                                                beam_type="ff_beam",
+                                                diffraction_plane=2,  # Tangential
+                                                calcType=3,  # Diffraction by Mirror Size + Errors
+                                                verbose=verbose,
+                                                random_seed=None if random_seed is None else (random_seed + 200))
             else:
-                output_beam =  hybrid_control.hy_run(get_hybrid_input_parameters(output_beam,
-                                                                                 diffraction_plane=2,  # Tangential
-                                                                                 calcType=3,  # Diffraction by Mirror Size + Errors
-                                                                                 nf=1,
-                                                                                 image_distance=self._vkb._oe.T_IMAGE + self._hkb._oe.T_SOURCE + self._hkb._oe.T_IMAGE,
-                                                                                 verbose=verbose,
-                                                                                 random_seed=None if random_seed is None else (random_seed + 200))).nf_beam
+                output_beam =  self._run_hybrid(output_beam,
+                                                beam_type="nf_beam",
+                                                diffraction_plane=2,  # Tangential
+                                                calcType=3,  # Diffraction by Mirror Size + Errors
+                                                nf=1,
+                                                image_distance=self._vkb._oe.T_IMAGE + self._hkb._oe.T_SOURCE + self._hkb._oe.T_IMAGE,
+                                                verbose=verbose,
+                                                random_seed=None if random_seed is None else (random_seed + 200))
         except Exception:
             raise HybridFailureException(oe="V-KB")
 
@@ -237,18 +238,20 @@ class IdealFocusingOptics(FocusingOpticsCommonAbstract):
                               remove_lost_rays=remove_lost_rays)
         try:
             if not near_field_calculation:
-                output_beam = hybrid_control.hy_run(get_hybrid_input_parameters(output_beam,
-                                                                                diffraction_plane=2,  # Tangential
-                                                                                calcType=3,  # Diffraction by Mirror Size + Errors
-                                                                                verbose=verbose,
-                                                                                random_seed=None if random_seed is None else (random_seed + 300))).ff_beam
+                output_beam = self._run_hybrid(output_beam,
+                                               beam_type="ff_beam",
+                                               diffraction_plane=2,  # Tangential
+                                               calcType=3,  # Diffraction by Mirror Size + Errors
+                                               verbose=verbose,
+                                               random_seed=None if random_seed is None else (random_seed + 300))
             else:
-                output_beam = hybrid_control.hy_run(get_hybrid_input_parameters(output_beam,
-                                                                                diffraction_plane=2,  # Tangential
-                                                                                calcType=3,  # Diffraction by Mirror Size + Errors
-                                                                                nf=1,
-                                                                                verbose=verbose,
-                                                                                random_seed=None if random_seed is None else (random_seed + 300))).nf_beam
+                output_beam = self._run_hybrid(output_beam,
+                                               beam_type="nf_beam",
+                                               diffraction_plane=2,  # Tangential
+                                               calcType=3,  # Diffraction by Mirror Size + Errors
+                                               nf=1,
+                                               verbose=verbose,
+                                               random_seed=None if random_seed is None else (random_seed + 300))
         except Exception:
             raise HybridFailureException(oe="H-KB")
 
@@ -51,9 +51,8 @@ import Shadow
 from Shadow import ShadowTools as ST
 
 from orangecontrib.shadow.util.shadow_objects import ShadowOpticalElement
-from orangecontrib.shadow.widgets.special_elements.bl import hybrid_control
 
-from aps.ai.autoalignment.common.util.shadow.common import HybridFailureException, rotate_axis_system, get_hybrid_input_parameters
+from aps.ai.autoalignment.common.util.shadow.common import HybridFailureException, rotate_axis_system
 from aps.ai.autoalignment.common.facade.parameters import Movement, DistanceUnits, AngularUnits
 
 from aps.ai.autoalignment.beamline34IDC.simulation.shadow.focusing_optics.focusing_optics_common import FocusingOpticsCommonAbstract
@@ -346,18 +345,20 @@ class CalibratedBendableFocusingOptics(FocusingOpticsCommonAbstract):
         def run_hybrid(output_beam):
             try:
                 if not near_field_calculation:
-                    return hybrid_control.hy_run(get_hybrid_input_parameters(output_beam,
-                                                                             diffraction_plane=2,  # Tangential
-                                                                             calcType=3,  # Diffraction by Mirror Size + Errors
-                                                                             verbose=verbose,
-                                                                             random_seed=None if random_seed is None else (random_seed + increment))).ff_beam
+                    return self._run_hybrid(output_beam,
+                                            beam_type="ff_beam",
+                                            diffraction_plane=2,  # Tangential
+                                            calcType=3,  # Diffraction by Mirror Size + Errors
+                                            verbose=verbose,
+                                            random_seed=None if random_seed is None else (random_seed + increment))
                 else:
-                    return hybrid_control.hy_run(get_hybrid_input_parameters(output_beam,
-                                                                             diffraction_plane=2,  # Tangential
-                                                                             calcType=3,  # Diffraction by Mirror Size + Errors
-                                                                             nf=1,
-                                                                             verbose=verbose,
-                                                                             random_seed=None if random_seed is None else (random_seed + increment + 1))).nf_beam
+                    return self._run_hybrid(output_beam,
+                                            beam_type="nf_beam",
+                                            diffraction_plane=2,  # Tangential
+                                            calcType=3,  # Diffraction by Mirror Size + Errors
+                                            nf=1,
+                                            verbose=verbose,
+                                            random_seed=None if random_seed is None else (random_seed + increment + 1))
             except Exception:
                 raise HybridFailureException(oe=oe_name)
 
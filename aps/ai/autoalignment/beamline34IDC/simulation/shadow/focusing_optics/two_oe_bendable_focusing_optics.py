@@ -50,9 +50,8 @@ import numpy
 import Shadow
 
 from orangecontrib.shadow.util.shadow_objects import ShadowOpticalElement, ShadowBeam
-from orangecontrib.shadow.widgets.special_elements.bl import hybrid_control
 
-from aps.ai.autoalignment.common.util.shadow.common import HybridFailureException, rotate_axis_system, get_hybrid_input_parameters
+from aps.ai.autoalignment.common.util.shadow.common import HybridFailureException, rotate_axis_system
 from aps.ai.autoalignment.common.facade.parameters import Movement, AngularUnits, DistanceUnits
 
 from aps.ai.autoalignment.beamline34IDC.simulation.shadow.focusing_optics.focusing_optics_common import FocusingOpticsCommonAbstract
@@ -334,30 +333,32 @@ class TwoOEBendableFocusingOptics(FocusingOpticsCommonAbstract):
                             oe_name="V-KB",
                             remove_lost_rays=remove_lost_rays)
 
-        def run_hybrid(output_beam, increment):
+        def get_hybrid_parameters(increment):
             # NOTE: Near field not possible for vkb (beam is untraceable)
-            try:
-                if not near_field_calculation:
-                    return hybrid_control.hy_run(get_hybrid_input_parameters(output_beam,
-                                                                             diffraction_plane=2,  # Tangential
-                                                                             calcType=3,  # Diffraction by Mirror Size + Errors
-                                                                             verbose=verbose,
-                                                                             random_seed=None if random_seed is None else (random_seed + increment))).ff_beam
-                else:
-                    return hybrid_control.hy_run(get_hybrid_input_parameters(output_beam,
-                                                                             diffraction_plane=2,  # Tangential
-                                                                             calcType=3,  # Diffraction by Mirror Size + Errors
-                                                                             nf=1,
-                                                                             image_distance=self._vkb[0]._oe.T_IMAGE + self._hkb[0]._oe.T_SOURCE + self._hkb[0]._oe.T_IMAGE,
-                                                                             verbose=verbose,
-                                                                             random_seed=None if random_seed is None else (random_seed + increment))).nf_beam
-            except Exception:
-                raise HybridFailureException(oe="V-KB")
-
-        output_beam_upstream = run_hybrid(output_beam_upstream, increment=200)
-        output_beam_upstream._beam.rays = output_beam_upstream._beam.rays[cursor_upstream]
-
-        output_beam_downstream = run_hybrid(output_beam_downstream, increment=201)
+            if not near_field_calculation:
+                return "ff_beam", dict(diffraction_plane=2,  # Tangential
+                                       calcType=3,  # Diffraction by Mirror Size + Errors
+                                       verbose=verbose,
+                                       random_seed=None if random_seed is None else (random_seed + increment))
+            else:
+                return "nf_beam", dict(diffraction_plane=2,  # Tangential
+                                       calcType=3,  # Diffraction by Mirror Size + Errors
+                                       nf=1,
+                                       image_distance=self._vkb[0]._oe.T_IMAGE + self._hkb[0]._oe.T_SOURCE + self._hkb[0]._oe.T_IMAGE,
+                                       verbose=verbose,
+                                       random_seed=None if random_seed is None else (random_seed + increment))
+
+        # the two sides of the mirror are independent: concurrent HYBRID calculations with n_hybrid_processes > 1
+        beam_type, hybrid_parameters_upstream   = get_hybrid_parameters(increment=200)
+        _,         hybrid_parameters_downstream = get_hybrid_parameters(increment=201)
+
+        try:
+            output_beam_upstream, output_beam_downstream = self._run_hybrid_concurrently([(output_beam_upstream,   beam_type, hybrid_parameters_upstream),
+                                                                                          (output_beam_downstream, beam_type, hybrid_parameters_downstream)])
+        except Exception:
+            raise HybridFailureException(oe="V-KB")
+
+        output_beam_upstream._beam.rays   = output_beam_upstream._beam.rays[cursor_upstream]
         output_beam_downstream._beam.rays = output_beam_downstream._beam.rays[cursor_downstream]
 
         output_beam = ShadowBeam.mergeBeams(output_beam_upstream, output_beam_downstream, which_flux=3, merge_history=0)
@@ -376,28 +377,30 @@ class TwoOEBendableFocusingOptics(FocusingOpticsCommonAbstract):
                             oe_name="H-KB",
                             remove_lost_rays=remove_lost_rays)
 
-        def run_hybrid(output_beam, increment):
-            try:
-                if not near_field_calculation:
-                    return hybrid_control.hy_run(get_hybrid_input_parameters(output_beam,
-                                                                             diffraction_plane=2,  # Tangential
-                                                                             calcType=3,  # Diffraction by Mirror Size + Errors
-                                                                             verbose=verbose,
-                                                                             random_seed=None if random_seed is None else (random_seed + increment))).ff_beam
-                else:
-                    return hybrid_control.hy_run(get_hybrid_input_parameters(output_beam,
-                                                                             diffraction_plane=2,  # Tangential
-                                                                             calcType=3,  # Diffraction by Mirror Size + Errors
-                                                                             nf=1,
-                                                                             verbose=verbose,
-                                                                             random_seed=None if random_seed is None else (random_seed + increment))).nf_beam
-            except Exception:
-                raise HybridFailureException(oe="H-KB")
-
-        output_beam_upstream = run_hybrid(output_beam_upstream, increment=300)
-        output_beam_upstream._beam.rays = output_beam_upstream._beam.rays[cursor_upstream]
-
-        output_beam_downstream = run_hybrid(output_beam_downstream, increment=301)
+        def get_hybrid_parameters(increment):
+            if not near_field_calculation:
+                return "ff_beam", dict(diffraction_plane=2,  # Tangential
+                                       calcType=3,  # Diffraction by Mirror Size + Errors
+                                       verbose=verbose,
+                                       random_seed=None if random_seed is None else (random_seed + increment))
+            else:
+                return "nf_beam", dict(diffraction_plane=2,  # Tangential
+                                       calcType=3,  # Diffraction by Mirror Size + Errors
+                                       nf=1,
+                                       verbose=verbose,
+                                       random_seed=None if random_seed is None else (random_seed + increment))
+
+        # the two sides of the mirror are independent: concurrent HYBRID calculations with n_hybrid_processes > 1
+        beam_type, hybrid_parameters_upstream   = get_hybrid_parameters(increment=300)
+        _,         hybrid_parameters_downstream = get_hybrid_parameters(increment=301)
+
+        try:
+            output_beam_upstream, output_beam_downstream = self._run_hybrid_concurrently([(output_beam_upstream,   beam_type, hybrid_parameters_upstream),
+                                                                                          (output_beam_downstream, beam_type, hybrid_parameters_downstream)])
+        except Exception:
+            raise HybridFailureException(oe="H-KB")
+
+        output_beam_upstream._beam.rays   = output_beam_upstream._beam.rays[cursor_upstream]
         output_beam_downstream._beam.rays = output_beam_downstream._beam.rays[cursor_downstream]
 
         output_beam = ShadowBeam.mergeBeams(output_beam_upstream, output_beam_downstream, which_flux=3, merge_history=0)
@@ -49,6 +49,9 @@ import numpy
 from aps.ai.autoalignment.common.facade.parameters import Movement, DistanceUnits, AngularUnits, MotorResolutionRegistry
 from aps.ai.autoalignment.common.util.srw.common import write_dabam_file, plot_srw_wavefront_spatial_distribution
 from aps.ai.autoalignment.common.simulation.srw.focusing_optics import AbstractSRWFocusingOptics
+from aps.ai.autoalignment.common.simulation.srw.wavefront_propagation import WavefrontCache, get_optical_element_state, propagate_incoherent_wavefronts, DEFAULT_WAVEFRONT_CACHE_SIZE
+
+from aps.ai.autoalignment.beamline34IDC.simulation.srw import initialize_propagator_2D
 
 from aps.ai.autoalignment.beamline34IDC.simulation.facade.focusing_optics_interface import AbstractSimulatedFocusingOptics, get_default_input_features
 
@@ -91,9 +94,18 @@ class _FocusingOpticsCommon(AbstractSRWFocusingOptics, AbstractSimulatedFocusing
         self._vkb = None
         self._hkb = None
 
+        self._wavefront_cache = None
+        self._wavefront_keys  = {} # keys of the wavefronts currently held by the elements
+
     def initialize(self, **kwargs):
         super(_FocusingOpticsCommon, self).initialize(**kwargs)
 
+        try:    wavefront_cache_size = kwargs["wavefront_cache_size"]
+        except: wavefront_cache_size = DEFAULT_WAVEFRONT_CACHE_SIZE
+
+        self._wavefront_cache = WavefrontCache(max_size=wavefront_cache_size)
+        self._wavefront_keys  = {}
+
         try:    self._input_features = kwargs["input_features"]
         except: self._input_features = get_default_input_features()
 
@@ -145,8 +157,6 @@ class _FocusingOpticsCommon(AbstractSRWFocusingOptics, AbstractSimulatedFocusing
 
         self._initialize_kb(self._input_features, vkb_error_profile_file, hkb_error_profile_file)
 
-        self._modified_elements = [self._coherence_slits, self._vkb, self._hkb]
-
     def modify_coherence_slits(self, coh_slits_h_center=None, coh_slits_v_center=None, coh_slits_h_aperture=None, coh_slits_v_aperture=None, units=DistanceUnits.MICRON):
         boundaries = self._coherence_slits._boundary_shape.get_boundaries()
 
@@ -195,39 +205,62 @@ class _FocusingOpticsCommon(AbstractSRWFocusingOptics, AbstractSimulatedFocusing
 
         if self._input_wavefront is None: raise ValueError("Focusing Optical System is not initialized")
 
-        PropagationManager.Instance().set_propagation_mode(SRW_APPLICATION, SRWPropagationMode.STEP_BY_STEP)
+        # multi-electron or energy-resolved calculation: the given wavefronts (one per macro-electron or photon energy)
+        # are propagated through the whole system on a process pool, and the output is the sum of their intensities
+        try:    input_photon_beams = kwargs["input_photon_beams"]
+        except: input_photon_beams = None
+
+        if not input_photon_beams is None:
+            return propagate_incoherent_wavefronts(propagation_chain=[self._coherence_slits_propagation_parameters,
+                                                                      self._vkb_propagation_parameters,
+                                                                      self._hkb_propagation_parameters],
+                                                   handler_name=FresnelSRWNative.HANDLER_NAME,
+                                                   input_wavefronts=input_photon_beams,
+                                                   weights=kwargs.get("weights", None),
+                                                   n_processes=kwargs.get("n_processes", None),
+                                                   initializer=initialize_propagator_2D)
 
-        output_wavefront = None
+        PropagationManager.Instance().set_propagation_mode(SRW_APPLICATION, SRWPropagationMode.STEP_BY_STEP)
 
         try:
-            run_all = self._modified_elements == [] or len(self._modified_elements) == 3
-
-            if run_all or self._coherence_slits in self._modified_elements:
-                self._slits_wavefront = self._propagate_coherence_slits(verbose)
-                output_wavefront = self._slits_wavefront
-
-                if debug_mode: plot_srw_wavefront_spatial_distribution(self._slits_wavefront, title="Coherence Slits", xrange=None, yrange=None)
+            # every element is propagated only if it, or any element upstream, changed since the last run and its state is not found in the cache
+            slits_key = (self._input_wavefront_version, get_optical_element_state(self._coherence_slits))
+            vkb_key   = (slits_key, get_optical_element_state(self._vkb))
+            hkb_key   = (vkb_key, get_optical_element_state(self._hkb))
 
-            if run_all or self._vkb in self._modified_elements:
-                self._vkb_wavefront = self._propagate_vkb(verbose)
-                output_wavefront = self._vkb_wavefront
+            self._slits_wavefront, propagated = self._get_cached_wavefront("slits", slits_key, self._slits_wavefront, self._propagate_coherence_slits, verbose)
+            if debug_mode and propagated: plot_srw_wavefront_spatial_distribution(self._slits_wavefront, title="Coherence Slits", xrange=None, yrange=None)
 
-                if debug_mode: plot_srw_wavefront_spatial_distribution(self._vkb_wavefront, title="VKB", xrange=None, yrange=None)
+            self._vkb_wavefront, propagated = self._get_cached_wavefront("vkb", vkb_key, self._vkb_wavefront, self._propagate_vkb, verbose)
+            if debug_mode and propagated: plot_srw_wavefront_spatial_distribution(self._vkb_wavefront, title="VKB", xrange=None, yrange=None)
 
-            if run_all or self._hkb in self._modified_elements:
-                self._hkb_wavefront = self._propagate_hkb(verbose)
-                output_wavefront = self._hkb_wavefront
+            self._hkb_wavefront, propagated = self._get_cached_wavefront("hkb", hkb_key, self._hkb_wavefront, self._propagate_hkb, verbose)
+            if debug_mode and propagated: plot_srw_wavefront_spatial_distribution(self._hkb_wavefront, title="HKB", xrange=None, yrange=None)
 
-                if debug_mode: plot_srw_wavefront_spatial_distribution(self._hkb_wavefront, title="HKB", xrange=None, yrange=None)
-
-            # after every run, the list of modified elements must be empty
-            self._modified_elements = []
+            output_wavefront = self._hkb_wavefront.duplicate() # the wavefront of the HKB is re-used by the next runs
 
         except Exception as e:
             raise e
 
         return output_wavefront
 
+    def _get_cached_wavefront(self, element_name, key, current_wavefront, propagate_method, verbose):
+        if not current_wavefront is None and self._wavefront_keys.get(element_name) == key: return current_wavefront, False # unchanged
+
+        wavefront = self._wavefront_cache.get(key)
+
+        if wavefront is None:
+            wavefront  = propagate_method(verbose)
+            propagated = True
+            self._wavefront_cache.put(key, wavefront)
+        else:
+            propagated = False
+            if verbose: print("Wavefront found in cache (hits: " + str(self._wavefront_cache.hits) + ", misses: " + str(self._wavefront_cache.misses) + ")")
+
+        self._wavefront_keys[element_name] = key
+
+        return wavefront, propagated
+
     def _propagate_coherence_slits(self, verbose):
         self._coherence_slits_propagation_parameters._wavefront = self._input_wavefront.duplicate()
 
@@ -334,9 +367,6 @@ class __IdealFocusingOptics(_FocusingOpticsCommon):
         self._move_pitch_motor(self._vkb, angle, movement, units,
                                  round_digit=self._motor_resolution.get_motor_resolution("vkb_motor_3_pitch", units=AngularUnits.RADIANS)[1], invert=True)
 
-        if not self._vkb in self._modified_elements: self._modified_elements.append(self._vkb)
-        if not self._hkb in self._modified_elements: self._modified_elements.append(self._hkb)
-
     def get_vkb_motor_3_pitch(self, units=AngularUnits.MILLIRADIANS):
         return self._get_pitch_motor_value(self._vkb, units, invert=True)
 
@@ -344,18 +374,12 @@ class __IdealFocusingOptics(_FocusingOpticsCommon):
         self._move_translation_motor(self._vkb, translation, movement, units,
                                       round_digit=self._motor_resolution.get_motor_resolution("vkb_motor_4_translation", units=DistanceUnits.MILLIMETERS)[1] + 3)
 
-        if not self._vkb in self._modified_elements: self._modified_elements.append(self._vkb)
-        if not self._hkb in self._modified_elements: self._modified_elements.append(self._hkb)
-
     def get_vkb_motor_4_translation(self, units=DistanceUnits.MICRON):
         return self._get_translation_motor_value(self._vkb, units)
 
     def change_vkb_shape(self, q_distance, movement=Movement.ABSOLUTE):
         self._change_shape(self._vkb, q_distance, movement)
 
-        if not self._vkb in self._modified_elements: self._modified_elements.append(self._vkb)
-        if not self._hkb in self._modified_elements: self._modified_elements.append(self._hkb)
-
     def get_vkb_q_distance(self):
         return self._get_q_distance(self._vkb)
 
@@ -365,8 +389,6 @@ class __IdealFocusingOptics(_FocusingOpticsCommon):
         self._move_pitch_motor(self._hkb, angle, movement, units,
                                  round_digit=self._motor_resolution.get_motor_resolution("hkb_motor_3_pitch", units=AngularUnits.RADIANS)[1])
 
-        if not self._hkb in self._modified_elements: self._modified_elements.append(self._hkb)
-
     def get_hkb_motor_3_pitch(self, units=AngularUnits.MILLIRADIANS):
         return self._get_pitch_motor_value(self._hkb, units)
 
@@ -374,16 +396,12 @@ class __IdealFocusingOptics(_FocusingOpticsCommon):
         self._move_translation_motor(self._hkb, translation, movement, units,
                                       round_digit=self._motor_resolution.get_motor_resolution("hkb_motor_4_translation", units=DistanceUnits.MILLIMETERS)[1] + 3)
 
-        if not self._hkb in self._modified_elements: self._modified_elements.append(self._hkb)
-
     def get_hkb_motor_4_translation(self, units=DistanceUnits.MICRON):
         return self._get_translation_motor_value(self._hkb, units)
 
     def change_hkb_shape(self, q_distance, movement=Movement.ABSOLUTE):
         self._change_shape(self._hkb, q_distance, movement)
 
-        if not self._hkb in self._modified_elements: self._modified_elements.append(self._hkb)
-
     def get_hkb_q_distance(self):
         return self._get_q_distance(self._hkb)
 
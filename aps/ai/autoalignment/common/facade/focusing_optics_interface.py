@@ -44,7 +44,9 @@
 # ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
 # POSSIBILITY OF SUCH DAMAGE.                                             #
 # ----------------------------------------------------------------------- #
+from contextlib import nullcontext
 
 class AbstractFocusingOptics():
     def initialize(self, **kwargs): raise NotImplementedError()
     def get_photon_beam(self, **kwargs): raise NotImplementedError()
+    def position_snapshot(self): return nullcontext() # consistent reading of all the motor positions (hardware)
@@ -47,14 +47,82 @@
 import numpy
 
 from aps.ai.autoalignment.common.facade.parameters import Movement, DistanceUnits, AngularUnits
+from aps.ai.autoalignment.common.hardware.epics.move_planner import MovePlanner
+from aps.ai.autoalignment.common.hardware.epics.position_cache import PositionCache
+from aps.ai.autoalignment.common.hardware.epics.watchdog import Watchdog, WatchdogException, OperationType
 
 from epics import PV
 
 class AbstractEpicsOptics():
 
-    def __init__(self, translational_units=DistanceUnits.MICRON, angular_units=AngularUnits.MILLIRADIANS):
+    def __init__(self, translational_units=DistanceUnits.MICRON, angular_units=AngularUnits.MILLIRADIANS, move_planner=None, watchdog=None, position_cache=None):
         self.__translational_units=translational_units
         self.__angular_units=angular_units
+        self.__move_planner   = MovePlanner() if move_planner is None else move_planner
+        self.__watchdog       = Watchdog() if watchdog is None else watchdog
+        self.__position_cache = PositionCache() if position_cache is None else position_cache
+        self.__readback_pvs   = {}
+        self.__stop_pvs       = {}
+
+    @property
+    def move_planner(self): return self.__move_planner
+    @property
+    def watchdog(self): return self.__watchdog
+    @property
+    def position_cache(self): return self.__position_cache
+
+    def position_snapshot(self): return self.__position_cache.snapshot()
+
+    # PROTECTED METHODS (move planning: approach direction, overshoot-and-return, backlash compensation)
+
+    def _get_position(self, pv : PV):
+        # logical position: the target of the last move, also if the planner put a compensated setpoint
+        return self.__move_planner.get_position(pv.pvname, self.__position_cache.get(pv))
+
+    def _plan_move(self, pv : PV, target):
+        return self.__move_planner.plan(pv.pvname, self.__position_cache.get(pv), target)
+
+    def _put_position(self, pv : PV, target, wait=True, readback_pv : PV = None):
+        try:
+            setpoints = self._plan_move(pv, target)
+            for index, setpoint in enumerate(setpoints):
+                if wait or index < len(setpoints) - 1: self._put_and_wait(pv, setpoint, readback_pv) # the overshoot must be completed before the return
+                else:                                  pv.put(setpoint)
+                self.__position_cache.set(pv, setpoint)
+        except:
+            self.__move_planner.reset(pv.pvname)
+            self.__position_cache.invalidate(pv.pvname)
+            raise
+
+        if self.__move_planner.record_moves and wait and len(setpoints) > 0: self._record_move(pv, setpoints[-1], readback_pv)
+
+    def _record_move(self, pv : PV, setpoint, readback_pv : PV = None):
+        self.__move_planner.record(pv.pvname, setpoint, self._get_readback_pv(pv, readback_pv).get())
+
+    # PROTECTED METHODS (watchdog: timing budget, stall detection and retries of the moves)
+
+    def _put_and_wait(self, pv : PV, setpoint, readback_pv : PV = None, operation=OperationType.MOTOR_MOVE):
+        readback_pv = self._get_readback_pv(pv, readback_pv)
+
+        def move():
+            if pv.put(setpoint, use_complete=True) is None: raise WatchdogException(pv.pvname + " not connected")
+            self.__watchdog.wait_for(pv.pvname, operation,
+                                     is_done=lambda: pv.put_complete,
+                                     distance=lambda: abs(readback_pv.get() - setpoint))
+
+        self.__watchdog.run(pv.pvname, operation, move, recovery=lambda: self._stop_motor(pv))
+
+    def _stop_motor(self, pv : PV):
+        # STOP field of the EPICS motor record
+        if not pv.pvname in self.__stop_pvs: self.__stop_pvs[pv.pvname] = PV(pvname=pv.pvname.split(".")[0] + ".STOP")
+        self.__stop_pvs[pv.pvname].put(1)
+
+    def _get_readback_pv(self, pv : PV, readback_pv : PV = None):
+        if readback_pv is None: # readback of the EPICS motor record
+            if not pv.pvname in self.__readback_pvs: self.__readback_pvs[pv.pvname] = PV(pvname=pv.pvname.split(".")[0] + ".RBV")
+            readback_pv = self.__readback_pvs[pv.pvname]
+
+        return readback_pv
 
     # PRIVATE METHODS
 
@@ -67,8 +135,8 @@ class AbstractEpicsOptics():
             elif self.__translational_units == DistanceUnits.MICRON: pass
         else: raise ValueError("Distance units not recognized")
 
-        if movement == Movement.ABSOLUTE:   pv.put(pos, wait=wait)
-        elif movement == Movement.RELATIVE: pv.put(pv.get() + pos, wait=wait)
+        if movement == Movement.ABSOLUTE:   self._put_position(pv, pos, wait=wait)
+        elif movement == Movement.RELATIVE: self._put_position(pv, self._get_position(pv) + pos, wait=wait)
         else: raise ValueError("Movement not recognized")
 
     def _move_rotational_motor(self, pv : PV, angle, movement=Movement.ABSOLUTE, units=AngularUnits.MILLIRADIANS, wait=True):
@@ -86,30 +154,30 @@ class AbstractEpicsOptics():
             elif self.__angular_units == AngularUnits.RADIANS:      pass
         else:  raise ValueError("Angular units not recognized")
 
-        if movement == Movement.ABSOLUTE:   pv.put(angle, wait=wait)
-        elif movement == Movement.RELATIVE: pv.put(pv.get() + angle, wait=wait)
+        if movement == Movement.ABSOLUTE:   self._put_position(pv, angle, wait=wait)
+        elif movement == Movement.RELATIVE: self._put_position(pv, self._get_position(pv) + angle, wait=wait)
         else: raise ValueError("Movement not recognized")
 
     def _get_translational_motor_position(self, pv : PV, units=DistanceUnits.MICRON):
         if units == DistanceUnits.MILLIMETERS:
-            if self.__translational_units == DistanceUnits.MILLIMETERS: return pv.get()
-            elif self.__translational_units == DistanceUnits.MICRON: return 1e-3 * pv.get()
+            if self.__translational_units == DistanceUnits.MILLIMETERS: return self._get_position(pv)
+            elif self.__translational_units == DistanceUnits.MICRON: return 1e-3 * self._get_position(pv)
         elif units == DistanceUnits.MICRON:
-            if self.__translational_units == DistanceUnits.MILLIMETERS: return 1e3 * pv.get()
-            elif self.__translational_units == DistanceUnits.MICRON: return pv.get()
+            if self.__translational_units == DistanceUnits.MILLIMETERS: return 1e3 * self._get_position(pv)
+            elif self.__translational_units == DistanceUnits.MICRON: return self._get_position(pv)
         else: raise ValueError("Distance units not recognized")
 
     def _get_rotational_motor_angle(self, pv : PV, units=AngularUnits.MILLIRADIANS):
         if units == AngularUnits.MILLIRADIANS:
-            if self.__angular_units   == AngularUnits.MILLIRADIANS: return pv.get()
-            elif self.__angular_units == AngularUnits.DEGREES:      return 1e3 * numpy.radians(pv.get())
-            elif self.__angular_units == AngularUnits.RADIANS:      return 1e3 * pv.get()
+            if self.__angular_units   == AngularUnits.MILLIRADIANS: return self._get_position(pv)
+            elif self.__angular_units == AngularUnits.DEGREES:      return 1e3 * numpy.radians(self._get_position(pv))
+            elif self.__angular_units == AngularUnits.RADIANS:      return 1e3 * self._get_position(pv)
         elif units == AngularUnits.DEGREES:
-            if self.__angular_units   == AngularUnits.MILLIRADIANS: return numpy.degrees(1e-3 * pv.get())
-            elif self.__angular_units == AngularUnits.DEGREES:      return pv.get()
-            elif self.__angular_units == AngularUnits.RADIANS:      return numpy.degrees(pv.get())
+            if self.__angular_units   == AngularUnits.MILLIRADIANS: return numpy.degrees(1e-3 * self._get_position(pv))
+            elif self.__angular_units == AngularUnits.DEGREES:      return self._get_position(pv)
+            elif self.__angular_units == AngularUnits.RADIANS:      return numpy.degrees(self._get_position(pv))
         elif units == AngularUnits.RADIANS:
-            if self.__angular_units   == AngularUnits.MILLIRADIANS: return 1e-3 * pv.get()
-            elif self.__angular_units == AngularUnits.DEGREES:      return numpy.radians(pv.get())
-            elif self.__angular_units == AngularUnits.RADIANS:      return pv.get()
+            if self.__angular_units   == AngularUnits.MILLIRADIANS: return 1e-3 * self._get_position(pv)
+            elif self.__angular_units == AngularUnits.DEGREES:      return numpy.radians(self._get_position(pv))
+            elif self.__angular_units == AngularUnits.RADIANS:      return self._get_position(pv)
         else:  raise ValueError("Angular units not recognized")
\ No newline at end of file
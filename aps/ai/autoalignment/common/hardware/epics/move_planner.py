@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------- #
+# Copyright (c) 2021, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2021. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# ----------------------------------------------------------------------- #
+import numpy
+
+#############################################################################
+# Move planning:
+#
+# mechanical backlash and the hysteresis of the benders make the position
+# reached by a motor depend on the direction of the last move: a target
+# approached from different directions is reached at different positions,
+# and this spread adds to the noise of the measurements. The planner turns
+# every move of a motor (identified by its PV name) into the sequence of
+# setpoints to be put, according to the strategy of the motor:
+#
+# DIRECT         : the target only (no planning).
+# UNIDIRECTIONAL : the final approach is always in approach_direction: moves
+#                  from the wrong side go first past the target by the
+#                  overshoot and then return (overshoot-and-return). The
+#                  overshoot is skipped when the motor is already moving in
+#                  the approach direction and the slack is taken up (the last
+#                  move was in the same direction, or the move is longer than
+#                  the overshoot): no extra time when not needed.
+# COMPENSATED    : one move to a setpoint corrected with the backlash model
+#                  (open loop, no extra moves): after a move in direction d
+#                  the motor is at setpoint - d * backlash/2 + offset.
+#
+# The backlash models are calibrated from recorded moves (direction of the
+# final approach, setpoint, readback), e.g. collected with DIRECT moves in
+# both directions (record_moves=True).
+#
+
+class MoveStrategy:
+    DIRECT         = "direct"
+    UNIDIRECTIONAL = "unidirectional"
+    COMPENSATED    = "compensated"
+
+class BacklashModel():
+    """
+    Lost motion of a motor: after a move in direction (+1, -1) the motor is at setpoint - direction * backlash/2 + offset.
+    """
+    def __init__(self, backlash=0.0, offset=0.0):
+        self.backlash = backlash
+        self.offset   = offset
+
+    def get_position(self, setpoint, direction): return setpoint - direction * 0.5 * self.backlash + self.offset
+    def get_setpoint(self, position, direction): return position + direction * 0.5 * self.backlash - self.offset
+
+    def to_dictionary(self): return {"backlash": self.backlash, "offset": self.offset}
+
+def calibrate_backlash_model(directions, setpoints, readbacks):
+    """
+    Backlash model from recorded moves: direction of the final approach, setpoint and readback (position reached) of every
+    move. Moves in both directions are needed. Medians make the fit robust to single bad readbacks.
+    """
+    directions = numpy.sign(numpy.asarray(directions, dtype=float))
+    errors     = numpy.asarray(readbacks, dtype=float) - numpy.asarray(setpoints, dtype=float)
+
+    if not (numpy.any(directions > 0) and numpy.any(directions < 0)): raise ValueError("The calibration needs moves in both directions")
+
+    error_positive = numpy.median(errors[directions > 0]) # = -backlash/2 + offset
+    error_negative = numpy.median(errors[directions < 0]) # = +backlash/2 + offset
+
+    return BacklashModel(backlash=float(max(error_negative - error_positive, 0.0)), offset=float(0.5 * (error_negative + error_positive)))
+
+class MotorMovePolicy():
+    """
+    Strategy of the moves of a motor. The overshoot (UNIDIRECTIONAL) defaults to twice the backlash of the model.
+    """
+    def __init__(self, strategy=MoveStrategy.UNIDIRECTIONAL, approach_direction=1, backlash_model=None, overshoot=None):
+        if not approach_direction in (1, -1): raise ValueError("The approach direction must be +1 or -1")
+        if overshoot is None and not backlash_model is None: overshoot = 2 * backlash_model.backlash
+        if strategy == MoveStrategy.UNIDIRECTIONAL and not (overshoot is not None and overshoot > 0): raise ValueError("Unidirectional approach needs an overshoot or a backlash model")
+        if strategy == MoveStrategy.COMPENSATED and backlash_model is None: raise ValueError("Compensated moves need a backlash model")
+
+        self.strategy           = strategy
+        self.approach_direction = approach_direction
+        self.backlash_model     = backlash_model
+        self.overshoot          = overshoot
+
+class MovePlanner():
+    """
+    Setpoints of the moves of the motors (keys: PV names), according to their MotorMovePolicy (default: direct moves).
+    The planner keeps the state of the motors (target and direction of the last move): all the moves must be planned.
+    """
+    def __init__(self, policies={}, record_moves=False):
+        self.__policies     = dict(policies)
+        self.__record_moves = record_moves
+        self.__last_moves   = {} # motor: (target, setpoint, direction)
+        self.__records      = {} # motor: list of (direction, setpoint, readback)
+
+    @property
+    def record_moves(self): return self.__record_moves
+
+    def set_policy(self, motor, policy):
+        self.__policies[motor] = policy
+        self.reset(motor)
+
+    def get_policy(self, motor): return self.__policies.get(motor, None)
+
+    def reset(self, motor=None):
+        """Forgets the state of the motor (all the motors if None), e.g. after a failed or an external move."""
+        if motor is None: self.__last_moves.clear()
+        else:             self.__last_moves.pop(motor, None)
+
+    def __is_last_setpoint(self, motor, setpoint):
+        # the setpoint was not changed since the last planned move
+        last_move = self.__last_moves.get(motor, None)
+
+        return not last_move is None and abs(last_move[1] - setpoint) <= 1e-9 * max(1.0, abs(setpoint))
+
+    def get_position(self, motor, setpoint):
+        """Logical position of the motor: the target of the last planned move, if the setpoint was not changed since."""
+        return self.__last_moves[motor][0] if self.__is_last_setpoint(motor, setpoint) else setpoint
+
+    def plan(self, motor, setpoint, target):
+        """Setpoints to put to move the motor from the current setpoint to the target (the state is updated)."""
+        policy   = self.__policies.get(motor, None)
+        distance = target - self.get_position(motor, setpoint)
+
+        if policy is None or policy.strategy == MoveStrategy.DIRECT:
+            direction = numpy.sign(distance)
+            setpoints = [target]
+        elif policy.strategy == MoveStrategy.UNIDIRECTIONAL:
+            direction = policy.approach_direction
+            # the slack is taken up if the last move was in the approach direction, or if this move is long enough
+            slack_taken_up = (self.__is_last_setpoint(motor, setpoint) and self.__last_moves[motor][2] == direction) or direction * distance >= policy.overshoot
+
+            if not slack_taken_up or direction * distance < 0: setpoints = [target - direction * policy.overshoot, target]
+            elif distance == 0:                                setpoints = []
+            else:                                              setpoints = [target]
+        elif policy.strategy == MoveStrategy.COMPENSATED:
+            direction = numpy.sign(distance)
+            setpoints = [] if distance == 0 else [float(policy.backlash_model.get_setpoint(target, direction))]
+        else:
+            raise ValueError("Move strategy not recognized: " + str(policy.strategy))
+
+        if len(setpoints) > 0: self.__last_moves[motor] = (target, setpoints[-1], direction)
+
+        return setpoints
+
+    def record(self, motor, setpoint, readback):
+        """Records the position reached (readback) by the last planned move of the motor, for the calibration."""
+        last_move = self.__last_moves.get(motor, None)
+        if last_move is None or last_move[2] == 0: return
+
+        self.__records.setdefault(motor, []).append((last_move[2], setpoint, readback))
+
+    def get_records(self, motor): return list(self.__records.get(motor, []))
+
+    def calibrate(self, motor):
+        """Calibrates the backlash model of the motor from its records: the model is stored in its policy and returned."""
+        records = self.__records.get(motor, [])
+        if len(records) == 0: raise ValueError("No recorded moves of " + str(motor))
+
+        backlash_model = calibrate_backlash_model(*zip(*records))
+
+        policy = self.__policies.get(motor, None)
+        if policy is None: self.set_policy(motor, MotorMovePolicy(strategy=MoveStrategy.DIRECT, backlash_model=backlash_model))
+        else:
+            policy.backlash_model = backlash_model
+            if policy.overshoot is None or policy.overshoot <= 0: policy.overshoot = 2 * backlash_model.backlash
+
+        return backlash_model
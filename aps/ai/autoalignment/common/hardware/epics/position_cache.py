@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------- #
+# Copyright (c) 2021, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2021. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# ----------------------------------------------------------------------- #
+import time
+import threading
+from contextlib import contextmanager
+
+#############################################################################
+# Position cache:
+#
+# the values of the PVs read by the position getters are kept up to date by
+# the CA monitors (callbacks), so a position is read without a round trip to
+# the IOC. An entry is stale when the PV is (or was) disconnected: after a
+# reconnection the monitor sends the current value again. The monitors of
+# the setpoints fire only when they change, so an idle motor keeps a valid
+# entry indefinitely; max_age (seconds since the last update, None by default)
+# is only an optional extra limit. Stale entries are read again, in bulk
+# (caget_many) when taking a snapshot.
+#
+# Within snapshot(), all the reads return the values frozen at the start of
+# the block: the positions of all the motors are consistent with each other
+# (e.g. a pitch computed from two translations).
+#
+
+class PositionCache():
+    """
+    Monitored values of the position PVs (keys: PV names), with optional staleness limit max_age (seconds, None: no limit).
+    """
+    def __init__(self, max_age=None, bulk_timeout=5.0):
+        self.__max_age      = max_age
+        self.__bulk_timeout = bulk_timeout
+        self.__lock         = threading.RLock()
+        self.__pvs          = {} # PV name: PV
+        self.__entries      = {} # PV name: (value, time of the update)
+        self.__snapshot     = None
+        self.__n_snapshots  = 0
+
+    def register(self, pv):
+        """Subscribes to the monitor of the PV (the first time)."""
+        with self.__lock:
+            if pv.pvname in self.__pvs: return
+            self.__pvs[pv.pvname] = pv
+
+        pv.add_callback(self.__on_update, with_ctrlvars=False)
+        pv.connection_callbacks.append(self.__on_connection)
+
+    def __on_update(self, pvname=None, value=None, **kwargs):
+        with self.__lock: self.__entries[pvname] = (value, time.time())
+
+    def __on_connection(self, pvname=None, conn=True, **kwargs):
+        if not conn: self.invalidate(pvname)
+
+    def __is_fresh(self, pvname, now):
+        entry = self.__entries.get(pvname, None)
+        pv    = self.__pvs.get(pvname, None)
+
+        if entry is None or entry[0] is None or pv is None or not pv.connected: return False
+        else: return self.__max_age is None or now - entry[1] <= self.__max_age
+
+    def invalidate(self, pvname=None):
+        """The next read of the PV (all the PVs if None) goes to the IOC."""
+        with self.__lock:
+            if pvname is None: self.__entries.clear()
+            else:              self.__entries.pop(pvname, None)
+
+    def set(self, pv, value):
+        """Write-through after a put, before the monitor confirms it (also in the active snapshot)."""
+        with self.__lock:
+            self.__entries[pv.pvname] = (value, time.time())
+            if not self.__snapshot is None: self.__snapshot[pv.pvname] = value
+
+    def get(self, pv):
+        """Value of the PV: from the snapshot, if one is active, or from the monitor, if fresh."""
+        self.register(pv)
+
+        with self.__lock:
+            if not self.__snapshot is None and pv.pvname in self.__snapshot: return self.__snapshot[pv.pvname]
+            if self.__is_fresh(pv.pvname, time.time()):                     return self.__entries[pv.pvname][0]
+
+        value = pv.get()
+        if not value is None:
+            with self.__lock:
+                self.__entries[pv.pvname] = (value, time.time())
+                if not self.__snapshot is None: self.__snapshot[pv.pvname] = value
+
+        return value
+
+    def refresh(self):
+        """Reads again all the stale PVs, with one bulk request."""
+        with self.__lock:
+            now   = time.time()
+            stale = [pvname for pvname in self.__pvs if not self.__is_fresh(pvname, now)]
+        if len(stale) == 0: return
+
+        from epics import caget_many
+
+        values = caget_many(stale, timeout=self.__bulk_timeout)
+
+        with self.__lock:
+            now = time.time()
+            for pvname, value in zip(stale, values):
+                if not value is None: self.__entries[pvname] = (value, now)
+
+    def get_snapshot(self):
+        """Consistent copy of the values of all the registered PVs (stale PVs are read again)."""
+        self.refresh()
+        with self.__lock: return {pvname: entry[0] for pvname, entry in self.__entries.items() if pvname in self.__pvs and not entry[0] is None}
+
+    @contextmanager
+    def snapshot(self):
+        """Context: the reads return the values frozen at the start (nested blocks share the outermost snapshot)."""
+        if self.__n_snapshots == 0: self.__snapshot = self.get_snapshot()
+        self.__n_snapshots += 1
+        try:
+            yield self
+        finally:
+            self.__n_snapshots -= 1
+            if self.__n_snapshots == 0: self.__snapshot = None
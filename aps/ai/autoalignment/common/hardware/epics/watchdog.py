@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------- #
+# Copyright (c) 2021, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2021. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# ----------------------------------------------------------------------- #
+import time
+import threading
+
+#############################################################################
+# Watchdog of the hardware operations:
+#
+# every operation that waits for the hardware (motor moves, bender feedback,
+# image acquisition) runs within the timing budget of its type:
+#
+# timeout       : maximum duration of an attempt.
+# stall_timeout : maximum time without progress, i.e. without a decrease of
+#                 the distance of the readback from the target larger than
+#                 min_progress (stall detection, e.g. a stuck motor).
+# n_retries     : attempts after the first one, retry_delay seconds apart:
+#                 before a retry, the recovery of the operation is executed
+#                 (e.g. stop the motor, reset the camera).
+#
+# When the retries are exhausted a HardwareAbortException is raised: the
+# optimizer marks the trial as failed and the script returns the motors to
+# safe positions. Blocking calls without timeout (e.g. the image collector)
+# run in a daemon thread: after a timeout the thread is abandoned.
+#
+
+HARDWARE_FAILURE_ATTR = "hardware_failure" # user attribute of the failed Optuna trials
+
+class OperationType:
+    MOTOR_MOVE        = "motor_move"
+    BENDER_MOVE       = "bender_move"
+    IMAGE_ACQUISITION = "image_acquisition"
+
+class WatchdogException(Exception):
+    def __init__(self, message="hardware operation failed"):
+        super().__init__(message)
+
+class OperationTimeoutException(WatchdogException):
+    def __init__(self, name="operation", timeout=0.0):
+        super().__init__(str(name) + f" not completed in {timeout:.1f} s")
+
+class StallException(WatchdogException):
+    def __init__(self, name="operation", stall_timeout=0.0):
+        super().__init__(str(name) + f" stalled: no progress of the readback in {stall_timeout:.1f} s")
+
+class HardwareAbortException(Exception):
+    def __init__(self, name="operation", n_attempts=1, cause=None):
+        super().__init__(str(name) + " failed after " + str(n_attempts) + " attempt(s)" + ("" if cause is None else ": " + str(cause)))
+        self.name       = name
+        self.n_attempts = n_attempts
+        self.cause      = cause
+
+class OperationBudget():
+    """
+    Timing budget (seconds) and retry policy of a type of hardware operation. None: no timeout/stall detection.
+    """
+    def __init__(self, timeout=None, stall_timeout=None, min_progress=0.0, n_retries=0, retry_delay=1.0):
+        self.timeout       = timeout
+        self.stall_timeout = stall_timeout
+        self.min_progress  = min_progress
+        self.n_retries     = n_retries
+        self.retry_delay   = retry_delay
+
+def get_default_budgets():
+    return {OperationType.MOTOR_MOVE:        OperationBudget(timeout=300.0, stall_timeout=30.0, n_retries=1, retry_delay=1.0),
+            OperationType.BENDER_MOVE:       OperationBudget(timeout=600.0, stall_timeout=120.0, n_retries=1, retry_delay=5.0),
+            OperationType.IMAGE_ACQUISITION: OperationBudget(timeout=120.0, n_retries=2, retry_delay=5.0)}
+
+class Watchdog():
+    """
+    Timing budgets (keys: OperationType) of the hardware operations, stall detection and retries.
+    """
+    def __init__(self, budgets={}, poll_interval=0.1, verbose=True):
+        self.__budgets       = get_default_budgets()
+        self.__budgets.update(budgets)
+        self.__poll_interval = poll_interval
+        self.__verbose       = verbose
+
+    def get_budget(self, operation): return self.__budgets.get(operation, OperationBudget())
+    def set_budget(self, operation, budget): self.__budgets[operation] = budget
+
+    def wait_for(self, name, operation, is_done, distance=None):
+        """
+        Polls is_done() until True, within the budget of the operation. distance(): distance of the readback from the
+        target, for the stall detection. A failed readback (exception or None, e.g. CA disconnection) is a WatchdogException.
+        """
+        budget        = self.get_budget(operation)
+        start_time    = time.time()
+        progress_time = start_time # time of the last progress
+        best_distance = None if distance is None else self.__read(name, distance)
+
+        while not self.__read(name, is_done):
+            now = time.time()
+            if not budget.timeout is None and now - start_time > budget.timeout: raise OperationTimeoutException(name, budget.timeout)
+            if not (budget.stall_timeout is None or distance is None):
+                current_distance = self.__read(name, distance)
+                if best_distance - current_distance > budget.min_progress: progress_time, best_distance = now, current_distance
+                elif now - progress_time > budget.stall_timeout:            raise StallException(name, budget.stall_timeout)
+
+            time.sleep(self.__poll_interval)
+
+    @staticmethod
+    def __read(name, function):
+        # readback failures go through recovery and retries, like timeouts and stalls
+        try:                   value = function()
+        except Exception as e: raise WatchdogException(str(name) + ": readback failed (" + type(e).__name__ + ": " + str(e) + ")")
+        if value is None:      raise WatchdogException(str(name) + ": no readback (disconnected)")
+
+        return value
+
+    def run(self, name, operation, function, recovery=None, threaded=False):
+        """
+        Runs function() with the retry policy of the operation: a WatchdogException of an attempt triggers recovery()
+        and a new attempt, a HardwareAbortException is raised when the attempts are exhausted. threaded: every attempt
+        runs in a daemon thread, within the timeout of the operation (for blocking calls).
+        """
+        budget = self.get_budget(operation)
+
+        for attempt in range(budget.n_retries + 1):
+            try:
+                if threaded: return self.__call_with_timeout(name, budget.timeout, function)
+                else:        return function()
+            except WatchdogException as e:
+                cause = e
+                if self.__verbose: print("Watchdog: " + str(e) + (f", retrying ({attempt + 1}/{budget.n_retries})" if attempt < budget.n_retries else ""))
+
+                if not recovery is None:
+                    try:    recovery()
+                    except Exception as recovery_exception:
+                        if self.__verbose: print("Watchdog: recovery of " + str(name) + " failed: " + str(recovery_exception))
+                if attempt < budget.n_retries: time.sleep(budget.retry_delay)
+
+        raise HardwareAbortException(name, budget.n_retries + 1, cause)
+
+    @staticmethod
+    def __call_with_timeout(name, timeout, function):
+        result = {}
+
+        def target():
+            try:
+                from epics import ca
+                ca.use_initial_context() # CA context of the main thread
+            except: pass
+            try:                   result["value"] = function()
+            except Exception as e: result["exception"] = e
+
+        thread = threading.Thread(target=target, name="watchdog: " + str(name), daemon=True)
+        thread.start()
+        thread.join(timeout)
+
+        if thread.is_alive():     raise OperationTimeoutException(name, timeout)
+        if "exception" in result: raise result["exception"]
+
+        return result.get("value", None)
@@ -51,6 +51,7 @@ from aps.ai.autoalignment.common.facade.focusing_optics_interface import Abstrac
 class AbstractSimulatedFocusingOptics(AbstractFocusingOptics):
     def perturbate_input_photon_beam(self, shift_h=None, shift_v=None, rotation_h=None, rotation_v=None): raise  NotImplementedError()
     def restore_input_photon_beam(self): raise NotImplementedError()
+    def get_photon_beam_caustic(self, distances, **kwargs): raise NotImplementedError()
 
 
 
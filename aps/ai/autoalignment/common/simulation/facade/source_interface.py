@@ -77,6 +77,7 @@ class AbstractSource():
     def set_angular_acceptance_from_aperture(self, aperture=[0.03, 0.07], distance=50500): raise NotImplementedError()
     def set_energy(self, energy=[4999.0, 5001.0], **kwargs): raise NotImplementedError()
     def get_source_beam(self, **kwargs): raise NotImplementedError()
+    def reset_common_random_numbers(self): raise NotImplementedError()
 
 
 
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------- #
+# Copyright (c) 2021, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2021. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# ----------------------------------------------------------------------- #
+import os
+import shutil
+import tempfile
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+import Shadow
+
+from orangecontrib.shadow.util.shadow_objects import ShadowBeam, ShadowOpticalElement, ShadowOEHistoryItem
+
+#############################################################################
+# Intra-trace parallelism:
+#
+# SHADOW rays are independent through non-diffractive elements, so the input
+# rays can be split in chunks traced by different processes. The first chunk
+# is traced in the calling process with the full history, the others in the
+# workers, each one running in its own directory because SHADOW writes its
+# files in the current directory. The output beams are then merged in the
+# original order, and the history item of the OE is rebuilt with the whole
+# input beam (HYBRID reads it). HYBRID must always run on the merged beam.
+#
+
+MINIMUM_RAYS_PER_CHUNK = 10000
+
+__worker_directory = None
+
+def _initialize_worker(root_directory, verbose):
+    global __worker_directory
+    __worker_directory = tempfile.mkdtemp(prefix="worker_", dir=root_directory)
+    os.chdir(__worker_directory)
+
+    if not verbose: # Fortran output of the workers
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 1)
+
+def _trace_chunk(rays, oe_parameters, widget_class_name):
+    shadow_oe = Shadow.OE()
+    for name, value in oe_parameters.items(): setattr(shadow_oe, name, value)
+
+    input_beam = ShadowBeam(beam=Shadow.Beam())
+    input_beam._beam.rays = rays
+
+    return ShadowBeam.traceFromOE(input_beam,
+                                  ShadowOpticalElement(shadow_oe),
+                                  widget_class_name=widget_class_name,
+                                  history=False,
+                                  recursive_history=False)._beam.rays
+
+def _get_oe_parameters(shadow_oe):
+    """Parameters of the OE, with the file names made absolute (the workers run in their own directories)."""
+    oe_parameters = shadow_oe._oe.to_dictionary()
+
+    for name, value in oe_parameters.items():
+        if name.startswith("FILE_") and isinstance(value, bytes):
+            file_name = value.decode("utf-8").strip()
+            if file_name != "" and not os.path.isabs(file_name) and os.path.exists(file_name):
+                oe_parameters[name] = os.path.abspath(file_name).encode()
+
+    return oe_parameters
+
+class ChunkedTracer():
+    def __init__(self, n_processes, verbose=False):
+        if n_processes < 2: raise ValueError("Chunked tracing needs at least 2 processes")
+
+        self.__n_processes    = n_processes
+        self.__root_directory = tempfile.mkdtemp(prefix="shadow_chunked_tracing_")
+        self.__executor       = ProcessPoolExecutor(max_workers=n_processes - 1, # the calling process traces a chunk too
+                                                    initializer=_initialize_worker,
+                                                    initargs=(self.__root_directory, verbose))
+        self.__finalizer      = weakref.finalize(self, ChunkedTracer.__shutdown, self.__executor, self.__root_directory)
+
+    @property
+    def n_processes(self): return self.__n_processes
+
+    def trace_oe(self, input_beam, shadow_oe, widget_class_name, history=True):
+        rays     = input_beam._beam.rays
+        n_chunks = min(self.__n_processes, rays.shape[0] // MINIMUM_RAYS_PER_CHUNK)
+
+        if n_chunks < 2: return ShadowBeam.traceFromOE(input_beam, shadow_oe.duplicate(), widget_class_name=widget_class_name, history=history, recursive_history=False)
+
+        chunks        = numpy.array_split(numpy.arange(rays.shape[0]), n_chunks)
+        oe_parameters = _get_oe_parameters(shadow_oe)
+        futures       = [self.__executor.submit(_trace_chunk, rays[chunk], oe_parameters, widget_class_name) for chunk in chunks[1:]]
+
+        first_input_beam = input_beam.duplicate(history=history)
+        first_input_beam._beam.rays = rays[chunks[0]]
+
+        output_beam = ShadowBeam.traceFromOE(first_input_beam, shadow_oe.duplicate(), widget_class_name=widget_class_name, history=history, recursive_history=False)
+
+        output_history = output_beam.history
+
+        for future in futures:
+            chunk_beam = output_beam.duplicate(history=False)
+            chunk_beam._beam.rays = future.result()
+
+            output_beam = ShadowBeam.mergeBeams(output_beam, chunk_beam, which_flux=3, merge_history=0)
+
+        output_beam.history = output_history # the merged beam is the output of the same OE
+
+        if history: # the history item of the first chunk has only its input rays
+            history_item = output_beam.getOEHistory(output_beam._oe_number)
+            output_beam.history[output_beam._oe_number] = ShadowOEHistoryItem(oe_number=output_beam._oe_number,
+                                                                               input_beam=input_beam.duplicate(),
+                                                                               shadow_oe_start=history_item._shadow_oe_start,
+                                                                               shadow_oe_end=history_item._shadow_oe_end,
+                                                                               widget_class_name=history_item._widget_class_name)
+
+        return output_beam
+
+    def close(self):
+        self.__finalizer()
+
+    @staticmethod
+    def __shutdown(executor, root_directory):
+        executor.shutdown(wait=True, cancel_futures=True)
+        shutil.rmtree(root_directory, ignore_errors=True)
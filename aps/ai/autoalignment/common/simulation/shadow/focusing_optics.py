@@ -47,27 +47,60 @@
 import numpy
 from orangecontrib.shadow.util.shadow_util import ShadowMath, ShadowCongruence
 from orangecontrib.shadow.util.shadow_objects import ShadowBeam
+from orangecontrib.shadow.widgets.special_elements.bl import hybrid_control
 
 from aps.common.ml.data_structures import DictionaryWrapper
 
 from aps.ai.autoalignment.common.facade.parameters import Movement, AngularUnits, DistanceUnits
-from aps.ai.autoalignment.common.util.shadow.common import EmptyBeamException
+from aps.ai.autoalignment.common.util.shadow.common import EmptyBeamException, get_hybrid_input_parameters
+from aps.ai.autoalignment.common.util.shadow.compact_beam import compact_beam_caustic
+from aps.ai.autoalignment.common.util.shadow.shared_beam import is_shared_beam
 from aps.ai.autoalignment.common.simulation.facade.focusing_optics_interface import AbstractSimulatedFocusingOptics
+from aps.ai.autoalignment.common.simulation.shadow.chunked_tracing import ChunkedTracer
+from aps.ai.autoalignment.common.simulation.shadow.hybrid_execution import HybridExecutor
 
 class AbstractShadowFocusingOptics(AbstractSimulatedFocusingOptics):
     def __init__(self):
         self._input_beam = None
         self.__initial_input_beam = None
         self._modified_elements = None
+        self._chunked_tracer = None
+        self._hybrid_executor = None
+        self._geometric_only = False
 
     def initialize(self, **kwargs):
         input_photon_beam = kwargs["input_photon_beam"]
 
-        self._input_beam          = input_photon_beam.duplicate()
-        self.__initial_input_beam = input_photon_beam.duplicate()
+        if is_shared_beam(input_photon_beam): # read-only rays in shared memory: copied only when perturbed
+            self._input_beam          = input_photon_beam
+            self.__initial_input_beam = input_photon_beam
+        else:
+            self._input_beam          = input_photon_beam.duplicate()
+            self.__initial_input_beam = input_photon_beam.duplicate()
+
+        # intra-trace parallelism: the non-diffractive elements are traced in chunks of rays on n_tracing_processes
+        try:    n_tracing_processes = kwargs["n_tracing_processes"]
+        except: n_tracing_processes = 1
+
+        if not self._chunked_tracer is None: self._chunked_tracer.close()
+
+        if n_tracing_processes > 1: self._chunked_tracer = ChunkedTracer(n_tracing_processes, verbose=kwargs.get("verbose", False))
+        else:                       self._chunked_tracer = None
+
+        # HYBRID: cache of the outputs for unchanged upstream geometry, independent calculations on n_hybrid_processes
+        try:    hybrid_cache_size = kwargs["hybrid_cache_size"]
+        except: hybrid_cache_size = 0
+        try:    n_hybrid_processes = kwargs["n_hybrid_processes"]
+        except: n_hybrid_processes = 1
+
+        if not self._hybrid_executor is None: self._hybrid_executor.close()
+
+        if hybrid_cache_size > 0 or n_hybrid_processes > 1: self._hybrid_executor = HybridExecutor(n_hybrid_processes, hybrid_cache_size, verbose=kwargs.get("verbose", False))
+        else:                                               self._hybrid_executor = None
 
     def perturbate_input_photon_beam(self, shift_h=None, shift_v=None, rotation_h=None, rotation_v=None):
         if self._input_beam is None: raise ValueError("Focusing Optical System is not initialized")
+        if is_shared_beam(self._input_beam): self._input_beam = self._input_beam.duplicate()
 
         good_only = numpy.where(self._input_beam._beam.rays[:, 9] == 1)
 
@@ -88,7 +121,14 @@ class AbstractShadowFocusingOptics(AbstractSimulatedFocusingOptics):
 
     def restore_input_photon_beam(self):
         if self._input_beam is None: raise ValueError("Focusing Optical System is not initialized")
-        self._input_beam = self.__initial_input_beam.duplicate()
+        if is_shared_beam(self.__initial_input_beam): self._input_beam = self.__initial_input_beam
+        else:                                         self._input_beam = self.__initial_input_beam.duplicate()
+
+    def get_photon_beam_caustic(self, distances, **kwargs):
+        """
+        Beams (CompactBeam) at the planes at the given distances from the image plane, from a single trace.
+        """
+        return compact_beam_caustic(self.get_photon_beam(**kwargs), distances)
 
     # PROTECTED GENERIC MOTOR METHODS
     @classmethod
@@ -164,20 +204,36 @@ class AbstractShadowFocusingOptics(AbstractSimulatedFocusingOptics):
         if element is None: raise ValueError("Initialize Focusing Optics System first")
         return element._oe.SIMAG
 
-    @classmethod
-    def _trace_oe(cls, input_beam, shadow_oe, widget_class_name, oe_name, remove_lost_rays, history=True):
-        return cls._check_beam(ShadowBeam.traceFromOE(input_beam,
-                                                      shadow_oe.duplicate(),
-                                                      widget_class_name=widget_class_name,
-                                                      history=history,
-                                                      recursive_history=False),
-                               oe_name, remove_lost_rays)
+    def _trace_oe(self, input_beam, shadow_oe, widget_class_name, oe_name, remove_lost_rays, history=True):
+        if self._chunked_tracer is None:
+            output_beam = ShadowBeam.traceFromOE(input_beam,
+                                                 shadow_oe.duplicate(),
+                                                 widget_class_name=widget_class_name,
+                                                 history=history,
+                                                 recursive_history=False)
+        else:
+            output_beam = self._chunked_tracer.trace_oe(input_beam, shadow_oe, widget_class_name=widget_class_name, history=history)
+
+        return self._check_beam(output_beam, oe_name, remove_lost_rays)
+
+    def _run_hybrid(self, output_beam, beam_type="ff_beam", **hybrid_parameters):
+        return self._run_hybrid_concurrently([(output_beam, beam_type, hybrid_parameters)])[0]
+
+    def _run_hybrid_concurrently(self, calculations):
+        if self._geometric_only: return [output_beam for output_beam, _, _ in calculations] # no diffraction: e.g. pilot traces
+        elif self._hybrid_executor is None:
+            return [getattr(hybrid_control.hy_run(get_hybrid_input_parameters(output_beam, **hybrid_parameters)), beam_type)
+                    for output_beam, beam_type, hybrid_parameters in calculations]
+        else:
+            return self._hybrid_executor.run_concurrently(calculations)
 
     @classmethod
     def _check_beam(cls, output_beam, oe, remove_lost_rays):
         if ShadowCongruence.checkEmptyBeam(output_beam):
             if ShadowCongruence.checkGoodBeam(output_beam):
-                if remove_lost_rays:
+                if remove_lost_rays and is_shared_beam(output_beam): # shared beams are usually published without lost rays
+                    if not numpy.all(output_beam._beam.rays[:, 9] == 1): output_beam = output_beam.duplicate()
+                if remove_lost_rays and not is_shared_beam(output_beam):
                     output_beam._beam.rays = output_beam._beam.rays[numpy.where(output_beam._beam.rays[:, 9] == 1)]
                     output_beam._beam.rays[:, 11] = numpy.arange(1, output_beam._beam.rays.shape[0] + 1, 1)
                 return output_beam
@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------- #
+# Copyright (c) 2021, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2021. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+import hashlib
+import os
+import shutil
+import tempfile
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+import Shadow
+
+from orangecontrib.shadow.util.shadow_objects import ShadowBeam, ShadowOpticalElement, ShadowOEHistoryItem
+from orangecontrib.shadow.widgets.special_elements.bl import hybrid_control
+
+from aps.ai.autoalignment.common.util.shadow.common import get_hybrid_input_parameters
+from aps.ai.autoalignment.common.simulation.shadow.chunked_tracing import _initialize_worker, _get_oe_parameters
+
+DEFAULT_HYBRID_CACHE_SIZE = 8
+
+#############################################################################
+# HYBRID execution layer:
+#
+# 1) cache of the HYBRID outputs: the key is a digest of everything HYBRID
+#    reads (rays at the element and at its input, parameters and error
+#    profile files of the element, HYBRID parameters). Elements whose
+#    upstream geometry did not change (e.g. fixed coherence slits) are not
+#    recalculated. With random_seed=None the cached diffraction sample is
+#    re-used as it is.
+# 2) concurrent execution of independent HYBRID calculations (e.g. the two
+#    sides of a bendable mirror), in separate processes: HYBRID needs the
+#    history of the beam, which is rebuilt in the worker from the rays and
+#    the parameters of the element.
+#
+
+class HybridCache():
+    def __init__(self, max_size=DEFAULT_HYBRID_CACHE_SIZE):
+        self.__max_size = max_size
+        self.__beams    = OrderedDict()
+        self.__hits     = 0
+        self.__misses   = 0
+
+    def get(self, key):
+        if key in self.__beams:
+            self.__beams.move_to_end(key)
+            self.__hits += 1
+            return self.__beams[key].duplicate() # callers modify the rays of the output beam
+        else:
+            self.__misses += 1
+            return None
+
+    def put(self, key, shadow_beam):
+        if self.__max_size <= 0: return
+
+        self.__beams[key] = shadow_beam.duplicate()
+        self.__beams.move_to_end(key)
+        while len(self.__beams) > self.__max_size: self.__beams.popitem(last=False)
+
+    def clear(self):
+        self.__beams.clear()
+
+    @property
+    def hits(self): return self.__hits
+    @property
+    def misses(self): return self.__misses
+
+    def __len__(self): return len(self.__beams)
+
+def _get_file_state(oe_parameters):
+    file_state = []
+    for name, value in sorted(oe_parameters.items()):
+        if name.startswith("FILE_") and isinstance(value, bytes):
+            file_name = value.decode("utf-8").strip()
+            if file_name != "" and os.path.exists(file_name):
+                stat = os.stat(file_name)
+                file_state.append((name, stat.st_mtime_ns, stat.st_size))
+    return file_state
+
+def get_hybrid_cache_key(shadow_beam, beam_type, hybrid_parameters):
+    history_item = shadow_beam.getOEHistory(shadow_beam._oe_number)
+    digest       = hashlib.blake2b(digest_size=20)
+
+    digest.update(numpy.ascontiguousarray(shadow_beam._beam.rays).data)
+    if not history_item._input_beam is None: digest.update(numpy.ascontiguousarray(history_item._input_beam._beam.rays).data)
+
+    for shadow_oe in [history_item._shadow_oe_start, history_item._shadow_oe_end]:
+        if not shadow_oe is None:
+            oe_parameters = _get_oe_parameters(shadow_oe)
+            digest.update(repr(sorted(oe_parameters.items())).encode())
+            digest.update(repr(_get_file_state(oe_parameters)).encode())
+
+    return digest.hexdigest(), beam_type, tuple(sorted(hybrid_parameters.items()))
+
+#############################################################################
+# Worker side
+#
+
+def _get_beam_state(shadow_beam):
+    history_item = shadow_beam.getOEHistory(shadow_beam._oe_number)
+
+    return {"oe_number"         : shadow_beam._oe_number,
+            "rays"              : shadow_beam._beam.rays,
+            "input_rays"        : None if history_item._input_beam is None else history_item._input_beam._beam.rays,
+            "oe_start"          : _get_oe_parameters(history_item._shadow_oe_start),
+            "oe_end"            : _get_oe_parameters(history_item._shadow_oe_end),
+            "widget_class_name" : history_item._widget_class_name}
+
+def _rebuild_beam(beam_state):
+    def rebuild_oe(oe_parameters):
+        shadow_oe = Shadow.OE()
+        for name, value in oe_parameters.items(): setattr(shadow_oe, name, value)
+        return ShadowOpticalElement(shadow_oe)
+
+    oe_number = beam_state["oe_number"]
+
+    if beam_state["input_rays"] is None: input_beam = None
+    else:
+        input_beam = ShadowBeam(oe_number=oe_number - 1, beam=Shadow.Beam())
+        input_beam._beam.rays = beam_state["input_rays"]
+
+    shadow_beam = ShadowBeam(oe_number=oe_number, beam=Shadow.Beam())
+    shadow_beam._beam.rays = beam_state["rays"]
+    shadow_beam.history = [None]*oe_number + [ShadowOEHistoryItem(oe_number=oe_number,
+                                                                  input_beam=input_beam,
+                                                                  shadow_oe_start=rebuild_oe(beam_state["oe_start"]),
+                                                                  shadow_oe_end=rebuild_oe(beam_state["oe_end"]),
+                                                                  widget_class_name=beam_state["widget_class_name"])]
+    return shadow_beam
+
+def _run_hybrid_in_worker(beam_state, beam_type, hybrid_parameters):
+    output_beam = getattr(hybrid_control.hy_run(get_hybrid_input_parameters(_rebuild_beam(beam_state), verbose=False, **hybrid_parameters)), beam_type)
+
+    return output_beam._beam.rays
+
+#############################################################################
+
+class HybridExecutor():
+    """
+    Runs HYBRID through the cache and, with n_processes > 1, runs independent calculations concurrently.
+    hybrid_parameters are the arguments of get_hybrid_input_parameters (verbose is ignored: the
+    output of the calling process follows the executor setting, the workers are silent), beam_type
+    is "ff_beam" or "nf_beam".
+    """
+    def __init__(self, n_processes=1, cache_size=0, verbose=False):
+        self.__verbose = verbose
+        self.__cache   = HybridCache(cache_size) if cache_size > 0 else None
+
+        if n_processes > 1:
+            self.__root_directory = tempfile.mkdtemp(prefix="hybrid_execution_")
+            self.__executor       = ProcessPoolExecutor(max_workers=n_processes - 1, # the calling process runs a calculation too
+                                                        initializer=_initialize_worker,
+                                                        initargs=(self.__root_directory, verbose))
+            self.__finalizer      = weakref.finalize(self, HybridExecutor.__shutdown, self.__executor, self.__root_directory)
+        else:
+            self.__executor  = None
+            self.__finalizer = None
+
+    @property
+    def cache(self): return self.__cache
+
+    def run(self, shadow_beam, beam_type="ff_beam", **hybrid_parameters):
+        return self.run_concurrently([(shadow_beam, beam_type, hybrid_parameters)])[0]
+
+    def run_concurrently(self, calculations):
+        """
+        calculations: list of (shadow_beam, beam_type, hybrid_parameters), output beams returned in the same order.
+        """
+        output_beams = [None]*len(calculations)
+        cache_keys   = [None]*len(calculations)
+        to_calculate = []
+
+        calculations = [(shadow_beam, beam_type, {name : value for name, value in hybrid_parameters.items() if name != "verbose"})
+                        for shadow_beam, beam_type, hybrid_parameters in calculations]
+
+        for index, (shadow_beam, beam_type, hybrid_parameters) in enumerate(calculations):
+            if not self.__cache is None:
+                cache_keys[index]   = get_hybrid_cache_key(shadow_beam, beam_type, hybrid_parameters)
+                output_beams[index] = self.__cache.get(cache_keys[index])
+            if output_beams[index] is None: to_calculate.append(index)
+
+        if len(to_calculate) > 0:
+            if self.__executor is None: remote_indexes = []
+            else:                       remote_indexes = to_calculate[1:]
+
+            futures = {index : self.__executor.submit(_run_hybrid_in_worker,
+                                                      _get_beam_state(calculations[index][0]),
+                                                      calculations[index][1],
+                                                      calculations[index][2]) for index in remote_indexes}
+
+            for index in to_calculate:
+                if index in futures: continue
+                shadow_beam, beam_type, hybrid_parameters = calculations[index]
+                output_beams[index] = getattr(hybrid_control.hy_run(get_hybrid_input_parameters(shadow_beam, verbose=self.__verbose, **hybrid_parameters)), beam_type)
+
+            for index, future in futures.items():
+                output_beams[index] = calculations[index][0].duplicate(history=True)
+                output_beams[index]._beam.rays = future.result()
+
+            if not self.__cache is None:
+                for index in to_calculate: self.__cache.put(cache_keys[index], output_beams[index])
+
+        return output_beams
+
+    def close(self):
+        if not self.__finalizer is None: self.__finalizer()
+
+    @staticmethod
+    def __shutdown(executor, root_directory):
+        executor.shutdown(wait=True, cancel_futures=True)
+        shutil.rmtree(root_directory, ignore_errors=True)
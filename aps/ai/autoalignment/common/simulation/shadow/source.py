@@ -55,6 +55,37 @@ from aps.common.ml.mocks import MockWidget
 from aps.ai.autoalignment.common.util.shadow.common import fix_Intensity, m2ev, TTYInibitor
 from aps.ai.autoalignment.common.simulation.facade.source_interface import AbstractSource, Sources, StorageRing, ElectronBeamAPS_U, ElectronBeamAPS
 
+#############################################################################
+# COMMON RANDOM NUMBERS
+#
+# with common_random_numbers=True the source rays are generated only once (with the
+# seed given at initialization) and every call of get_source_beam returns a copy of
+# the same rays: trials differ only by the motors and by the explicit perturbations
+# (kwargs source_displacement [x, z] and source_angular_displacement [x', z'], in the
+# units of the beam and rad), so that Monte-Carlo noise does not hide the small differences
+# between neighbouring trials. The rays are regenerated after any change of the
+# source parameters or after reset_common_random_numbers(). The hybrid undulator
+# source keeps the beams generated with and without the aperture (ignore_aperture)
+# separately.
+#
+
+def _displace_source_beam(source_beam, **kwargs):
+    try: displacement = kwargs["source_displacement"]
+    except: displacement = None
+    try: angular_displacement = kwargs["source_angular_displacement"]
+    except: angular_displacement = None
+
+    if not displacement is None:
+        source_beam._beam.rays[:, 0] += displacement[0]
+        source_beam._beam.rays[:, 2] += displacement[1]
+    if not angular_displacement is None:
+        rays = source_beam._beam.rays
+        rays[:, 3] += angular_displacement[0] * rays[:, 4]  # small angles: x' = vx/vy, z' = vz/vy
+        rays[:, 5] += angular_displacement[1] * rays[:, 4]
+        rays[:, 3:6] /= numpy.linalg.norm(rays[:, 3:6], axis=1)[:, numpy.newaxis]
+
+    return source_beam
+
 def shadow_source_factory_method(kind_of_source=Sources.GAUSSIAN):
     if kind_of_source == Sources.GAUSSIAN:    return __ShadowGaussianUndulatorSource()
     elif kind_of_source == Sources.UNDULATOR: return __ShadowHybridUndulatorSource()
@@ -69,6 +100,8 @@ class __ShadowGaussianUndulatorSource(AbstractSource):
 
     def __init__(self):
         self.__shadow_source = None
+        self.__common_random_numbers = False
+        self.__common_random_numbers_beam = None
 
     def initialize(self, storage_ring=StorageRing.APS, **kwargs):
         try: n_rays = kwargs["n_rays"]
@@ -77,6 +110,8 @@ class __ShadowGaussianUndulatorSource(AbstractSource):
         except: random_seed = 5676561
         try: undulator_length = kwargs["undulator_length"]
         except: undulator_length = 2.376
+        try: common_random_numbers = kwargs["common_random_numbers"]
+        except: common_random_numbers = False
 
         #####################################################
         # SHADOW 3 INITIALIZATION
@@ -90,10 +125,17 @@ class __ShadowGaussianUndulatorSource(AbstractSource):
         self.__undulator_length = undulator_length
         self.__storage_ring = storage_ring
 
+        self.__common_random_numbers      = common_random_numbers
+        self.__common_random_numbers_beam = None
+
         self.set_angular_acceptance_from_aperture() # defaults
         self.set_energy() # defaults
 
+    def reset_common_random_numbers(self):
+        self.__common_random_numbers_beam = None
+
     def set_angular_acceptance(self, divergence=[1e-4, 1e-4]):
+        self.__common_random_numbers_beam = None
         self.__shadow_source.src.FDISTR = 3 # gaussian
 
         self.__shadow_source.src.HDIV1 = divergence[0]/2
@@ -105,6 +147,8 @@ class __ShadowGaussianUndulatorSource(AbstractSource):
         self.set_angular_acceptance(divergence=[aperture[0] / distance, aperture[1] / distance])
 
     def set_energy(self, energy=[4999.0, 5001.0], **kwargs):
+        self.__common_random_numbers_beam = None
+
         try: self.__shadow_source.src.F_COLOR = kwargs["photon_energy_distribution"]
         except: self.__shadow_source.src.F_COLOR = 3
 
@@ -114,8 +158,16 @@ class __ShadowGaussianUndulatorSource(AbstractSource):
         self.__set_photon_sizes()
 
     def get_source_beam(self, **kwargs):
+        if self.__common_random_numbers and not self.__common_random_numbers_beam is None:
+            return _displace_source_beam(self.__common_random_numbers_beam.duplicate(), **kwargs)
+
         try:    verbose = kwargs["verbose"]
         except: verbose = False
+        try:    random_seed = kwargs["random_seed"] # fresh rays for this beam only, ignored with common random numbers
+        except: random_seed = None
+
+        user_seed = self.__shadow_source.src.ISTAR1
+        if not (random_seed is None or self.__common_random_numbers): self.__shadow_source.src.ISTAR1 = random_seed
 
         if not verbose:
             fortran_suppressor = TTYInibitor()
@@ -135,8 +187,14 @@ class __ShadowGaussianUndulatorSource(AbstractSource):
             if not verbose:
                 try: fortran_suppressor.stop()
                 except: pass
+        finally:
+            self.__shadow_source.src.ISTAR1 = user_seed # restore user seed
 
-        return output_beam
+        if self.__common_random_numbers:
+            self.__common_random_numbers_beam = output_beam
+            output_beam = output_beam.duplicate()
+
+        return _displace_source_beam(output_beam, **kwargs)
 
 
     def __set_photon_sizes(self):
@@ -187,6 +245,8 @@ class __ShadowHybridUndulatorSource(AbstractSource):
         self.__widget = None
         self.__aperture = None
         self.__distance = None
+        self.__common_random_numbers = False
+        self.__common_random_numbers_beams = {}
 
     def initialize(self, storage_ring=StorageRing.APS, **kwargs):
         try: n_rays = kwargs["n_rays"]
@@ -195,11 +255,19 @@ class __ShadowHybridUndulatorSource(AbstractSource):
         except: random_seed = 5676561
         try: verbose = kwargs["verbose"]
         except: verbose = False
+        try: common_random_numbers = kwargs["common_random_numbers"]
+        except: common_random_numbers = False
 
         self.__widget = self.__MockUndulatorHybrid(storage_ring=storage_ring, verbose=verbose)
         self.__widget.number_of_rays = n_rays
         self.__widget.seed = random_seed
 
+        self.__common_random_numbers      = common_random_numbers
+        self.__common_random_numbers_beams = {}
+
+    def reset_common_random_numbers(self):
+        self.__common_random_numbers_beams = {}
+
     def set_wavefront_parameters(self,
                                  source_dimension_wf_h_slit_gap,
                                  source_dimension_wf_v_slit_gap,
@@ -210,6 +278,8 @@ class __ShadowHybridUndulatorSource(AbstractSource):
                                  horizontal_resolution_modification_factor_at_resizing=5.0,
                                  vertical_range_modification_factor_at_resizing=0.5,
                                  vertical_resolution_modification_factor_at_resizing=5.0):
+        self.__common_random_numbers_beams = {}
+
         self.__widget.source_dimension_wf_h_slit_gap    = source_dimension_wf_h_slit_gap
         self.__widget.source_dimension_wf_v_slit_gap    = source_dimension_wf_v_slit_gap
         self.__widget.source_dimension_wf_h_slit_points = source_dimension_wf_h_slit_points
@@ -228,6 +298,8 @@ class __ShadowHybridUndulatorSource(AbstractSource):
                                  vertical_central_position = 0.0,
                                  longitudinal_central_position = 0.0,
                                  waist_position_user_defined = 0.0):
+        self.__common_random_numbers_beams = {}
+
         self.__widget.number_of_periods = number_of_periods
         self.__widget.undulator_period = undulator_period
         self.__widget.horizontal_central_position = horizontal_central_position
@@ -240,6 +312,8 @@ class __ShadowHybridUndulatorSource(AbstractSource):
             self.__widget.waist_position_calculation = 0
 
     def set_angular_acceptance(self, divergence=[1e-4, 1e-4]):
+        self.__common_random_numbers_beams = {}
+
         if divergence is None:
             self.__aperture = None
             self.__distance = None
@@ -248,10 +322,14 @@ class __ShadowHybridUndulatorSource(AbstractSource):
             self.__aperture = [self.__distance*numpy.tan(divergence[0]), self.__distance*numpy.tan(divergence[0])]
 
     def set_angular_acceptance_from_aperture(self, aperture=[0.03, 0.07], distance=50500):
+        self.__common_random_numbers_beams = {}
+
         self.__aperture = aperture
         self.__distance = distance
 
     def set_K_on_specific_harmonic(self, harmonic_energy, harmonic_number, which=KDirection.VERTICAL):
+        self.__common_random_numbers_beams = {}
+
         wavelength = harmonic_number*m2ev/harmonic_energy
         K = round(numpy.sqrt(2*(((wavelength*2*HU.gamma(self.__widget)**2)/self.__widget.undulator_period)-1)), 6)
 
@@ -267,6 +345,8 @@ class __ShadowHybridUndulatorSource(AbstractSource):
             self.__widget.Kh = Kboth
 
     def set_energy(self, energy=[4999.0, 5001.0], **kwargs):
+        self.__common_random_numbers_beams = {}
+
         try: photon_energy_distribution = kwargs["photon_energy_distribution"]
         except: photon_energy_distribution = 2
 
@@ -291,6 +371,30 @@ class __ShadowHybridUndulatorSource(AbstractSource):
     def get_source_beam(self, **kwargs):
         if self.__widget is None: raise ValueError("Source has not been initialized")
 
+        try:    ignore_aperture = kwargs["ignore_aperture"] # the rays with and without aperture are different beams
+        except: ignore_aperture = False
+
+        if self.__common_random_numbers and ignore_aperture in self.__common_random_numbers_beams:
+            return _displace_source_beam(self.__common_random_numbers_beams[ignore_aperture].duplicate(), **kwargs)
+
+        try:    random_seed = kwargs["random_seed"] # fresh rays for this beam only, ignored with common random numbers
+        except: random_seed = None
+
+        user_seed = self.__widget.seed
+        if not (random_seed is None or self.__common_random_numbers): self.__widget.seed = random_seed
+
+        try:
+            source_beam = self.__generate_source_beam(**kwargs)
+        finally:
+            self.__widget.seed = user_seed # restore user seed
+
+        if self.__common_random_numbers:
+            self.__common_random_numbers_beams[ignore_aperture] = source_beam
+            source_beam = source_beam.duplicate()
+
+        return _displace_source_beam(source_beam, **kwargs)
+
+    def __generate_source_beam(self, **kwargs):
         try: ignore_aperture = kwargs["ignore_aperture"]
         except: ignore_aperture = False
 
@@ -335,7 +439,7 @@ class __ShadowHybridUndulatorSource(AbstractSource):
         random_seed = self.__widget.seed
 
         self.__widget.seed = 0 # seed to 0 to ensure a new beam every time
-        source_beam = self.get_source_beam(ignore_aperture=True)
+        source_beam = self.__generate_source_beam(ignore_aperture=True)
         self.__widget.seed = random_seed # restore user seed
 
         slits_beam = ShadowBeam.traceFromOE(source_beam, ShadowOpticalElement(slits_oe), widget_class_name="ScreenSlits", recursive_history=False)
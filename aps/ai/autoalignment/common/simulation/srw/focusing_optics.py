@@ -60,7 +60,7 @@ class AbstractSRWFocusingOptics(AbstractSimulatedFocusingOptics):
         self._input_wavefront = None
         self.__initial_input_wavefront = None
         self._beamline = None
-        self._modified_elements = None
+        self._input_wavefront_version = 0 # part of the keys of the wavefront cache
 
     def initialize(self, **kwargs):
         input_photon_beam = kwargs["input_photon_beam"]
@@ -68,6 +68,7 @@ class AbstractSRWFocusingOptics(AbstractSimulatedFocusingOptics):
         self._input_wavefront          = input_photon_beam.duplicate()
         self.__initial_input_wavefront = input_photon_beam.duplicate()
         self._beamline                 = SRWBeamline()
+        self._input_wavefront_version += 1
 
     def perturbate_input_photon_beam(self, shift_h=None, shift_v=None, rotation_h=None, rotation_v=None):
         pass
@@ -75,6 +76,7 @@ class AbstractSRWFocusingOptics(AbstractSimulatedFocusingOptics):
     def restore_input_photon_beam(self):
         if self._input_wavefront is None: raise ValueError("Focusing Optical System is not initialized")
         self._input_wavefront = self.__initial_input_wavefront.duplicate()
+        self._input_wavefront_version += 1
 
     # PROTECTED GENERIC MOTOR METHODS
     @classmethod
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------- #
+# Copyright (c) 2022, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2022. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# ----------------------------------------------------------------------- #
+import copy
+import numpy
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from scipy.interpolate import RegularGridInterpolator
+
+from wofry.propagator.propagator import PropagationManager
+from wofrysrw.propagator.propagators2D.srw_fresnel_native import SRW_APPLICATION
+from wofrysrw.propagator.propagators2D.srw_propagation_mode import SRWPropagationMode
+
+DEFAULT_WAVEFRONT_CACHE_SIZE = 0 # opt-in: every cached wavefront holds a full SRW field in memory
+
+#############################################################################
+# Per-element wavefront cache
+#
+
+def get_optical_element_state(optical_element, round_digit=12):
+    """
+    Hashable snapshot of the parameters of an optical element that change the propagated wavefront
+    (aperture boundaries, displacement, grazing angle and p/q of the surface shape).
+    """
+    state = [type(optical_element).__name__]
+
+    boundary_shape = getattr(optical_element, "_boundary_shape", None)
+    if not boundary_shape is None: state += list(boundary_shape.get_boundaries())
+
+    displacement = getattr(optical_element, "displacement", None)
+    if not displacement is None:
+        state += [displacement.shift_x, displacement.shift_y, displacement.rotation_x, displacement.rotation_y]
+
+    grazing_angle = getattr(optical_element, "grazing_angle", None)
+    if not grazing_angle is None:
+        state.append(grazing_angle)
+        try:    state += list(optical_element.get_surface_shape().get_p_q(grazing_angle))
+        except AttributeError: pass
+
+    return tuple(round(float(value), round_digit) if isinstance(value, (int, float, numpy.number)) else value for value in state)
+
+class WavefrontCache():
+    """
+    LRU cache of the wavefronts propagated through each element, keyed by the state of that element and of
+    all the elements upstream of it: a key is (key of the previous element, state of the element).
+    Returning to a configuration already seen (e.g. a re-evaluated point or a rejected move) costs nothing,
+    and moving a downstream element re-uses the cached wavefronts of the upstream ones.
+    Wavefronts are copied in and out, so callers never share the cached objects. A max_size <= 0 disables it.
+    """
+    def __init__(self, max_size=DEFAULT_WAVEFRONT_CACHE_SIZE):
+        self.__max_size  = max_size
+        self.__wavefronts = OrderedDict()
+        self.__hits      = 0
+        self.__misses    = 0
+
+    def get(self, key):
+        if key in self.__wavefronts:
+            self.__wavefronts.move_to_end(key)
+            self.__hits += 1
+            return self.__wavefronts[key].duplicate()
+        else:
+            self.__misses += 1
+            return None
+
+    def put(self, key, wavefront):
+        if self.__max_size <= 0: return
+
+        self.__wavefronts[key] = wavefront.duplicate()
+        self.__wavefronts.move_to_end(key)
+        while len(self.__wavefronts) > self.__max_size: self.__wavefronts.popitem(last=False)
+
+    def clear(self):
+        self.__wavefronts.clear()
+
+    @property
+    def hits(self): return self.__hits
+    @property
+    def misses(self): return self.__misses
+
+    def __len__(self): return len(self.__wavefronts)
+
+#############################################################################
+# Incoherent (multi-electron/energy-resolved) propagation on a process pool
+#
+
+class SRWIntensityDistribution():
+    """
+    Weighted incoherent sum of the intensities of several propagated wavefronts, on the grid of the first one.
+    It exposes the same get_intensity() of an SRW wavefront, so it can be used with the distribution info/plot
+    utilities (phase information is lost, so native SRW plotting is not available).
+    """
+    def __init__(self, x_array, y_array, intensity, photon_energy=0.0):
+        self.__x_array       = x_array
+        self.__y_array       = y_array
+        self.__intensity     = intensity
+        self.__photon_energy = photon_energy
+
+    def get_intensity(self, multi_electron=False, **kwargs):
+        return numpy.array([self.__photon_energy]), self.__x_array.copy(), self.__y_array.copy(), numpy.array([self.__intensity])
+
+    def duplicate(self):
+        return SRWIntensityDistribution(self.__x_array.copy(), self.__y_array.copy(), self.__intensity.copy(), self.__photon_energy)
+
+def _propagate_through_chain(propagation_chain, handler_name, wavefront):
+    propagation_manager = PropagationManager.Instance()
+    propagation_manager.set_propagation_mode(SRW_APPLICATION, SRWPropagationMode.STEP_BY_STEP)
+
+    for propagation_parameters in propagation_chain:
+        propagation_parameters._wavefront = wavefront
+        wavefront = propagation_manager.do_propagation(propagation_parameters=propagation_parameters, handler_name=handler_name)
+
+    photon_energy, x_array, y_array, intensity = wavefront.get_intensity(multi_electron=False)
+
+    return photon_energy[0], x_array, y_array, intensity[0] # only the intensity goes back to the main process
+
+def propagate_incoherent_wavefronts(propagation_chain, handler_name, input_wavefronts, weights=None, n_processes=None, initializer=None):
+    """
+    Propagates every input wavefront (e.g. one per macro-electron or per photon energy) through the chain of
+    propagation parameters, in a pool of n_processes processes (n_processes=1 runs serially), and returns the
+    weighted sum of the output intensities as an SRWIntensityDistribution.
+    The initializer is run in every worker, and must register the propagator of handler_name.
+    """
+    if len(input_wavefronts) == 0: raise ValueError("No input wavefronts to propagate")
+    if weights is None: weights = numpy.ones(len(input_wavefronts))
+    elif len(weights) != len(input_wavefronts): raise ValueError("Weights and input wavefronts must have the same length")
+
+    propagation_chain = [copy.copy(propagation_parameters) for propagation_parameters in propagation_chain]
+    for propagation_parameters in propagation_chain: propagation_parameters._wavefront = None # not to be sent to the workers
+
+    if n_processes == 1:
+        results = [_propagate_through_chain(copy.deepcopy(propagation_chain), handler_name, wavefront.duplicate()) for wavefront in input_wavefronts]
+    else:
+        with ProcessPoolExecutor(max_workers=n_processes, initializer=initializer) as executor:
+            results = list(executor.map(_propagate_through_chain,
+                                        [propagation_chain] * len(input_wavefronts),
+                                        [handler_name] * len(input_wavefronts),
+                                        input_wavefronts))
+
+    photon_energy, x_array, y_array, intensity = results[0]
+    intensity = weights[0] * intensity
+
+    for weight, (_, x_array_i, y_array_i, intensity_i) in zip(weights[1:], results[1:]):
+        if not (numpy.array_equal(x_array_i, x_array) and numpy.array_equal(y_array_i, y_array)):
+            intensity_i = RegularGridInterpolator((x_array_i, y_array_i), intensity_i, bounds_error=False, fill_value=0.0)(
+                tuple(numpy.meshgrid(x_array, y_array, indexing="ij")))
+        intensity = intensity + weight * intensity_i
+
+    return SRWIntensityDistribution(x_array, y_array, intensity / numpy.sum(weights), photon_energy)
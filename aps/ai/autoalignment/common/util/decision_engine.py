@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------- #
+# Copyright (c) 2021, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2021. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# ----------------------------------------------------------------------- #
+import numpy
+
+#############################################################################
+# Multi-criteria decision making on a cached objective matrix:
+#
+# all the values are stored as "to be minimized" (maximized objectives are
+# sign-flipped), one row per completed trial. The selectors are vectorized
+# functions of the objective matrix and return the index of the selected row.
+#
+
+TOPSIS             = "topsis"
+NASH_EQUILIBRIUM   = "nash-equilibrium"
+KNEE_POINT         = "knee-point"
+WEIGHTED_CHEBYSHEV = "weighted-chebyshev"
+
+def _get_weights(values, weights):
+    if weights is None: return numpy.ones(values.shape[1])
+    weights = numpy.asarray(weights, dtype=float)
+    if weights.shape != (values.shape[1],): raise ValueError("The number of weights must match the number of objectives")
+    return weights
+
+def _normalize_to_range(values):
+    minimum = values.min(axis=0)
+    spread  = values.max(axis=0) - minimum
+    spread[spread == 0] = 1.0
+
+    return (values - minimum) / spread
+
+def dominance_matrix(values, other_values):
+    """Boolean matrix M with M[i, j] True if values[i] dominates other_values[j]."""
+    less_equal = numpy.all(values[:, None, :] <= other_values[None, :, :], axis=2)
+    less       = numpy.any(values[:, None, :] <  other_values[None, :, :], axis=2)
+
+    return numpy.logical_and(less_equal, less)
+
+def select_topsis(values, weights=None, **kwargs):
+    weights = _get_weights(values, weights)
+
+    norm = numpy.sqrt(numpy.sum(values**2, axis=0))
+    norm[norm == 0] = 1.0
+
+    v         = weights * values / norm
+    d_ideal   = numpy.sqrt(numpy.sum((v - v.min(axis=0))**2, axis=1))
+    d_nadir   = numpy.sqrt(numpy.sum((v - v.max(axis=0))**2, axis=1))
+    distances = d_ideal + d_nadir
+    closeness = numpy.divide(d_nadir, distances, out=numpy.zeros_like(d_nadir), where=distances > 0)
+
+    return int(numpy.argmax(closeness))
+
+def select_nash_equilibrium(values, all_values=None, **kwargs):
+    """The row that dominates the largest number of rows of all_values (all the completed trials)."""
+    if all_values is None: all_values = values
+
+    return int(numpy.argmax(numpy.sum(dominance_matrix(values, all_values), axis=1)))
+
+def select_knee_point(values, **kwargs):
+    """
+    The row farthest from the hyperplane through the extreme points of the (normalized) front, on the side
+    of the ideal point: the solution where improving any objective costs the most on the others.
+    """
+    if values.shape[0] <= 2 or values.shape[1] == 1: return int(numpy.argmin(numpy.sum(_normalize_to_range(values), axis=1)))
+
+    normalized = _normalize_to_range(values)
+    extremes   = normalized[numpy.argmin(normalized, axis=0)]
+
+    try:    plane = numpy.linalg.solve(extremes, numpy.ones(values.shape[1]))
+    except numpy.linalg.LinAlgError: plane = numpy.ones(values.shape[1])
+    if not numpy.all(numpy.isfinite(plane)) or numpy.allclose(plane, 0.0): plane = numpy.ones(values.shape[1])
+
+    return int(numpy.argmax((1.0 - normalized @ plane) / numpy.linalg.norm(plane)))
+
+def select_weighted_chebyshev(values, weights=None, augmentation=1e-6, **kwargs):
+    """Augmented weighted Chebyshev distance from the ideal point, on the objectives normalized to [0, 1]."""
+    weights    = _get_weights(values, weights)
+    normalized = weights * _normalize_to_range(values)
+
+    return int(numpy.argmin(numpy.max(normalized, axis=1) + augmentation * numpy.sum(normalized, axis=1)))
+
+SELECTORS = {
+    TOPSIS             : select_topsis,
+    NASH_EQUILIBRIUM   : select_nash_equilibrium,
+    KNEE_POINT         : select_knee_point,
+    WEIGHTED_CHEBYSHEV : select_weighted_chebyshev,
+}
+
+def _is_minimize(direction):
+    if isinstance(direction, str): return direction.lower() == "minimize"
+    else:                          return getattr(direction, "name", "").upper() == "MINIMIZE" # optuna StudyDirection
+
+class DecisionEngine():
+    """
+    Keeps the objective matrix of the completed trials and their Pareto front, updated incrementally as trials
+    arrive, so that selecting the best trial does not rebuild the values from the trials at every call.
+    """
+    def __init__(self, directions, initial_capacity=256):
+        self.__signs         = numpy.array([1.0 if _is_minimize(direction) else -1.0 for direction in directions])
+        self.__values        = numpy.empty((initial_capacity, len(self.__signs)))
+        self.__pareto_mask   = numpy.zeros(initial_capacity, dtype=bool)
+        self.__n_rows        = 0
+        self.__rows          = {} # trial number -> row
+
+    @property
+    def n_objectives(self): return len(self.__signs)
+
+    def __len__(self): return self.__n_rows
+
+    def get_objective_matrix(self):
+        """Objective values of the completed trials (with their original signs)."""
+        return self.__values[:self.__n_rows] * self.__signs
+
+    def get_pareto_rows(self):
+        return numpy.flatnonzero(self.__pareto_mask[:self.__n_rows])
+
+    def get_rows(self, trial_numbers):
+        return numpy.array([self.__rows[trial_number] for trial_number in trial_numbers], dtype=int)
+
+    def get_trial_numbers(self, rows):
+        numbers = numpy.empty(self.__n_rows, dtype=int)
+        for trial_number, row in self.__rows.items(): numbers[row] = trial_number
+
+        return numbers[rows]
+
+    def add(self, trial_number, values):
+        if trial_number in self.__rows: return False
+
+        values = self.__signs * numpy.asarray(values, dtype=float)
+        if values.shape != self.__signs.shape: raise ValueError("The number of values must match the number of objectives")
+
+        if self.__n_rows == self.__values.shape[0]:
+            self.__values      = numpy.concatenate([self.__values, numpy.empty_like(self.__values)])
+            self.__pareto_mask = numpy.concatenate([self.__pareto_mask, numpy.zeros_like(self.__pareto_mask)])
+
+        row = self.__n_rows
+        self.__values[row] = values
+        self.__rows[trial_number] = row
+        self.__n_rows += 1
+
+        pareto_rows = self.get_pareto_rows()
+        front       = self.__values[pareto_rows]
+
+        if not numpy.any(dominance_matrix(front, values[None, :])):
+            self.__pareto_mask[pareto_rows[dominance_matrix(values[None, :], front)[0]]] = False
+            self.__pareto_mask[row] = True
+
+        return True
+
+    def update(self, trials):
+        """Adds the completed trials not yet seen, returns the number of added trials."""
+        n_added = 0
+        for trial in trials:
+            if trial.number in self.__rows or trial.values is None or trial.state.name != "COMPLETE": continue
+            n_added += int(self.add(trial.number, trial.values))
+
+        return n_added
+
+    def count_dominated(self, rows):
+        return numpy.sum(dominance_matrix(self.__values[rows], self.__values[:self.__n_rows]), axis=1)
+
+    def select(self, algorithm=TOPSIS, rows=None, weights=None):
+        """Selects among the given rows (the Pareto front by default) and returns the selected row."""
+        try:    selector = SELECTORS[algorithm]
+        except KeyError: raise ValueError("Selection algorithm not recognized: " + str(algorithm))
+
+        if rows is None: rows = self.get_pareto_rows()
+        if len(rows) == 0: raise ValueError("No completed trials to select from")
+
+        return rows[selector(self.__values[rows], weights=weights, all_values=self.__values[:self.__n_rows])]
+
+    def select_trial(self, trials, algorithm=TOPSIS, weights=None):
+        """Selects among the given (completed) trials, and returns the index of the selected one in the list."""
+        self.update(trials)
+
+        rows = self.get_rows([trial.number for trial in trials])
+
+        return int(numpy.flatnonzero(rows == self.select(algorithm, rows, weights))[0])
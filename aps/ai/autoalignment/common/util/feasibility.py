@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------- #
+# Copyright (c) 2021, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2021. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# ----------------------------------------------------------------------- #
+import numpy
+
+#############################################################################
+# Feasibility of the start points:
+#
+# the random initialization draws motor positions until the beam is inside
+# the detector (and intense enough): every rejected guess costs a full trace,
+# or a move and a shot on the hardware. The classifier keeps the outcomes of
+# the previous guesses and trials (absolute motor positions: the origin of the
+# relative moves changes at every cycle) and estimates the probability of an
+# acceptable beam with a kernel (Nadaraya-Watson) average, shrunk towards 1/2
+# by prior_weight pseudo-observations where there are no data:
+#
+#   p(x) = (prior_weight/2 + sum_i k(x, x_i) y_i) / (prior_weight + sum_i k(x, x_i))
+#
+# with Gaussian kernels of width length_scale times the sampled ranges. The
+# start points are drawn among n_candidates uniform candidates, with weights
+# p(x) (only the candidates with p(x) >= min_probability, if any): still
+# random, but away from the known failures.
+#
+
+class FeasibilityClassifier():
+    """
+    Probability of an acceptable beam at given motor positions, from the recorded outcomes (one history per motor set).
+    """
+    def __init__(self, length_scale=0.1, prior_weight=1.0, max_records=5000):
+        self.__length_scale = length_scale
+        self.__prior_weight = prior_weight
+        self.__max_records  = max_records
+        self.__records      = {} # motor types: (list of absolute positions, list of outcomes)
+
+    def record(self, motor_types, absolute_positions, feasible):
+        """Outcome of the absolute positions of the motors (feasible: acceptable beam)."""
+        points, outcomes = self.__records.setdefault(tuple(motor_types), ([], []))
+        points.append(numpy.asarray(absolute_positions, dtype=float))
+        outcomes.append(1.0 if feasible else 0.0)
+
+        if len(points) > self.__max_records: # the oldest outcomes are forgotten (drifts)
+            del points[0]
+            del outcomes[0]
+
+    def get_n_records(self, motor_types): return len(self.__records.get(tuple(motor_types), ([], []))[0])
+
+    def predict(self, motor_types, absolute_positions, scales):
+        """Feasibility probability of the absolute positions (n, d), with kernel widths length_scale * scales (d)."""
+        absolute_positions = numpy.atleast_2d(numpy.asarray(absolute_positions, dtype=float))
+        if self.get_n_records(motor_types) == 0: return numpy.full(absolute_positions.shape[0], 0.5)
+
+        points, outcomes = self.__records[tuple(motor_types)]
+        widths           = self.__length_scale * numpy.maximum(numpy.abs(numpy.asarray(scales, dtype=float)), 1e-12)
+        distances        = (absolute_positions[:, numpy.newaxis, :] - numpy.array(points)[numpy.newaxis, :, :]) / widths
+        kernel           = numpy.exp(-0.5 * numpy.sum(distances**2, axis=2))
+
+        return (0.5 * self.__prior_weight + kernel @ numpy.array(outcomes)) / (self.__prior_weight + kernel.sum(axis=1))
+
+    def propose(self, motor_types, origin, ranges, rng, n_candidates=256, min_probability=0.5):
+        """
+        Relative guess in the ranges around the origin (absolute positions), drawn with rng among n_candidates uniform
+        candidates with weights equal to their feasibility probability: (guess, probability).
+        """
+        ranges     = numpy.asarray(ranges, dtype=float)
+        candidates = rng.uniform(ranges[:, 0], ranges[:, 1], size=(n_candidates, len(ranges)))
+        p          = self.predict(motor_types, numpy.asarray(origin, dtype=float) + candidates, scales=ranges[:, 1] - ranges[:, 0])
+
+        weights = numpy.where(p >= min_probability, p, 0.0)
+        if weights.sum() == 0.0: weights = p # no candidate is likely feasible: the most promising ones are preferred anyway
+
+        index = rng.choice(n_candidates, p=weights / weights.sum())
+
+        return [float(value) for value in candidates[index]], float(p[index])
+
+    def record_trials(self, motor_types, trials, origin, no_beam_loss=1e4):
+        """
+        Outcomes of Optuna trials (relative params, origin: absolute positions of the motors at the start of the study):
+        pruned trials and trials with penalty values are infeasible.
+        """
+        from optuna.trial import TrialState
+
+        for trial in trials:
+            if not all(motor in trial.params for motor in motor_types): continue
+
+            if trial.state == TrialState.PRUNED:     feasible = False
+            elif trial.state == TrialState.COMPLETE: feasible = bool(numpy.all(numpy.asarray(trial.values) < no_beam_loss))
+            else:                                    continue
+
+            self.record(motor_types, numpy.asarray(origin, dtype=float) + numpy.array([trial.params[motor] for motor in motor_types]), feasible)
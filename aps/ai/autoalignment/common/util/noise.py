@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------- #
+# Copyright (c) 2021, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2021. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# ----------------------------------------------------------------------- #
+import numpy
+
+#############################################################################
+# Independent random streams:
+#
+# every stream is derived from the user seed through a SeedSequence, using
+# the spawn key (worker index, trial number). This is equivalent to calling
+# SeedSequence(random_seed).spawn(n_workers)[worker_index].spawn(...)[trial_number],
+# without having to keep the spawn tree in memory or to share it between processes.
+#
+
+def get_seed_sequence(random_seed=None, worker_index=None, trial_number=None):
+    spawn_key = ()
+    if not worker_index is None: spawn_key += (int(worker_index),)
+    if not trial_number is None:
+        if worker_index is None: spawn_key += (0,)
+        spawn_key += (int(trial_number),)
+
+    return numpy.random.SeedSequence(entropy=random_seed, spawn_key=spawn_key)
+
+def get_random_generator(random_seed=None, worker_index=None, trial_number=None):
+    if worker_index is None and trial_number is None: return numpy.random.default_rng(random_seed) # same stream as the plain seed
+    else:                                             return numpy.random.default_rng(get_seed_sequence(random_seed, worker_index, trial_number))
+
+def spawn_random_generators(random_seed=None, n_streams=1):
+    return [numpy.random.default_rng(seed_sequence) for seed_sequence in numpy.random.SeedSequence(random_seed).spawn(n_streams)]
+
+#############################################################################
+# Detector noise
+
+class NoiseGenerator:
+    """
+    Uniform detector noise, added in place to the histograms of the simulated beam:
+
+        hh += noise + fluctuation*(0.5 - U[0, 1)),   fluctuation = percentage_fluctuation*noise
+
+    The random numbers are drawn from a private numpy.random.Generator into a buffer
+    allocated once per histogram shape, so repeated calls do not allocate new arrays.
+    An instance is not thread-safe: use one per worker.
+    """
+    def __init__(self, rng : numpy.random.Generator = None):
+        self.__rng     = numpy.random.default_rng() if rng is None else rng
+        self.__buffers = {}
+
+    @property
+    def rng(self): return self.__rng
+
+    def reseed(self, rng : numpy.random.Generator):
+        self.__rng = rng
+
+    def add_noise(self, hh, noise, percentage_fluctuation):
+        fluctuation = percentage_fluctuation*noise
+
+        buffer = self.__get_buffer(hh.shape)
+        self.__rng.random(out=buffer)
+        buffer *= -fluctuation
+        buffer += noise + 0.5*fluctuation
+
+        hh += buffer
+
+        return hh
+
+    def generate_noise_batch(self, shape, n_samples, noise, percentage_fluctuation):
+        fluctuation = percentage_fluctuation*noise
+
+        batch = self.__rng.random((n_samples,) + tuple(shape))
+        batch *= -fluctuation
+        batch += noise + 0.5*fluctuation
+
+        return batch
+
+    def add_noise_batch(self, hh_batch, noise, percentage_fluctuation):
+        hh_batch += self.generate_noise_batch(hh_batch.shape[1:], hh_batch.shape[0], noise, percentage_fluctuation)
+
+        return hh_batch
+
+    def __get_buffer(self, shape):
+        shape = tuple(shape)
+        try:
+            buffer = self.__buffers[shape]
+        except KeyError:
+            buffer = numpy.empty(shape, dtype=numpy.float64)
+            self.__buffers[shape] = buffer
+
+        return buffer
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------- #
+# Copyright (c) 2021, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2021. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# ----------------------------------------------------------------------- #
+import numpy
+
+from aps.ai.autoalignment.common.util.common import Histogram, get_info
+from aps.ai.autoalignment.common.util.shadow.compact_beam import CompactBeam, compact_beam
+
+#############################################################################
+# Observation noise of a single trial:
+#
+# the standard error of the objectives is estimated from replicates of the beam
+# state, that are evaluated with the same loss functions of the observation:
+#
+# - BOOTSTRAP (SHADOW simulations): Poisson(1) weights on the rays (Poisson
+#   bootstrap), histograms and statistics are recalculated for every replicate;
+# - COUNTING (simulations and hardware): Poisson counting statistics on the bins
+#   of the histogram, the weight of one count being the mean (intensity-weighted)
+#   weight of the rays or the detector gain.
+#
+# The standard errors are stored in the trial user attributes (OBSERVATION_NOISE_ATTR)
+# and consumed by the fixed-noise/heteroscedastic GP of the BoTorch sampler.
+#
+
+class ObservationNoiseMethods:
+    BOOTSTRAP = "bootstrap"
+    COUNTING  = "counting"
+
+DEFAULT_N_REPLICATES   = 32
+OBSERVATION_NOISE_ATTR = "loss_standard_error"
+
+def get_count_weight(photon_beam):
+    """Weight of one count of the histogram: sum(w^2)/sum(w) over the good rays (1 if not a SHADOW beam)."""
+    if isinstance(photon_beam, CompactBeam): intensity = photon_beam.getshonecol(23, nolost=1)
+    else:
+        try:    intensity = photon_beam._beam.getshonecol(23, nolost=1)
+        except: return 1.0
+
+    total_intensity = numpy.sum(intensity)
+
+    return 1.0 if total_intensity <= 0 else numpy.sum(intensity**2) / total_intensity
+
+def get_bootstrap_beams(photon_beam, n_replicates=DEFAULT_N_REPLICATES, rng : numpy.random.Generator = None):
+    if rng is None: rng = numpy.random.default_rng()
+    if not isinstance(photon_beam, CompactBeam): photon_beam = compact_beam(photon_beam, dtype=numpy.float64)
+
+    n_rays = photon_beam.nrays(nolost=1)
+
+    for _ in range(n_replicates): yield photon_beam.reweight(rng.poisson(1.0, n_rays))
+
+def get_counting_histograms(hist : Histogram, n_replicates=DEFAULT_N_REPLICATES, rng : numpy.random.Generator = None, count_weight=1.0):
+    if rng is None: rng = numpy.random.default_rng()
+
+    counts = numpy.clip(hist.data_2D, 0.0, None) / count_weight # denoised images and added noise can be negative
+
+    for _ in range(n_replicates): yield Histogram(hh=hist.hh, vv=hist.vv, data_2D=rng.poisson(counts) * count_weight)
+
+def get_counting_distribution_info(hist : Histogram, do_gaussian_fit=False, calculate_over_noise=False, noise_threshold=1.5):
+    return get_info(x_array=hist.hh, y_array=hist.vv, z_array=hist.data_2D,
+                    do_gaussian_fit=do_gaussian_fit, calculate_over_noise=calculate_over_noise, noise_threshold=noise_threshold)
+
+def get_standard_errors(replicate_values):
+    """Standard deviation over the replicates (first axis) of the values, NaN if less than 2 valid replicates."""
+    replicate_values = numpy.asarray(replicate_values, dtype=float)
+    valid            = numpy.isfinite(replicate_values)
+    n_valid          = valid.sum(axis=0)
+
+    mean     = numpy.where(valid, replicate_values, 0.0).sum(axis=0) / numpy.maximum(n_valid, 1)
+    variance = numpy.where(valid, (replicate_values - mean)**2, 0.0).sum(axis=0) / numpy.maximum(n_valid - 1, 1)
+
+    return numpy.where(n_valid > 1, numpy.sqrt(variance), numpy.nan)
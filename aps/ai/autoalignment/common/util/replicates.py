@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------- #
+# Copyright (c) 2021, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2021. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# ----------------------------------------------------------------------- #
+import numpy
+
+#############################################################################
+# Adaptive replication of the measurements:
+#
+# a configuration is measured again (without moving the motors) only when its
+# position with respect to the current front is uncertain. The distance from
+# the front is measured in standard errors of the mean of the replicates:
+#
+#   z = max over front points p of (min over objectives j of (m_j - p_j)/se_j)
+#
+# (objectives in minimization convention). z > margin: clearly dominated, no
+# more frames; |z| <= margin: ambiguous, enough frames are added to resolve the
+# margin (se ~ 1/sqrt(n)); z < -margin: clear winner, confirmed by at least
+# min_best_replicates frames, against single outlier frames.
+#
+# The standard errors combine the spread of the replicates with a prior single
+# frame variance (observation noise estimate, or pooled from previous trials).
+#
+
+class ReplicateScheduler:
+    def __init__(self, max_replicates=5, margin=2.0, min_best_replicates=2, prior_weight=2.0):
+        if max_replicates < 1: raise ValueError("At least one replicate is needed")
+
+        self.__max_replicates      = max_replicates
+        self.__margin              = margin
+        self.__min_best_replicates = min(min_best_replicates, max_replicates)
+        self.__prior_weight        = prior_weight # pseudo-replicates of the prior variance
+        self.__pooled_squares      = None
+        self.__pooled_dof          = 0
+
+    @property
+    def max_replicates(self): return self.__max_replicates
+
+    def get_pooled_variance(self):
+        """Single frame variance of the objectives, pooled over the recorded trials (None if not available)."""
+        return None if self.__pooled_dof == 0 else self.__pooled_squares / self.__pooled_dof
+
+    def record(self, replicate_losses):
+        replicate_losses = numpy.atleast_2d(replicate_losses)
+        if replicate_losses.shape[0] < 2: return
+
+        squares = numpy.sum((replicate_losses - replicate_losses.mean(axis=0))**2, axis=0)
+
+        self.__pooled_squares  = squares if self.__pooled_squares is None else self.__pooled_squares + squares
+        self.__pooled_dof     += replicate_losses.shape[0] - 1
+
+    def get_standard_errors(self, replicate_losses, single_frame_standard_errors=None):
+        """Standard errors of the mean of the replicates (NaN if the noise cannot be estimated yet)."""
+        replicate_losses = numpy.atleast_2d(replicate_losses)
+        n_replicates     = replicate_losses.shape[0]
+
+        if single_frame_standard_errors is None or not numpy.all(numpy.isfinite(single_frame_standard_errors)): prior_variance = self.get_pooled_variance()
+        else:                                                                                                   prior_variance = numpy.square(single_frame_standard_errors)
+
+        if n_replicates > 1:
+            sample_squares = numpy.sum((replicate_losses - replicate_losses.mean(axis=0))**2, axis=0)
+            if prior_variance is None: variance = sample_squares / (n_replicates - 1)
+            else:                      variance = (self.__prior_weight * prior_variance + sample_squares) / (self.__prior_weight + n_replicates - 1)
+        elif prior_variance is None:
+            return numpy.full(replicate_losses.shape[1], numpy.nan)
+        else:
+            variance = prior_variance
+
+        return numpy.sqrt(variance / n_replicates)
+
+    def get_front_distance(self, mean_loss, standard_errors, front):
+        """Signed distance of the mean loss from the front (minimization), in standard errors: > 0 dominated."""
+        front = numpy.atleast_2d(front)
+        if front.size == 0: return -numpy.inf
+
+        return numpy.max(numpy.min((numpy.atleast_1d(mean_loss) - front) / numpy.maximum(standard_errors, 1e-300), axis=1))
+
+    def get_n_extra_replicates(self, replicate_losses, front, single_frame_standard_errors=None):
+        replicate_losses = numpy.atleast_2d(replicate_losses)
+        n_replicates     = replicate_losses.shape[0]
+
+        if n_replicates >= self.__max_replicates: return 0
+
+        standard_errors = self.get_standard_errors(replicate_losses, single_frame_standard_errors)
+        if not numpy.all(numpy.isfinite(standard_errors)): return 1 # one more frame to estimate the noise
+
+        z = self.get_front_distance(replicate_losses.mean(axis=0), standard_errors, front)
+
+        if z > self.__margin:    n_needed = n_replicates
+        elif z < -self.__margin: n_needed = self.__min_best_replicates
+        else:                    n_needed = int(numpy.ceil(n_replicates * (self.__margin / max(abs(z), 1e-3))**2))
+
+        return int(numpy.clip(n_needed, n_replicates, self.__max_replicates)) - n_replicates
@@ -0,0 +1,371 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------- #
+# Copyright (c) 2021, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2021. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+import os
+import glob
+import json
+import shutil
+import hashlib
+import tempfile
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy
+from scipy.stats import qmc
+
+from aps.ai.autoalignment.common.facade.parameters import Movement
+from aps.ai.autoalignment.common.simulation.facade.parameters import Implementors
+from aps.ai.autoalignment.common.util import clean_up
+from aps.ai.autoalignment.common.util.travel import get_travel_order
+from aps.ai.autoalignment.common.util.wrappers import get_distribution_info
+
+#############################################################################
+# Scan engine:
+#
+# scans of any set of facade motors (moved with move_<name>), on a grid, a
+# line, random or Latin hypercube points. Every measured point is appended
+# to a results file (one JSON record per line, flushed immediately): an
+# interrupted scan restarts from the points already measured, and the file
+# can be read by load_scan_results while the scan is running.
+#
+# Parallel scans (simulation only) run on n_workers processes, each one with
+# its own focusing system (built by focusing_system_factory, a picklable
+# callable) in a private directory, because SHADOW writes its files in the
+# current directory. Only the files matching worker_files (glob patterns in
+# the working directory, by default the preprocessor, error profile and
+# configuration files) are copied there: beams read from files by the factory
+# must be added explicitly (with their parameters_start_/parameters_end_
+# files), or better published once with a SharedBeam.
+#
+# Random and Latin hypercube scans without random_seed store the drawn
+# positions in the results file, and an interrupted scan resumes on them.
+#
+# With a travel_time_model (common.util.travel, keyed by the motor names),
+# the missing points are measured in the order with the shortest travel of
+# the motors, instead of the order of the positions.
+#
+
+RESULTS_FILE_VERSION = 1
+
+DEFAULT_WORKER_FILES = ["*.ini", "*_shadow.dat", "*_srw.dat", "*bender*.dat", "*reflectivity*.dat", "error_profile.dat", "Pt.dat", "Si111.dat", "KB.dat"]
+
+class ScanType:
+    GRID            = "grid"
+    LINE            = "line"
+    RANDOM          = "random"
+    LATIN_HYPERCUBE = "latin-hypercube"
+
+class ScanMotor():
+    """
+    Motor of the focusing optics facade, moved with move_<name>(position, movement=ABSOLUTE[, units=units]).
+    Motors with the same axis move together in grid scans (e.g. the upstream benders of the two KBs).
+    """
+    def __init__(self, name, start, stop, units=None, axis=None):
+        self.name  = name
+        self.start = start
+        self.stop  = stop
+        self.units = units
+        self.axis  = axis
+
+    def to_dictionary(self): return {"name": self.name, "start": self.start, "stop": self.stop, "units": self.units, "axis": self.axis}
+
+def generate_scan_points(motors, scan_type=ScanType.GRID, n_points=10, random_seed=None):
+    """
+    Positions of the scan, as an array (points, motors). For grid scans n_points is the number of points of
+    every axis or a list with one number per axis (axes ordered as they first appear in motors).
+    """
+    starts = numpy.array([motor.start for motor in motors], dtype=float)
+    stops  = numpy.array([motor.stop  for motor in motors], dtype=float)
+
+    if scan_type == ScanType.GRID:
+        motor_axes = [("motor", index) if motor.axis is None else motor.axis for index, motor in enumerate(motors)]
+        axes       = list(dict.fromkeys(motor_axes))
+
+        if numpy.isscalar(n_points): n_points = [n_points]*len(axes)
+        elif len(n_points) != len(axes): raise ValueError("Grid scan needs one number of points per axis (" + str(len(axes)) + ")")
+
+        grid    = numpy.array(list(itertools.product(*[range(n) for n in n_points])), dtype=int)
+        columns = [axes.index(axis) for axis in motor_axes]
+        steps   = numpy.array([max(n_points[column] - 1, 1) for column in columns], dtype=float)
+
+        return starts + (stops - starts) * grid[:, columns] / steps
+    elif scan_type == ScanType.LINE:
+        return starts + (stops - starts) * numpy.linspace(0.0, 1.0, n_points)[:, numpy.newaxis]
+    elif scan_type == ScanType.RANDOM:
+        return starts + (stops - starts) * numpy.random.default_rng(random_seed).random((n_points, len(motors)))
+    elif scan_type == ScanType.LATIN_HYPERCUBE:
+        return starts + (stops - starts) * qmc.LatinHypercube(d=len(motors), seed=random_seed).random(n_points)
+    else:
+        raise ValueError("Scan type not recognized: " + str(scan_type))
+
+#############################################################################
+# Results store
+#
+
+def _to_json(value):
+    if isinstance(value, dict):                           return {key: _to_json(item) for key, item in value.items()}
+    elif isinstance(value, (list, tuple, numpy.ndarray)): return [_to_json(item) for item in value]
+    elif isinstance(value, numpy.generic):                return value.item()
+    else:                                                 return value
+
+class ScanResults():
+    def __init__(self, header, records):
+        self.header    = header
+        self.motors    = [motor["name"] for motor in header["motors"]]
+        self.positions = numpy.array(header["positions"], dtype=float)
+        self.completed = numpy.zeros(len(self.positions), dtype=bool)
+        self.errors    = {}
+        self.values    = {}
+
+        for index, record in records.items():
+            if "error" in record:
+                self.errors[index] = record["error"]
+            else:
+                self.completed[index] = True
+                for name, value in record["result"].items():
+                    if not name in self.values: self.values[name] = numpy.full(len(self.positions), numpy.nan)
+                    try:    self.values[name][index] = value
+                    except (TypeError, ValueError): pass # non scalar results are kept in the file only
+
+    @property
+    def n_points(self): return len(self.positions)
+
+    def get_value(self, name, shape=None):
+        """Values of a result at all the points (NaN where not measured), reshaped e.g. as the grid."""
+        values = self.values[name]
+        return values if shape is None else values.reshape(shape)
+
+def _read_results_file(file_name):
+    header  = None
+    records = {}
+
+    with open(file_name, "r") as f:
+        for line in f:
+            if line.strip() == "": continue
+            try:    record = json.loads(line)
+            except json.JSONDecodeError: continue # last line of an interrupted scan
+
+            if header is None: header = record
+            else:              records[record["index"]] = record
+
+    if header is None: raise ValueError("Scan results file is empty: " + file_name)
+
+    return header, records
+
+def load_scan_results(file_name):
+    """Results of a scan, also partial (while the scan is running or after an interruption)."""
+    return ScanResults(*_read_results_file(file_name))
+
+#############################################################################
+# Workers
+#
+
+__worker_focusing_system = None
+__worker_position        = None
+
+def _initialize_worker(focusing_system_factory, working_directory, root_directory, worker_files):
+    global __worker_focusing_system
+
+    worker_directory = tempfile.mkdtemp(prefix="worker_", dir=root_directory)
+    file_names       = set(itertools.chain.from_iterable(glob.glob(os.path.join(working_directory, pattern)) for pattern in worker_files))
+    for file_name in file_names:
+        if os.path.isfile(file_name): shutil.copy2(file_name, worker_directory)
+    os.chdir(worker_directory)
+    clean_up() # SHADOW outputs copied from the working directory
+
+    __worker_focusing_system = focusing_system_factory()
+
+def _move_motors(focusing_system, motors, position, previous_position):
+    for index, motor in enumerate(motors):
+        # unchanged motors are not moved: the focusing optics retrace only the modified elements
+        if not previous_position is None and previous_position[index] == position[index]: continue
+
+        if motor.units is None: getattr(focusing_system, "move_" + motor.name)(position[index], movement=Movement.ABSOLUTE)
+        else:                   getattr(focusing_system, "move_" + motor.name)(position[index], movement=Movement.ABSOLUTE, units=motor.units)
+
+def _measure_point(focusing_system, motors, measure_function, index, position, previous_position):
+    try:
+        _move_motors(focusing_system, motors, position, previous_position)
+        return {"index": index, "result": _to_json(measure_function(focusing_system))}
+    except Exception as exception:
+        return {"index": index, "error": repr(exception)}
+
+def _measure_points_in_worker(motors, measure_function, indexes, positions):
+    global __worker_position
+
+    records = []
+    for index, position in zip(indexes, positions):
+        records.append(_measure_point(__worker_focusing_system, motors, measure_function, index, position, __worker_position))
+        __worker_position = None if "error" in records[-1] else position
+
+    return records
+
+#############################################################################
+
+class BeamStatistics():
+    """
+    Measure function for simulated scans: statistics of the beam at the detector, as get_distribution_info.
+    beam_kwargs go to get_photon_beam, the other kwargs (xrange, yrange, nbins_h, ...) to get_distribution_info.
+    """
+    def __init__(self, implementor=Implementors.SHADOW,
+                 parameters=("h_sigma", "v_sigma", "h_fwhm", "v_fwhm", "h_centroid", "v_centroid", "integral_intensity", "peak_intensity"),
+                 beam_kwargs={}, **kwargs):
+        self.__implementor = implementor
+        self.__parameters  = parameters
+        self.__beam_kwargs = beam_kwargs
+        self.__kwargs      = kwargs
+
+    def __call__(self, focusing_system):
+        _, dw = get_distribution_info(self.__implementor, focusing_system.get_photon_beam(**self.__beam_kwargs), **self.__kwargs)
+
+        return {parameter: dw.get_parameter(parameter) for parameter in self.__parameters}
+
+class ScanEngine():
+    def __init__(self, motors, measure_function, scan_type=ScanType.GRID, n_points=10, random_seed=None,
+                 results_file="scan_results.jsonl", focusing_system=None, focusing_system_factory=None,
+                 n_workers=1, chunk_size=None, working_directory=None, worker_files=DEFAULT_WORKER_FILES, positions=None, travel_time_model=None, verbose=False):
+        if n_workers > 1 and focusing_system_factory is None: raise ValueError("Parallel scans need a focusing_system_factory")
+        if n_workers == 1 and focusing_system is None and focusing_system_factory is None: raise ValueError("Give a focusing_system or a focusing_system_factory")
+
+        self.__motors                  = motors
+        self.__measure_function        = measure_function
+        # explicit positions (points, motors) replace the generated ones (e.g. finite-difference stencils)
+        if positions is None: self.__positions = generate_scan_points(motors, scan_type, n_points, random_seed)
+        else:                 self.__positions = numpy.atleast_2d(numpy.asarray(positions, dtype=float))
+        self.__results_file            = results_file
+        self.__focusing_system         = focusing_system
+        self.__focusing_system_factory = focusing_system_factory
+        self.__n_workers               = n_workers
+        self.__chunk_size              = chunk_size
+        self.__working_directory       = os.path.abspath(os.curdir if working_directory is None else working_directory)
+        self.__worker_files            = list(worker_files)
+        self.__travel_time_model       = travel_time_model
+        self.__verbose                 = verbose
+
+        self.__header = {"version"   : RESULTS_FILE_VERSION,
+                         "scan_type" : scan_type,
+                         "n_points"  : _to_json(n_points),
+                         "motors"    : [motor.to_dictionary() for motor in motors],
+                         "positions" : self.__positions.tolist()}
+
+        # positions drawn without seed cannot be generated again: they are not part of the digest, and are read from the file
+        self.__unseeded_positions = positions is None and random_seed is None and scan_type in [ScanType.RANDOM, ScanType.LATIN_HYPERCUBE]
+
+        digest_header = {key: value for key, value in self.__header.items() if not (key == "positions" and self.__unseeded_positions)}
+        self.__header["digest"] = hashlib.sha1(json.dumps(digest_header, sort_keys=True).encode()).hexdigest()
+
+    @property
+    def positions(self): return self.__positions
+
+    def run(self, callback=None):
+        """
+        Measures the missing points; callback(index, position, record) is called as soon as every point is stored.
+        """
+        for index, record in self.iterate():
+            if not callback is None: callback(index, self.__positions[index], record)
+
+        return load_scan_results(self.__results_file)
+
+    def iterate(self):
+        """Generator of (index, record) of the points measured by this run, as they are stored."""
+        records   = self.__open_results_file()
+        remaining = [index for index in range(len(self.__positions)) if not index in records]
+        if not self.__travel_time_model is None and len(remaining) > 1:
+            motor_names = [motor.name for motor in self.__motors]
+            remaining   = [remaining[index] for index in get_travel_order(self.__travel_time_model, motor_names, self.__positions[remaining])]
+
+        if self.__verbose: print("Scan: " + str(len(records)) + " points already measured, " + str(len(remaining)) + " to go")
+
+        with open(self.__results_file, "a") as results_file:
+            def store(record):
+                results_file.write(json.dumps(record) + "\n")
+                results_file.flush()
+                return record["index"], record
+
+            if self.__n_workers == 1:
+                if self.__focusing_system is None: self.__focusing_system = self.__focusing_system_factory()
+
+                previous_position = None
+                for index in remaining:
+                    record = _measure_point(self.__focusing_system, self.__motors, self.__measure_function, index, self.__positions[index], previous_position)
+                    previous_position = None if "error" in record else self.__positions[index]
+
+                    yield store(record)
+            else:
+                # contiguous chunks: consecutive points of a grid share the positions of the slow axes
+                chunk_size = self.__chunk_size if not self.__chunk_size is None else max(1, len(remaining) // (8*self.__n_workers))
+                chunks     = [remaining[start:start + chunk_size] for start in range(0, len(remaining), chunk_size)]
+
+                root_directory = tempfile.mkdtemp(prefix="scan_")
+                try:
+                    with ProcessPoolExecutor(max_workers=self.__n_workers,
+                                             initializer=_initialize_worker,
+                                             initargs=(self.__focusing_system_factory, self.__working_directory, root_directory, self.__worker_files)) as executor:
+                        futures = [executor.submit(_measure_points_in_worker, self.__motors, self.__measure_function, chunk, self.__positions[chunk]) for chunk in chunks]
+
+                        for future in as_completed(futures):
+                            for record in future.result(): yield store(record)
+                finally:
+                    shutil.rmtree(root_directory, ignore_errors=True)
+
+    def __open_results_file(self):
+        if os.path.exists(self.__results_file) and os.path.getsize(self.__results_file) > 0:
+            header, records = _read_results_file(self.__results_file)
+            if header.get("digest") != self.__header["digest"]: raise ValueError("Results file " + self.__results_file + " belongs to a different scan")
+            if self.__unseeded_positions:
+                self.__positions           = numpy.array(header["positions"], dtype=float)
+                self.__header["positions"] = header["positions"]
+
+            with open(self.__results_file, "rb+") as f: # an interrupted write leaves a partial last line
+                f.seek(0, os.SEEK_END)
+                if f.tell() > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n": f.write(b"\n")
+
+            return {index: record for index, record in records.items() if not "error" in record} # failed points are measured again
+        else:
+            with open(self.__results_file, "w") as f: f.write(json.dumps(self.__header) + "\n")
+
+            return {}
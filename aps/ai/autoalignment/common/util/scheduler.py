@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------- #
+# Copyright (c) 2021, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2021. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# ----------------------------------------------------------------------- #
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+
+#############################################################################
+# Scheduling of the cycles of a script:
+#
+# the cycles start on wall-clock deadlines (origin + k * period, fixed rate:
+# the duration of a cycle does not delay the next one), on trigger events
+# (e.g. the monitor of a PV, like the traffic light), or on the first of the
+# two. A cycle that overruns its period starts the next one immediately, and
+# the deadlines are re-anchored to it (no burst of late cycles).
+#
+# The post-processing of a cycle (plots, dumps, archives) is submitted to the
+# scheduler and runs while waiting for the next cycle:
+#
+# main thread : tasks run between the checks of the trigger (e.g. matplotlib,
+#               which is not thread-safe).
+# background  : tasks run in a worker thread, in order of submission (I/O,
+#               e.g. joblib dumps).
+#
+# The jitter of a cycle is the delay of its start with respect to its deadline
+# or trigger event.
+#
+
+class TriggerMode:
+    PERIOD          = "period"
+    EVENT           = "event"
+    PERIOD_OR_EVENT = "period_or_event"
+
+class CycleScheduler():
+    """
+    Start times of n_cycles cycles (period in seconds), with post-processing tasks executed while waiting.
+    """
+    def __init__(self, period, n_cycles, trigger_mode=TriggerMode.PERIOD, poll_interval=0.5, verbose=True):
+        if not trigger_mode in (TriggerMode.PERIOD, TriggerMode.EVENT, TriggerMode.PERIOD_OR_EVENT): raise ValueError("Trigger mode not recognized: " + str(trigger_mode))
+
+        self.__period        = period
+        self.__n_cycles      = int(n_cycles)
+        self.__trigger_mode  = trigger_mode
+        self.__poll_interval = poll_interval
+        self.__verbose       = verbose
+        self.__event         = threading.Event()
+        self.__event_time    = None
+        self.__main_tasks    = deque()
+        self.__executor      = None
+        self.__futures       = []
+        self.__jitters       = []
+        self.__n_overruns    = 0
+
+    def trigger(self):
+        """Starts the next cycle (EVENT or PERIOD_OR_EVENT mode), thread-safe: e.g. from a CA monitor callback."""
+        self.__event_time = time.time()
+        self.__event.set()
+
+    def add_trigger_pv(self, pv, condition=None):
+        """Every change of the PV value satisfying condition(value) (any change if None) triggers the next cycle."""
+        def on_change(pvname=None, value=None, **kwargs):
+            if condition is None or condition(value): self.trigger()
+
+        pv.add_callback(on_change)
+
+    def submit(self, function, *args, background=False, **kwargs):
+        """Post-processing task, executed while waiting for the next cycle (in a worker thread if background)."""
+        if background:
+            if self.__executor is None: self.__executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="post-processing")
+            self.__futures.append(self.__executor.submit(function, *args, **kwargs))
+        else:
+            self.__main_tasks.append((function, args, kwargs))
+
+    def cycles(self):
+        """Generator of the cycle numbers (1, 2, ...): every number is yielded at the start time of the cycle."""
+        origin = time.time()
+        for cycle in range(self.__n_cycles):
+            if cycle > 0:
+                deadline = None if self.__trigger_mode == TriggerMode.EVENT else origin + cycle * self.__period
+                wait_start, reference_time = self.__wait(deadline)
+
+                self.__jitters.append(time.time() - reference_time)
+                if not deadline is None and wait_start > deadline: # overrun: deadlines re-anchored to this cycle
+                    self.__n_overruns += 1
+                    origin = reference_time - cycle * self.__period
+
+                if self.__verbose: print(f"Cycle #{cycle + 1} started, jitter {self.__jitters[-1]:.3f} s")
+
+            yield cycle + 1
+
+    def __wait(self, deadline):
+        # time when the waiting started and time of the event or deadline that starts the cycle (not before the waiting)
+        wait_start = time.time()
+
+        if self.__verbose:
+            if deadline is None: print("Waiting for the trigger of the next cycle")
+            else:                print(f"Waiting for the next cycle ({max(deadline - wait_start, 0.0):.1f} s)")
+
+        while True:
+            if self.__trigger_mode != TriggerMode.PERIOD and self.__event.is_set():
+                self.__event.clear()
+                return wait_start, max(self.__event_time, wait_start)
+
+            now = time.time()
+            if not deadline is None and now >= deadline: return wait_start, max(deadline, wait_start)
+
+            if len(self.__main_tasks) > 0: self.__run_main_task()
+            else:
+                timeout = self.__poll_interval if deadline is None else min(self.__poll_interval, deadline - now)
+                if self.__trigger_mode == TriggerMode.PERIOD: time.sleep(timeout)
+                else:                                         self.__event.wait(timeout)
+
+    def __run_main_task(self):
+        function, args, kwargs = self.__main_tasks.popleft()
+        try:                   function(*args, **kwargs)
+        except Exception as e: print("Post-processing task failed: " + str(e))
+
+    def close(self, wait=True):
+        """Runs the pending main thread tasks and waits for the background tasks (wait=False: pending tasks dropped)."""
+        if wait:
+            while len(self.__main_tasks) > 0: self.__run_main_task()
+        else:
+            self.__main_tasks.clear()
+
+        if not self.__executor is None:
+            self.__executor.shutdown(wait=wait, cancel_futures=not wait)
+            self.__executor = None
+
+        for future in self.__futures:
+            if future.done() and not future.cancelled() and not future.exception() is None: print("Post-processing task failed: " + str(future.exception()))
+        self.__futures = []
+
+    def get_jitter_statistics(self):
+        """
+        Delays (seconds) of the start of the cycles after the first one, with respect to their deadline or trigger event
+        (or to the end of the previous cycle, if later). n_overruns: cycles started late because the previous one overran.
+        """
+        jitters = numpy.array(self.__jitters)
+        if len(jitters) == 0: return {"n_cycles": 0, "n_overruns": 0, "mean": 0.0, "std": 0.0, "max": 0.0}
+
+        return {"n_cycles": len(jitters), "n_overruns": self.__n_overruns, "mean": float(jitters.mean()), "std": float(jitters.std()), "max": float(jitters.max())}
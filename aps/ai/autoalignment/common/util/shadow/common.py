@@ -63,6 +63,8 @@ import scipy.constants as codata
 
 from aps.ai.autoalignment.common.util.common import get_peak_location_2D, plot_2D, Flip, PlotMode, AspectRatio, ColorMap, Histogram, calculate_projections_over_noise
 from aps.ai.autoalignment.common.util.gaussian_fit import calculate_2D_gaussian_fit
+from aps.ai.autoalignment.common.util.noise import NoiseGenerator
+from aps.ai.autoalignment.common.util.shadow.compact_beam import CompactBeam
 from aps.common.ml.data_structures import DictionaryWrapper
 from aps.common.ml.mocks import MockWidget
 
@@ -105,27 +107,36 @@ class HybridFailureException(Exception):
     def __init__(self, oe="OE"):
         super().__init__("Hybrid Algorithm failed for " + oe)
 
-def __generate_noise(hh, noise, percentage_fluctuation):
-    fluctuation = percentage_fluctuation*noise
-    hh += noise + 0.5*fluctuation - fluctuation*numpy.random.random(hh.shape)
+class EarlyAbortException(Exception):
+    def __init__(self, reason="pilot beam rejected"):
+        super().__init__("Ray-tracing aborted after the pilot trace: " + reason)
 
-def __get_arrays(shadow_beam, var_1, var_2, nbins_h=201, nbins_v=201, nolost=1, xrange=None, yrange=None, add_noise=False, noise=None, percentage_fluctuation=0.1):
-    ticket = shadow_beam._beam.histo2(var_1, var_2, nbins_h=nbins_h, nbins_v=nbins_v, nolost=nolost, xrange=xrange, yrange=yrange, calculate_widths=0)
+__default_noise_generator = NoiseGenerator()
 
-    if add_noise: __generate_noise(ticket["histogram"], noise, percentage_fluctuation)
+def __generate_noise(hh, noise, percentage_fluctuation, noise_generator=None):
+    if noise_generator is None: noise_generator = __default_noise_generator
+    noise_generator.add_noise(hh, noise, percentage_fluctuation)
+
+def __get_rays(shadow_beam):
+    return shadow_beam if isinstance(shadow_beam, CompactBeam) else shadow_beam._beam
+
+def __get_arrays(shadow_beam, var_1, var_2, nbins_h=201, nbins_v=201, nolost=1, xrange=None, yrange=None, add_noise=False, noise=None, percentage_fluctuation=0.1, noise_generator=None):
+    ticket = __get_rays(shadow_beam).histo2(var_1, var_2, nbins_h=nbins_h, nbins_v=nbins_v, nolost=nolost, xrange=xrange, yrange=yrange, calculate_widths=0)
+
+    if add_noise: __generate_noise(ticket["histogram"], noise, percentage_fluctuation, noise_generator)
 
     return ticket['bin_h_center'], ticket['bin_v_center'], ticket["histogram"]
 
 def __get_shadow_beam_distribution(shadow_beam, var_1, var_2, nbins_h=201, nbins_v=201, nolost=1, xrange=None, yrange=None, do_gaussian_fit=False,
-                                   add_noise=False, noise=None,  percentage_fluctuation=0.1, calculate_over_noise=False, noise_threshold=1.5):
-    ticket = shadow_beam._beam.histo2(var_1, var_2, nbins_h=nbins_h, nbins_v=nbins_v, nolost=nolost, xrange=xrange, yrange=yrange, calculate_widths=1)
+                                   add_noise=False, noise=None,  percentage_fluctuation=0.1, calculate_over_noise=False, noise_threshold=1.5, noise_generator=None):
+    ticket = __get_rays(shadow_beam).histo2(var_1, var_2, nbins_h=nbins_h, nbins_v=nbins_v, nolost=nolost, xrange=xrange, yrange=yrange, calculate_widths=1)
 
     hh   = ticket["histogram"]
     xx   = ticket['bin_h_center']
     yy   = ticket['bin_v_center']
 
     if add_noise:
-        __generate_noise(hh, noise, percentage_fluctuation)
+        __generate_noise(hh, noise, percentage_fluctuation, noise_generator)
 
         if calculate_over_noise:
             _, hh_h, hh_v = calculate_projections_over_noise(hh, noise_threshold)
@@ -170,9 +181,9 @@ def __get_shadow_beam_distribution(shadow_beam, var_1, var_2, nbins_h=201, nbins
 
 def plot_shadow_beam_distribution(shadow_beam, var_1, var_2, nbins_h=201, nbins_v=201, nolost=1, title="X,Z", xrange=None, yrange=None,
                                   plot_mode=PlotMode.INTERNAL, aspect_ratio=AspectRatio.AUTO, color_map=ColorMap.RAINBOW,
-                                  add_noise=False, noise=None, percentage_fluctuation=0.1, calculate_over_noise=False, noise_threshold=1.5):
+                                  add_noise=False, noise=None, percentage_fluctuation=0.1, calculate_over_noise=False, noise_threshold=1.5, noise_generator=None):
     if plot_mode in [PlotMode.INTERNAL, PlotMode.BOTH]:
-        x_array, y_array, z_array = __get_arrays(shadow_beam, var_1, var_2, nbins_h, nbins_v, nolost, xrange, yrange, add_noise, noise, percentage_fluctuation)
+        x_array, y_array, z_array = __get_arrays(shadow_beam, var_1, var_2, nbins_h, nbins_v, nolost, xrange, yrange, add_noise, noise, percentage_fluctuation, noise_generator)
 
         plot_2D(x_array, y_array, z_array, title, None, None,
                 int_um="", peak_um="", flip=Flip.VERTICAL, aspect_ratio=aspect_ratio, color_map=color_map,
@@ -180,19 +191,20 @@ def plot_shadow_beam_distribution(shadow_beam, var_1, var_2, nbins_h=201, nbins_
                 noise_threshold=noise_threshold)
 
     if plot_mode in [PlotMode.NATIVE, PlotMode.BOTH]:
+        if isinstance(shadow_beam, CompactBeam): raise ValueError("Native plot is not available for compact beams")
         Shadow.ShadowTools.plotxy(shadow_beam._beam, var_1, var_2, nbins_h=nbins_h, nbins_v=nbins_v, nolost=nolost, title=title, xrange=xrange, yrange=yrange)
 
 def get_shadow_beam_spatial_distribution(shadow_beam, nbins_h=201, nbins_v=201, nolost=1, xrange=None, yrange=None, do_gaussian_fit=False,
-                                         add_noise=False, noise=None, percentage_fluctuation=0.1, calculate_over_noise=False, noise_threshold=1.5):
-    return __get_shadow_beam_distribution(shadow_beam, 1, 3, nbins_h, nbins_v, nolost, xrange, yrange, do_gaussian_fit, add_noise, noise, percentage_fluctuation, calculate_over_noise, noise_threshold)
+                                         add_noise=False, noise=None, percentage_fluctuation=0.1, calculate_over_noise=False, noise_threshold=1.5, noise_generator=None):
+    return __get_shadow_beam_distribution(shadow_beam, 1, 3, nbins_h, nbins_v, nolost, xrange, yrange, do_gaussian_fit, add_noise, noise, percentage_fluctuation, calculate_over_noise, noise_threshold, noise_generator)
 
 def get_shadow_beam_divergence_distribution(shadow_beam, nbins_h=201, nbins_v=201, nolost=1, xrange=None, yrange=None, do_gaussian_fit=False):
     return __get_shadow_beam_distribution(shadow_beam, 4, 6, nbins_h, nbins_v, nolost, xrange, yrange, do_gaussian_fit)
 
 def plot_shadow_beam_spatial_distribution(shadow_beam, nbins_h=201, nbins_v=201, nolost=1, title="X,Z", xrange=None, yrange=None,
                                           plot_mode=PlotMode.INTERNAL, aspect_ratio=AspectRatio.AUTO, color_map=ColorMap.RAINBOW,
-                                          add_noise=False, noise=None, percentage_fluctuation=0.1, calculate_over_noise=False, noise_threshold=1.5):
-    plot_shadow_beam_distribution(shadow_beam, 1, 3, nbins_h, nbins_v, nolost, title, xrange, yrange, plot_mode, aspect_ratio, color_map, add_noise, noise, percentage_fluctuation, calculate_over_noise, noise_threshold)
+                                          add_noise=False, noise=None, percentage_fluctuation=0.1, calculate_over_noise=False, noise_threshold=1.5, noise_generator=None):
+    plot_shadow_beam_distribution(shadow_beam, 1, 3, nbins_h, nbins_v, nolost, title, xrange, yrange, plot_mode, aspect_ratio, color_map, add_noise, noise, percentage_fluctuation, calculate_over_noise, noise_threshold, noise_generator)
 
 def plot_shadow_beam_divergence_distribution(shadow_beam, nbins_h=201, nbins_v=201, nolost=1, title="X',Z'", xrange=None, yrange=None, plot_mode=PlotMode.INTERNAL, aspect_ratio=AspectRatio.AUTO, color_map=ColorMap.RAINBOW):
     plot_shadow_beam_distribution(shadow_beam, 4, 6, nbins_h, nbins_v, nolost, title, xrange, yrange, plot_mode, aspect_ratio, color_map)
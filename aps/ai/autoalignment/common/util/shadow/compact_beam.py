@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------- #
+# Copyright (c) 2021, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2021. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# ----------------------------------------------------------------------- #
+import numpy
+
+#############################################################################
+# Compact beam for the post-trace analysis:
+#
+# only the good rays and the SHADOW columns needed to compute histograms and
+# statistics are kept, optionally in single precision. 500k rays x 6 columns
+# in float32 are 12 MB, instead of the 72 MB of the full Nx18 float64 array.
+#
+
+DEFAULT_COLUMNS = (1, 3, 4, 6, 10, 23) # X, Z, X', Z', flag, intensity (SHADOW column numbers, 1-based)
+CAUSTIC_COLUMNS = (1, 2, 3, 4, 5, 6, 10, 23) # positions and direction cosines are needed to retrace the rays
+
+class CompactBeam():
+    def __init__(self, shadow_beam, columns=DEFAULT_COLUMNS, dtype=numpy.float32, remove_lost_rays=True):
+        if not 23 in columns: raise ValueError("Intensity (column 23) is needed for the weighted histograms")
+
+        beam = shadow_beam._beam
+
+        self.__columns          = tuple(columns)
+        self.__column_index     = {column: index for index, column in enumerate(self.__columns)}
+        self.__nrays_total      = beam.nrays(nolost=0)
+        self.__remove_lost_rays = remove_lost_rays
+
+        nolost = 1 if remove_lost_rays else 0
+
+        self.__data = numpy.empty((beam.nrays(nolost=nolost), len(self.__columns)), dtype=dtype)
+        for index, column in enumerate(self.__columns): self.__data[:, index] = beam.getshonecol(column, nolost=nolost)
+
+    @property
+    def columns(self): return self.__columns
+    @property
+    def dtype(self): return self.__data.dtype
+    @property
+    def nbytes(self): return self.__data.nbytes
+
+    def duplicate(self):
+        duplicate = CompactBeam.__new__(CompactBeam)
+        duplicate.__dict__.update(self.__dict__)
+        duplicate.__data = self.__data.copy()
+
+        return duplicate
+
+    def retrace(self, distance):
+        """
+        Beam at the plane at the given distance along Y from the origin of the current reference frame
+        (the image plane), as Shadow.Beam.retrace: rays are straight lines after the last element.
+        """
+        for column in (1, 2, 3, 4, 5, 6):
+            if not column in self.__column_index: raise ValueError("Column " + str(column) + " needed to retrace the compact beam " + str(self.__columns))
+
+        x, y, z, vx, vy, vz = (self.__data[:, self.__column_index[column]] for column in (1, 2, 3, 4, 5, 6))
+
+        time_of_flight = (distance - y) / vy
+
+        retraced_beam = CompactBeam.__new__(CompactBeam)
+        retraced_beam.__dict__.update(self.__dict__)
+        retraced_beam.__data = self.__data.copy()
+        retraced_beam.__data[:, self.__column_index[1]] = x + time_of_flight * vx
+        retraced_beam.__data[:, self.__column_index[2]] = distance
+        retraced_beam.__data[:, self.__column_index[3]] = z + time_of_flight * vz
+
+        return retraced_beam
+
+    def reweight(self, weights):
+        """
+        Copy of the beam with the intensity of every stored ray multiplied by the given weight
+        (e.g. Poisson(1) weights for a bootstrap replicate of the beam).
+        """
+        weights = numpy.asarray(weights)
+        if weights.shape != (self.__data.shape[0],): raise ValueError("One weight per stored ray is needed: " + str(self.__data.shape[0]))
+
+        reweighted_beam = self.duplicate()
+        reweighted_beam.__data[:, self.__column_index[23]] *= weights
+
+        return reweighted_beam
+
+    # same signatures and semantics of Shadow.Beam, for the methods used in the analysis
+
+    def nrays(self, nolost=0):
+        if nolost == 0: return self.__nrays_total
+        else:           return self.__data[self.__get_good_cursor(nolost)].shape[0]
+
+    def getshonecol(self, col, nolost=0):
+        try:    index = self.__column_index[col]
+        except KeyError: raise ValueError("Column " + str(col) + " not stored in the compact beam " + str(self.__columns))
+
+        return self.__data[self.__get_good_cursor(nolost), index].astype(numpy.float64)
+
+    def getshcol(self, cols, nolost=0):
+        return tuple(self.getshonecol(col, nolost) for col in cols)
+
+    def intensity(self, nolost=0):
+        return numpy.sum(self.getshonecol(23, nolost))
+
+    def get_good_range(self, icol, nolost=0):
+        col = self.getshonecol(icol, nolost=nolost)
+        if col.size == 0: return [-1, 1]
+
+        rmin = numpy.min(col)
+        rmax = numpy.max(col)
+        rmin = rmin * 0.95 if rmin > 0.0 else rmin * 1.05
+        rmax = rmax * 0.95 if rmax < 0.0 else rmax * 1.05
+
+        if rmin == rmax:
+            rmin = rmin * 0.95
+            rmax = rmax * 1.05
+            if rmin == 0.0: rmin, rmax = -1.0, 1.0
+
+        return [rmin, rmax]
+
+    def histo2(self, col_h, col_v, nbins=25, ref=23, nbins_h=None, nbins_v=None, nolost=0, xrange=None, yrange=None, calculate_widths=1):
+        if nbins_h is None: nbins_h = nbins
+        if nbins_v is None: nbins_v = nbins
+
+        col1, col2 = self.getshcol((col_h, col_v), nolost=nolost)
+        weights    = numpy.ones(len(col1)) if ref in (None, 0, "No") else self.getshonecol(23 if ref == "Yes" else ref, nolost=nolost)
+
+        if xrange is None: xrange = self.get_good_range(col_h, nolost=nolost)
+        if yrange is None: yrange = self.get_good_range(col_v, nolost=nolost)
+
+        hh, xx, yy = numpy.histogram2d(col1, col2, bins=[nbins_h, nbins_v], range=[xrange, yrange], weights=weights)
+
+        ticket = {'error': 0, 'col_h': col_h, 'col_v': col_v, 'nolost': nolost, 'nbins_h': nbins_h, 'nbins_v': nbins_v, 'ref': ref,
+                  'xrange': xrange, 'yrange': yrange,
+                  'bin_h_edges': xx, 'bin_v_edges': yy,
+                  'bin_h_left': xx[:-1], 'bin_v_left': yy[:-1], 'bin_h_right': xx[1:], 'bin_v_right': yy[1:],
+                  'bin_h_center': 0.5 * (xx[:-1] + xx[1:]), 'bin_v_center': 0.5 * (yy[:-1] + yy[1:]),
+                  'histogram': hh, 'histogram_h': hh.sum(axis=1), 'histogram_v': hh.sum(axis=0),
+                  'intensity': self.intensity(nolost=nolost),
+                  'nrays': self.nrays(nolost=0), 'good_rays': self.nrays(nolost=1)}
+
+        if calculate_widths > 0:
+            for direction in ["h", "v"]:
+                histogram  = ticket['histogram_' + direction]
+                bin_center = ticket['bin_' + direction + '_center']
+                cursor     = numpy.where(histogram >= numpy.max(histogram) * 0.5)
+
+                if histogram[cursor].size > 1:
+                    ticket['fwhm_' + direction]             = (bin_center[1] - bin_center[0]) * (cursor[0][-1] - cursor[0][0])
+                    ticket['fwhm_coordinates_' + direction] = (bin_center[cursor[0][0]], bin_center[cursor[0][-1]])
+                else:
+                    ticket['fwhm_' + direction] = None
+
+        return ticket
+
+    def __get_good_cursor(self, nolost): # nolost: 0 all rays, 1 good rays only, 2 lost rays only
+        if nolost == 0: return slice(None)
+        if self.__remove_lost_rays: return slice(None) if nolost == 1 else slice(0, 0)
+        if not 10 in self.__column_index: raise ValueError("Flag column (10) not stored in the compact beam")
+
+        flag = self.__data[:, self.__column_index[10]]
+
+        return flag == 1 if nolost == 1 else flag != 1
+
+def compact_beam(shadow_beam, dtype=numpy.float32, columns=DEFAULT_COLUMNS, validate=False, tolerance=1e-3, **histogram_kwargs):
+    """
+    Compact copy of the beam. With validate=True, the spatial and divergence histograms (with the given
+    nbins_h, nbins_v, xrange, yrange) and their statistics are compared with the ones of the full beam, and
+    a ValueError is raised if the relative difference exceeds the tolerance.
+    """
+    output_beam = CompactBeam(shadow_beam, columns=columns, dtype=dtype)
+
+    if validate:
+        errors = get_compact_beam_errors(shadow_beam, output_beam, **histogram_kwargs)
+        if max(errors.values()) > tolerance: raise ValueError("Compact beam out of tolerance (" + str(tolerance) + "): " + str(errors))
+
+    return output_beam
+
+def get_compact_beam_errors(shadow_beam, compact_beam, nbins_h=201, nbins_v=201, xrange=None, yrange=None):
+    """Relative differences of histograms and statistics computed on the full and on the compact beam."""
+    errors = {}
+
+    for label, (col_h, col_v) in {"spatial": (1, 3), "divergence": (4, 6)}.items():
+        if not (col_h in compact_beam.columns and col_v in compact_beam.columns): continue
+
+        # same ranges on both beams: the automatic range of the float32 data could differ by one ulp
+        ranges = [xrange if label == "spatial" else None, yrange if label == "spatial" else None]
+        if ranges[0] is None: ranges[0] = shadow_beam._beam.get_good_range(col_h, nolost=1)
+        if ranges[1] is None: ranges[1] = shadow_beam._beam.get_good_range(col_v, nolost=1)
+
+        full    = shadow_beam._beam.histo2(col_h, col_v, nbins_h=nbins_h, nbins_v=nbins_v, nolost=1, xrange=ranges[0], yrange=ranges[1], calculate_widths=1)
+        compact = compact_beam.histo2(col_h, col_v, nbins_h=nbins_h, nbins_v=nbins_v, nolost=1, xrange=ranges[0], yrange=ranges[1], calculate_widths=1)
+
+        scale = max(numpy.sum(numpy.abs(full['histogram'])), 1e-30)
+        errors[label + "_histogram"] = float(numpy.sum(numpy.abs(full['histogram'] - compact['histogram'])) / scale)
+        errors[label + "_intensity"] = float(abs(full['intensity'] - compact['intensity']) / max(abs(full['intensity']), 1e-30))
+
+        for direction in ["h", "v"]:
+            bin_center = full['bin_' + direction + '_center']
+            bin_size   = abs(bin_center[1] - bin_center[0]) if len(bin_center) > 1 else 1.0
+            extent     = max(abs(bin_center[-1] - bin_center[0]), 1e-30)
+
+            # FWHM is quantized on the bins: one bin of difference is the resolution of the measure
+            fwhm_full, fwhm_compact = full['fwhm_' + direction], compact['fwhm_' + direction]
+            if not (fwhm_full is None or fwhm_compact is None):
+                errors[label + "_fwhm_" + direction] = float(max(abs(fwhm_full - fwhm_compact) - bin_size, 0.0) / extent)
+
+            histogram_full    = full['histogram_' + direction]
+            histogram_compact = compact['histogram_' + direction]
+            if histogram_full.sum() > 0 and histogram_compact.sum() > 0:
+                errors[label + "_centroid_" + direction] = float(abs(numpy.average(bin_center, weights=histogram_full) -
+                                                                     numpy.average(bin_center, weights=histogram_compact)) / extent)
+
+    return errors
+
+def compact_beam_caustic(shadow_beam, distances, dtype=numpy.float64, remove_lost_rays=True):
+    """
+    Compact beams at the planes at the given distances from the image plane (units of the beam), from a single
+    trace: once the rays leave the last element, moving the screen is a linear operation on the rays.
+    """
+    if not isinstance(shadow_beam, CompactBeam): shadow_beam = CompactBeam(shadow_beam, columns=CAUSTIC_COLUMNS, dtype=dtype, remove_lost_rays=remove_lost_rays)
+
+    return [shadow_beam.retrace(distance) for distance in distances]
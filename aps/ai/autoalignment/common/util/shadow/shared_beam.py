@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------- #
+# Copyright (c) 2021, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2021. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+import sys
+import warnings
+import weakref
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy
+import Shadow
+
+from orangecontrib.shadow.util.shadow_objects import ShadowBeam, ShadowOpticalElement, ShadowOEHistoryItem
+
+from aps.ai.autoalignment.common.util.shadow.common import load_shadow_beam
+from aps.ai.autoalignment.common.simulation.shadow.chunked_tracing import _get_oe_parameters
+
+#############################################################################
+# Shared-memory beam transport:
+#
+# The rays of a beam (usually the primary optics output beam) are copied once
+# in a shared memory segment by the publishing process. The workers receive a
+# small picklable descriptor and map the segment read-only, so neither the
+# loading time nor the memory of the rays scale with the number of workers.
+# The last history item of the beam (the parameters of the OE that produced
+# it) travels with the descriptor.
+#
+# The publisher owns the segment: it has to be released with close() (or by
+# using the SharedBeam as a context manager). Segments garbage collected or
+# still alive at exit are released anyway, with a ResourceWarning.
+#
+
+class SharedBeamDescriptor():
+    def __init__(self, name, shape, dtype, oe_number=0, history_item=None):
+        self.name         = name
+        self.shape        = tuple(shape)
+        self.dtype        = numpy.dtype(dtype).str
+        self.oe_number    = oe_number
+        self.history_item = history_item # OE parameters and widget of the last history item, when available
+
+    def __repr__(self): return "SharedBeamDescriptor(name=" + self.name + ", shape=" + str(self.shape) + ", dtype=" + self.dtype + ")"
+
+_published_segments = {} # name -> shared memory, in the publishing process
+_attached_segments  = {} # name -> shared memory, in the workers
+
+def get_published_shared_beams():
+    return list(_published_segments.keys())
+
+def get_attached_shared_beams():
+    return list(_attached_segments.keys())
+
+def _release_segment(name, leaked=False):
+    shared_memory = _published_segments.pop(name, None)
+
+    if not shared_memory is None:
+        if leaked: warnings.warn("Shared beam " + name + " was not closed explicitly, releasing it", ResourceWarning)
+
+        try:    shared_memory.close()
+        except BufferError: pass # views still alive in this process: the mapping goes away with them
+        try:    shared_memory.unlink()
+        except FileNotFoundError: pass
+
+def _get_history_item_state(shadow_beam):
+    try:    history_item = shadow_beam.getOEHistory(-1)
+    except: history_item = None
+
+    if history_item is None or history_item._shadow_oe_start is None or history_item._shadow_oe_end is None: return None
+    else: return {"oe_start"          : _get_oe_parameters(history_item._shadow_oe_start),
+                  "oe_end"            : _get_oe_parameters(history_item._shadow_oe_end),
+                  "widget_class_name" : history_item._widget_class_name}
+
+def _rebuild_history_item(history_item_state, oe_number):
+    def rebuild_oe(oe_parameters):
+        shadow_oe = Shadow.OE()
+        for name, value in oe_parameters.items(): setattr(shadow_oe, name, value)
+        return ShadowOpticalElement(shadow_oe)
+
+    return ShadowOEHistoryItem(oe_number=oe_number,
+                               shadow_oe_start=rebuild_oe(history_item_state["oe_start"]),
+                               shadow_oe_end=rebuild_oe(history_item_state["oe_end"]),
+                               widget_class_name=history_item_state["widget_class_name"])
+
+class SharedBeam():
+    def __init__(self, shadow_beam, remove_lost_rays=True):
+        rays = shadow_beam._beam.rays
+
+        if remove_lost_rays:
+            rays = rays[numpy.where(rays[:, 9] == 1)]
+            rays[:, 11] = numpy.arange(1, rays.shape[0] + 1, 1)
+
+        self.__shared_memory = SharedMemory(create=True, size=max(rays.nbytes, 1))
+        _published_segments[self.__shared_memory.name] = self.__shared_memory
+
+        shared_rays = numpy.ndarray(rays.shape, dtype=rays.dtype, buffer=self.__shared_memory.buf)
+        shared_rays[:] = rays
+        del shared_rays
+
+        self.__descriptor = SharedBeamDescriptor(name=self.__shared_memory.name,
+                                                 shape=rays.shape,
+                                                 dtype=rays.dtype,
+                                                 oe_number=shadow_beam._oe_number,
+                                                 history_item=_get_history_item_state(shadow_beam))
+        self.__finalizer = weakref.finalize(self, _release_segment, self.__shared_memory.name, True)
+
+    @classmethod
+    def from_file(cls, file_name="primary_optics_system_beam.dat", remove_lost_rays=True):
+        return SharedBeam(load_shadow_beam(file_name), remove_lost_rays=remove_lost_rays)
+
+    @property
+    def descriptor(self): return self.__descriptor
+
+    @property
+    def name(self): return self.__descriptor.name
+
+    @property
+    def nbytes(self): return int(numpy.prod(self.__descriptor.shape)) * numpy.dtype(self.__descriptor.dtype).itemsize
+
+    def is_closed(self): return not self.__finalizer.alive
+
+    def close(self):
+        if self.__finalizer.alive:
+            self.__finalizer.detach()
+            _release_segment(self.__descriptor.name)
+
+    def __enter__(self): return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb): self.close()
+
+def attach_shared_beam(descriptor : SharedBeamDescriptor, history=True):
+    """
+    Maps a published beam in the current process. The rays are read-only: the
+    focusing optics copy them before any modification (e.g. perturbations).
+    With history, the last history item of the published beam is rebuilt.
+    """
+    try:
+        shared_memory = _attached_segments[descriptor.name]
+    except KeyError:
+        if descriptor.name in _published_segments: # same process of the publisher
+            shared_memory = _published_segments[descriptor.name]
+        else:
+            # before 3.13 attaching registers the segment to the resource tracker too. Workers spawned by
+            # multiprocessing share the tracker of the publisher, an independent process starts its own,
+            # which would destroy the segment at exit: the publisher owns it.
+            own_tracker   = getattr(resource_tracker._resource_tracker, "_fd", None) is None
+            shared_memory = SharedMemory(name=descriptor.name)
+            if own_tracker and sys.version_info < (3, 13): resource_tracker.unregister(shared_memory._name, "shared_memory")
+        _attached_segments[descriptor.name] = shared_memory
+
+    rays = numpy.ndarray(descriptor.shape, dtype=numpy.dtype(descriptor.dtype), buffer=shared_memory.buf)
+    rays.flags.writeable = False
+
+    shadow_beam = ShadowBeam(oe_number=descriptor.oe_number, beam=Shadow.Beam())
+    shadow_beam._beam.rays = rays
+
+    if history and not descriptor.history_item is None:
+        shadow_beam.history = [None]*descriptor.oe_number + [_rebuild_history_item(descriptor.history_item, descriptor.oe_number)]
+
+    return shadow_beam
+
+def detach_shared_beam(descriptor : SharedBeamDescriptor):
+    """
+    To be called when the beams mapped from the descriptor are no longer referenced.
+    """
+    shared_memory = _attached_segments.pop(descriptor.name, None)
+
+    if not shared_memory is None and not descriptor.name in _published_segments:
+        try:    shared_memory.close()
+        except BufferError: warnings.warn("Shared beam " + descriptor.name + " still in use, detach postponed", ResourceWarning)
+
+def is_shared_beam(shadow_beam):
+    return not shadow_beam._beam.rays.flags.writeable
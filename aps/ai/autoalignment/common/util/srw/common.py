@@ -47,6 +47,7 @@
 import os
 import numpy
 import pickle
+import importlib
 from srxraylib.metrology import dabam
 from oasys.util.error_profile_util import DabamInputParameters, calculate_dabam_profile
 from orangecontrib.srw.util.srw_util import write_error_profile_file
@@ -88,19 +89,78 @@ def plot_srw_wavefront_spatial_distribution(srw_wavefront, title="X,Z", xrange=N
         uti_plot2d1d(arI, plotMeshx, plotMeshy, labels=['Horizontal Position [mm]', 'Vertical Position [mm]', title])
         uti_plot_show()
 
-def save_srw_wavefront(srw_wavefront, file_name="srw_wavefront.dat"):
-    out_s = open(os.path.join(os.getcwd(),  file_name), 'wb')
-    pickle.dump(srw_wavefront, out_s)
-    out_s.flush()
-    out_s.close()
+BINARY_WAVEFRONT_FORMAT_VERSION = 1
+
+def save_srw_wavefront(srw_wavefront, file_name="srw_wavefront.dat", binary=False, compressed=False):
+    if binary: save_srw_wavefront_binary(srw_wavefront, file_name, compressed)
+    else:
+        out_s = open(os.path.join(os.getcwd(),  file_name), 'wb')
+        pickle.dump(srw_wavefront, out_s)
+        out_s.flush()
+        out_s.close()
 
 def load_srw_wavefront(file_name="srw_wavefront.dat"):
+    if __is_binary_wavefront_file(file_name): return load_srw_wavefront_binary(file_name)
+
     in_s = open(os.path.join(os.getcwd(), file_name), 'rb')
     srw_wavefront = pickle.load(in_s)
     in_s.close()
 
     return srw_wavefront
 
+#
+# Binary format: the electric field arrays (and any other flat array of the wavefront) are stored as raw numeric
+# arrays in a numpy archive, while the few scalar/small attributes (mesh, electron beam, radii, etc.) are stored
+# as a single small pickled blob. Loading does not need to re-parse the whole object graph, and the field arrays
+# keep their native SRW precision (float32 by default) instead of being pickled element by element.
+#
+def save_srw_wavefront_binary(srw_wavefront, file_name="srw_wavefront.npz", compressed=False):
+    arrays     = {}
+    attributes = {}
+
+    for name, value in vars(srw_wavefront).items():
+        if isinstance(value, array):           arrays["array_" + name]   = numpy.frombuffer(value, dtype=numpy.dtype(value.typecode))
+        elif isinstance(value, numpy.ndarray): arrays["ndarray_" + name] = value
+        else:                                  attributes[name] = value
+
+    header = {"version"    : BINARY_WAVEFRONT_FORMAT_VERSION,
+              "class"      : (type(srw_wavefront).__module__, type(srw_wavefront).__qualname__),
+              "typecodes"  : {name: value.typecode for name, value in vars(srw_wavefront).items() if isinstance(value, array)},
+              "attributes" : attributes}
+
+    arrays["header"] = numpy.frombuffer(pickle.dumps(header, protocol=pickle.HIGHEST_PROTOCOL), dtype=numpy.uint8)
+
+    with open(os.path.join(os.getcwd(), file_name), 'wb') as out_s:
+        if compressed: numpy.savez_compressed(out_s, **arrays)
+        else:          numpy.savez(out_s, **arrays)
+
+def load_srw_wavefront_binary(file_name="srw_wavefront.npz"):
+    with numpy.load(os.path.join(os.getcwd(), file_name), allow_pickle=False) as data:
+        header = pickle.loads(data["header"].tobytes())
+
+        if header["version"] > BINARY_WAVEFRONT_FORMAT_VERSION: raise ValueError("Binary wavefront format version not supported: " + str(header["version"]))
+
+        module_name, class_name = header["class"]
+        wavefront_class = importlib.import_module(module_name)
+        for name in class_name.split("."): wavefront_class = getattr(wavefront_class, name)
+
+        srw_wavefront = wavefront_class.__new__(wavefront_class)
+        srw_wavefront.__dict__.update(header["attributes"])
+
+        for key in data.files:
+            if key.startswith("array_"):
+                name = key[len("array_"):]
+                values = array(header["typecodes"][name])
+                values.frombytes(data[key].tobytes())
+                setattr(srw_wavefront, name, values)
+            elif key.startswith("ndarray_"):
+                setattr(srw_wavefront, key[len("ndarray_"):], data[key])
+
+    return srw_wavefront
+
+def __is_binary_wavefront_file(file_name):
+    with open(os.path.join(os.getcwd(), file_name), 'rb') as in_s: return in_s.read(4) == b"PK\x03\x04" # zip archive (numpy .npz)
+
 def write_dabam_file(figure_error_rms=None, dabam_entry_number=20, heigth_profile_file_name="KB.dat", seed=8787):
     server = dabam.dabam()
     server.set_input_silent(True)
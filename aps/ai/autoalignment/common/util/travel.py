@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------- #
+# Copyright (c) 2021, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2021. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# ----------------------------------------------------------------------- #
+import numpy
+
+#############################################################################
+# Travel-aware scheduling:
+#
+# on the hardware every measurement pays the motion and settle time of the
+# motors, moved one after the other (movers.move_motors). The time of a move
+# is modelled per motor as
+#
+#   t = settle_time + |distance| / velocity    (0 if the motor does not move)
+#
+# and the travel time between two positions is the sum over the motors (the
+# maximum for simultaneous moves). Pending points (enqueued trials, scans) are
+# measured in the order with the shortest total travel: nearest neighbour
+# path from the current position, improved by 2-opt exchanges. The samplers
+# can also discount the acquisition value by the travel time from the current
+# position (see BoTorchSampler, travel_time_model).
+#
+
+MAX_2OPT_POINTS = 500 # above, only the nearest neighbour path (the 2-opt needs the full time matrix)
+
+class MotorTravelModel():
+    """Move time of a motor: settle_time + |distance| / velocity, velocity in units of the motor per second."""
+    def __init__(self, velocity, settle_time=0.0):
+        if velocity <= 0: raise ValueError("The velocity must be positive")
+
+        self.velocity    = velocity
+        self.settle_time = settle_time
+
+    def get_move_time(self, distance):
+        distance = numpy.abs(distance)
+
+        return numpy.where(distance > 0, self.settle_time + distance / self.velocity, 0.0)
+
+class TravelTimeModel():
+    """
+    Travel time between positions of the motors (arrays ordered as motors), with one MotorTravelModel per motor name:
+    motors without a model do not contribute. The motors move one after the other, unless simultaneous=True.
+    """
+    def __init__(self, motor_models, simultaneous=False):
+        self.motor_models = dict(motor_models)
+        self.simultaneous = simultaneous
+
+    def get_travel_time(self, motors, start, end):
+        """Travel time(s) from start to end, arrays (..., motors) (broadcast)."""
+        start = numpy.asarray(start, dtype=float)
+        end   = numpy.asarray(end, dtype=float)
+
+        move_times = [self.motor_models[motor].get_move_time(end[..., index] - start[..., index]) for index, motor in enumerate(motors) if motor in self.motor_models]
+        if len(move_times) == 0: return numpy.zeros(numpy.broadcast_shapes(start.shape, end.shape)[:-1])
+
+        return numpy.max(move_times, axis=0) if self.simultaneous else numpy.sum(move_times, axis=0)
+
+    def get_path_time(self, motors, positions, start=None):
+        """Total travel time of the positions measured in order (from start, if given)."""
+        positions = numpy.atleast_2d(numpy.asarray(positions, dtype=float))
+        if not start is None: positions = numpy.vstack([numpy.asarray(start, dtype=float), positions])
+
+        return float(numpy.sum(self.get_travel_time(motors, positions[:-1], positions[1:])))
+
+def get_default_travel_time_model(movement_ranges, full_range_time=1.0, settle_time=0.0):
+    """
+    Model without measured velocities: every motor crosses its movement range (dictionary motor: [min, max], e.g.
+    configs.DEFAULT_MOVEMENT_RANGES) in full_range_time, i.e. the travel is measured in fractions of the ranges.
+    """
+    return TravelTimeModel({motor: MotorTravelModel(velocity=abs(movement_range[1] - movement_range[0]) / full_range_time, settle_time=settle_time)
+                            for motor, movement_range in movement_ranges.items() if movement_range[1] != movement_range[0]})
+
+def get_travel_order(travel_time_model, motors, positions, start=None):
+    """
+    Order of the positions (array (points, motors)) that shortens the total travel time from start (the first point if
+    not given): nearest neighbour path, improved by 2-opt segment reversals. Returns the list of the indexes.
+    """
+    positions = numpy.atleast_2d(numpy.asarray(positions, dtype=float))
+    n_points  = len(positions)
+    if n_points < 2: return list(range(n_points))
+
+    if start is None: order, current = [0], positions[0]
+    else:             order, current = [], numpy.asarray(start, dtype=float)
+
+    visited = numpy.zeros(n_points, dtype=bool)
+    visited[order] = True
+    while len(order) < n_points:
+        times          = travel_time_model.get_travel_time(motors, current, positions)
+        times[visited] = numpy.inf
+        index          = int(numpy.argmin(times))
+        visited[index] = True
+        order.append(index)
+        current = positions[index]
+
+    if n_points > MAX_2OPT_POINTS: return order
+
+    # path nodes: the start (if given) followed by the points, in the current order
+    nodes = positions[order] if start is None else numpy.vstack([numpy.asarray(start, dtype=float), positions[order]])
+    times = travel_time_model.get_travel_time(motors, nodes[:, numpy.newaxis, :], nodes[numpy.newaxis, :, :])
+    path  = list(range(len(nodes)))
+
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, len(path) - 1):
+            for j in range(i + 1, len(path)):
+                # reversal of path[i:j+1]: the first node of the path is fixed, the last one is free (open path)
+                delta = times[path[i - 1], path[j]] - times[path[i - 1], path[i]]
+                if j + 1 < len(path): delta += times[path[i], path[j + 1]] - times[path[j], path[j + 1]]
+                if delta < -1e-12:
+                    path[i:j + 1] = path[i:j + 1][::-1]
+                    improved      = True
+
+    if start is None: return [order[node] for node in path]
+    else:             return [order[node - 1] for node in path[1:]]
@@ -84,6 +84,7 @@ def get_distribution_info(implementor, beam, xrange=None, yrange=None, do_gaussi
         percentage_fluctuation = kwargs.get("percentage_fluctuation", 10.0) * 1e-2
         calculate_over_noise   = kwargs.get("calculate_over_noise", False)
         noise_threshold        = kwargs.get("noise_threshold", 1.5)
+        noise_generator        = kwargs.get("noise_generator", None)
 
         if kwargs.get("distribution") == "divergence": return get_shadow_beam_divergence_distribution(shadow_beam=beam,
                                                                                                       nbins_h=nbins_h, nbins_v=nbins_v,
@@ -99,7 +100,8 @@ def get_distribution_info(implementor, beam, xrange=None, yrange=None, do_gaussi
                                                                                                    noise=noise,
                                                                                                    percentage_fluctuation=percentage_fluctuation,
                                                                                                    calculate_over_noise=calculate_over_noise,
-                                                                                                   noise_threshold=noise_threshold)
+                                                                                                   noise_threshold=noise_threshold,
+                                                                                                   noise_generator=noise_generator)
 
 def plot_distribution(implementor, beam, title="X,Z", xrange=None, yrange=None, plot_mode=PlotMode.INTERNAL, aspect_ratio=AspectRatio.AUTO, color_map=ColorMap.RAINBOW, **kwargs):
     if implementor == Implementors.SRW: plot_srw_wavefront_spatial_distribution(beam, title, xrange, yrange, plot_mode, aspect_ratio, color_map)
@@ -112,6 +114,7 @@ def plot_distribution(implementor, beam, title="X,Z", xrange=None, yrange=None,
         percentage_fluctuation = kwargs.get("percentage_fluctuation", 10.0) * 1e-2
         calculate_over_noise   = kwargs.get("calculate_over_noise", False)
         noise_threshold        = kwargs.get("noise_threshold", 1.5)
+        noise_generator        = kwargs.get("noise_generator", None)
 
         if kwargs.get("distribution") == "divergence": plot_shadow_beam_divergence_distribution(shadow_beam=beam,
                                                                                                 nbins_h=nbins_h, nbins_v=nbins_v,
@@ -133,4 +136,5 @@ def plot_distribution(implementor, beam, title="X,Z", xrange=None, yrange=None,
                                                                                              noise=noise,
                                                                                              percentage_fluctuation=percentage_fluctuation,
                                                                                              calculate_over_noise=calculate_over_noise,
-                                                                                             noise_threshold=noise_threshold)
+                                                                                             noise_threshold=noise_threshold,
+                                                                                             noise_generator=noise_generator)